@@ -1,8 +1,7 @@
 import os
 import threading
 
-from time import sleep
-from flask import Flask, session, render_template, request, jsonify, flash, redirect, url_for
+from flask import Flask, Response, session, render_template, request, jsonify, flash, redirect, url_for
 from flask_wtf import FlaskForm
 from wtforms import (
     IntegerField,
@@ -14,14 +13,24 @@ from wtforms import (
 )
 from wtforms.validators import NumberRange
 
-from utils.stream import LiveStreamer
-from utils.config import load_settings, update_settings
+from utils.manager import StreamManager
+from utils.config import RESOLUTION_CHOICES, load_settings, update_settings
 from utils.image_processing import generate_image
+from utils.metrics import REGISTRY
+from utils.preview import MJPEG_BOUNDARY, PREVIEW_FORMATS
+from utils.stream_state import ACTIVE_STATES, stream_states
 
 app = Flask(__name__)
 app.config["SECRET_KEY"] = os.urandom(24)
 
-streamer = None
+# 描画プロセスはspawnで起動され、このファイルを__mp_main__として読み込み直すので、
+# モジュールの読み込み時には配信の管理の作成（スレッドも通信も行わない）以外の処理をしない
+manager = StreamManager()
+
+
+def primary_stream_id():
+    # 画面のボタンで操作する配信（指定がなければstreamsの先頭）
+    return request.args.get("stream") or manager.stream_ids()[0]
 
 class DisplaySettingsForm(FlaskForm):
     lower_text = StringField("下部テキスト")
@@ -44,17 +53,24 @@ class StreamSettingsForm(FlaskForm):
         ],
     )
     interval = IntegerField("インターバル（秒）", validators=[NumberRange(min=1)])
-    resolution = SelectField(
-        "解像度",
+    resolution = SelectField("解像度", choices=RESOLUTION_CHOICES)
+    fps = IntegerField("FPS", validators=[NumberRange(min=1)])
+    ingest_mode = SelectField(
+        "ffmpegへの入力方式",
         choices=[
-            ("1920x1080", "1080p"),
-            ("1280x720", "720p"),
-            ("854x480", "480p"),
-            ("640x360", "360p"),
-            ("426x240", "240p"),
+            ("full", "出力FPSで書き込む"),
+            ("low_rate", "低レートで書き込みffmpegで複製する"),
+        ],
+    )
+    encoder_profile = SelectField(
+        "エンコーダープロファイル",
+        choices=[
+            ("auto", "自動"),
+            ("eco", "省電力"),
+            ("balanced", "標準"),
+            ("quality", "高画質"),
         ],
     )
-    fps = IntegerField("FPS", validators=[NumberRange(min=1)])
     submit = SubmitField("設定を保存")
 
 @app.route('/static/<path:filename>')
@@ -63,7 +79,6 @@ def static_files(filename):
 
 @app.route("/")
 def index():
-    global streamer
     settings = load_settings()
     display_form = DisplaySettingsForm(
         lower_text=settings.get("lower_text", "画面下部に表示するテキスト"),
@@ -79,15 +94,17 @@ def index():
         interval=settings.get("interval", 5),
         resolution=settings.get("resolution", "1920x1080"),
         fps=settings.get("fps", 30),
+        ingest_mode=settings.get("ingest_mode", "full"),
+        encoder_profile=settings.get("encoder_profile", "auto"),
     )
     stream_settings = settings
     display_settings = settings
 
-    stream_url = None
-    stream_exsists = streamer._is_running if streamer else False
-    if stream_exsists:
-        sleep(10)
-        stream_url = "https://www.youtube.com/watch?v=" + streamer.youtube_broadcast_id
+    stream_id = primary_stream_id()
+    # 状態の変化は/eventsで画面に届くので、ここでは現在の状態をそのまま表示する
+    stream_state = manager.status(stream_id)
+    stream_exsists = stream_state["state"] in ACTIVE_STATES
+    stream_url = stream_state.get("watch_url") if stream_exsists else None
     return render_template(
         "index.html",
         display_form=display_form,
@@ -95,39 +112,107 @@ def index():
         stream_settings=stream_settings,
         display_settings=display_settings,
         stream_exsists=stream_exsists,
-        stream_url=stream_url
+        stream_url=stream_url,
+        stream_id=stream_id,
+        stream_state=stream_state,
+        streams=manager.status(),
     )
 
 @app.route('/start_stream', methods=['GET'])
 def start_stream():
-    global streamer
-    global streamer_thread
-    if streamer is None or not streamer._is_running:
-        streamer = LiveStreamer()
-        streamer_thread = threading.Thread(target=streamer.start_streaming, daemon=True)
-        streamer_thread.start()
-        flash(f"ライブ配信が開始されました", "success")
-        return redirect(url_for('index'))
-    else:
-        flash("ライブ配信はすでに実行中です", "danger")
-        return redirect(url_for('index'))
+    return start_stream_by_id(primary_stream_id())
 
 @app.route('/stop_stream', methods=['GET'])
 def stop_stream():
-    global streamer
-    global streamer_thread
-    if streamer and streamer._is_running:
-        streamer.stop_streaming()
-        # スレッドの終了を待機 (オプション)
-        if streamer_thread and streamer_thread.is_alive():
-            streamer_thread.join(timeout=10)
-        streamer = None
-        streamer_thread = None
-        flash("ライブ配信が停止されました", "success")
-        return redirect(url_for('index'))
+    return stop_stream_by_id(primary_stream_id())
+
+@app.route('/streams/<stream_id>/start', methods=['GET'])
+def start_stream_by_id(stream_id):
+    if stream_id not in manager.stream_ids():
+        flash(f"配信 {stream_id} は設定されていません", "danger")
+    elif manager.start(stream_id):
+        flash(f"ライブ配信 ({stream_id}) の開始処理を始めました", "success")
+    else:
+        flash(f"ライブ配信 ({stream_id}) はすでに実行中です", "danger")
+    return redirect(url_for('index', stream=stream_id))
+
+@app.route('/streams/<stream_id>/stop', methods=['GET'])
+def stop_stream_by_id(stream_id):
+    if manager.stop(stream_id):
+        flash(f"ライブ配信 ({stream_id}) が停止されました", "success")
+    else:
+        flash(f"ライブ配信 ({stream_id}) は実行されていません", "danger")
+    return redirect(url_for('index', stream=stream_id))
+
+@app.route('/streams', methods=['GET'])
+def streams_status():
+    return jsonify(manager.status())
+
+@app.route('/streams/<stream_id>/status', methods=['GET'])
+def stream_status(stream_id):
+    if stream_id not in manager.stream_ids():
+        return jsonify({"error": f"配信 {stream_id} は設定されていません"}), 404
+    return jsonify(manager.status(stream_id))
+
+@app.route("/streams/<stream_id>/preview.<ext>")
+def stream_preview(stream_id, ext):
+    """
+    配信中の最新フレームを返す。カメラは開かない
+
+    - preview.jpg / preview.webp: 静止画（ETagが一致すれば304）
+    - preview.mjpg: 新しいフレームごとに更新されるMJPEG
+    - ?width=320 などで縮小した画像を返す
+    """
+    streamer = manager.get(stream_id)
+    if streamer is None or not manager.is_running(stream_id):
+        return jsonify({"error": f"配信 {stream_id} は実行されていません"}), 404
+    width = request.args.get("width", type=int)
+    no_cache = {"Cache-Control": "no-cache"}
+
+    if ext == "mjpg":
+        return Response(
+            streamer.preview.mjpeg(width),
+            mimetype=f"multipart/x-mixed-replace; boundary={MJPEG_BOUNDARY}",
+            headers={**no_cache, "X-Accel-Buffering": "no"},
+        )
+    fmt = {"jpg": "jpeg", "jpeg": "jpeg", "webp": "webp"}.get(ext)
+    if fmt is None:
+        return jsonify({"error": f"対応していない形式です: {ext}"}), 404
+
+    snapshot = streamer.preview.snapshot(fmt, width, not_modified=request.if_none_match.contains)
+    if snapshot is None:
+        return jsonify({"error": "まだフレームがありません"}), 503
+    etag, data = snapshot
+    if data is None:
+        response = Response(status=304, headers=no_cache)
     else:
-        flash("ライブ配信は実行されていません", "danger")
-        return redirect(url_for('index'))
+        response = Response(data, mimetype=PREVIEW_FORMATS[fmt][1], headers=no_cache)
+    response.set_etag(etag)
+    return response
+
+@app.route("/events")
+def events():
+    """
+    全ての配信の状態をServer-Sent Eventsで送り続ける
+    """
+    return Response(
+        stream_states.events(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.route("/metrics")
+def metrics():
+    manager.update_metrics()
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4; charset=utf-8")
+
+def render_display_image():
+    # カメラを使わずに見本の画像で画面イメージを作成する
+    try:
+        canvas = generate_image(example=True)
+        canvas.save("static/display.png")
+    except Exception as e:
+        print(f"エラー: 画面イメージの作成中にエラーが発生しました: {e}")
 
 @app.route("/update_display_settings", methods=["POST"])
 def update_display_settings():
@@ -140,8 +225,8 @@ def update_display_settings():
             "mosaic_size": form.mosaic_size.data,
         }
         update_settings(settings)
-        canvas = generate_image(example=True)
-        canvas.save("static/display.png")
+        # 画面イメージの描画は時間がかかるので、リクエストを待たせずに裏で行う
+        threading.Thread(target=render_display_image, daemon=True).start()
         flash("表示設定が保存されました", "success")
     else:
         for field, errors in form.errors.items():
@@ -164,6 +249,8 @@ def update_stream_settings():
             "fps": form.fps.data,
             "resolution": form.resolution.data,
             "interval": form.interval.data,
+            "ingest_mode": form.ingest_mode.data,
+            "encoder_profile": form.encoder_profile.data,
         }
         update_settings(settings)
         flash("配信設定が保存されました", "success")
@@ -175,5 +262,18 @@ def update_stream_settings():
         flash("配信設定の保存に失敗しました", "danger")
     return redirect(url_for("index"))
 
+def start_provisioning(use_reloader):
+    """
+    配信開始時に待たずに済むよう、起動時にYouTube APIクライアントとライブ配信を用意しておく
+
+    リローダーを使う場合はこのファイルが監視用のプロセスとリクエストを受けるプロセスの両方で
+    実行されるので、後者（WERKZEUG_RUN_MAINが設定されたプロセス）だけで行う。
+    両方で行うと同時にAPIを呼び、ライブ配信が重複して作成される。
+    """
+    if use_reloader and os.environ.get("WERKZEUG_RUN_MAIN") != "true":
+        return
+    threading.Thread(target=manager.provision, daemon=True).start()
+
 if __name__ == "__main__":
-    app.run(debug=True, port=5000)
+    start_provisioning(use_reloader=True)
+    app.run(debug=True, use_reloader=True, port=5000)
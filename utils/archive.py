@@ -0,0 +1,310 @@
+import argparse
+import os
+import shlex
+import sqlite3
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+DEFAULT_ARCHIVE_SETTINGS = {
+    "enabled": False,
+    "path": "archive",
+    "source": "composed",  # 保存する画像 ("composed": 合成後の画像 / "raw": カメラ画像)
+    "segment_minutes": 60,  # 1つのセグメントファイルにまとめる時間（分）
+    "jpeg_quality": 85,
+    "retention_days": 30,  # これより古いセグメントは削除する (0なら無制限)
+    "max_gb": 50,  # 合計がこれを超えたら古いセグメントから削除する (0なら無制限)
+}
+
+
+def archive_settings(settings):
+    return {**DEFAULT_ARCHIVE_SETTINGS, **settings.get("archive", {})}
+
+
+class FrameArchive:
+    """
+    フレームをJPEGで時刻ごとのセグメントファイルに追記して保存するアーカイブ
+
+    セグメントは追記のみのファイルで、各フレームの時刻・セグメント・位置・長さを
+    SQLiteの索引に記録するので、任意の時間範囲のフレームをすぐに取り出せる。
+    """
+
+    def __init__(self, path="archive", segment_minutes=60, jpeg_quality=85, retention_days=30, max_gb=50):
+        self.path = path
+        self.segment_seconds = max(1, int(segment_minutes * 60))
+        self.jpeg_quality = jpeg_quality
+        self.retention_days = retention_days
+        self.max_bytes = int(max_gb * 1024 ** 3)
+        self._lock = threading.Lock()
+        self._segment_name = None
+        self._segment_file = None
+
+        os.makedirs(self.path, exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(self.path, "index.sqlite"), check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS frames ("
+            "ts REAL NOT NULL, segment TEXT NOT NULL, offset INTEGER NOT NULL, length INTEGER NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS frames_ts ON frames (ts)")
+        self._db.commit()
+
+    @classmethod
+    def from_settings(cls, settings, stream_id=None):
+        config = archive_settings(settings)
+        path = config["path"]
+        if stream_id and stream_id != "default":
+            # 複数の配信を行う場合は配信ごとにディレクトリを分ける
+            path = os.path.join(path, stream_id)
+        return cls(
+            path=path,
+            segment_minutes=config["segment_minutes"],
+            jpeg_quality=config["jpeg_quality"],
+            retention_days=config["retention_days"],
+            max_gb=config["max_gb"],
+        )
+
+    def append(self, frame, timestamp=None, is_rgb=True):
+        """
+        フレームを圧縮して保存する
+
+        :param frame: (height, width, 3) の配列
+        :param timestamp: UNIX時刻、Noneなら現在時刻
+        :param is_rgb: TrueならRGB、FalseならBGR (カメラ画像)
+        """
+        timestamp = timestamp or time.time()
+        if is_rgb:
+            frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
+        ret, encoded = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+        if not ret:
+            print("エラー: フレームの圧縮に失敗しました")
+            return
+        data = encoded.tobytes()
+
+        with self._lock:
+            segment_name = self._segment_for(timestamp)
+            if segment_name != self._segment_name:
+                self._open_segment(segment_name)
+                self._apply_retention()
+            offset = self._segment_file.tell()
+            self._segment_file.write(data)
+            self._segment_file.flush()
+            self._db.execute(
+                "INSERT INTO frames (ts, segment, offset, length) VALUES (?, ?, ?, ?)",
+                (timestamp, segment_name, offset, len(data)),
+            )
+            self._db.commit()
+
+    def lookup(self, start, end):
+        """
+        [start, end) の時刻のフレームを時刻順に返す
+
+        :return: (時刻, セグメントのパス, 位置, 長さ) のリスト
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT ts, segment, offset, length FROM frames WHERE ts >= ? AND ts < ? ORDER BY ts",
+                (start, end),
+            ).fetchall()
+        return [(ts, os.path.join(self.path, segment), offset, length) for ts, segment, offset, length in rows]
+
+    def close(self):
+        with self._lock:
+            if self._segment_file:
+                self._segment_file.close()
+                self._segment_file = None
+                self._segment_name = None
+            self._db.close()
+
+    def _segment_for(self, timestamp):
+        start = int(timestamp) // self.segment_seconds * self.segment_seconds
+        return datetime.fromtimestamp(start).strftime("%Y%m%d-%H%M%S") + ".seg"
+
+    def _open_segment(self, segment_name):
+        if self._segment_file:
+            self._segment_file.close()
+        self._segment_file = open(os.path.join(self.path, segment_name), "ab")
+        self._segment_name = segment_name
+
+    def apply_retention(self):
+        with self._lock:
+            self._apply_retention()
+
+    def _apply_retention(self):
+        segments = self._db.execute(
+            "SELECT segment, MAX(ts) FROM frames GROUP BY segment ORDER BY MIN(ts)"
+        ).fetchall()
+        sizes = {}
+        for segment, _last_ts in segments:
+            try:
+                sizes[segment] = os.path.getsize(os.path.join(self.path, segment))
+            except FileNotFoundError:
+                sizes[segment] = 0
+        total = sum(sizes.values())
+
+        cutoff = time.time() - self.retention_days * 86400 if self.retention_days else None
+        for segment, last_ts in segments:
+            if segment == self._segment_name:
+                break
+            too_old = cutoff is not None and last_ts < cutoff
+            too_large = self.max_bytes and total > self.max_bytes
+            if not (too_old or too_large):
+                break
+            self._db.execute("DELETE FROM frames WHERE segment = ?", (segment,))
+            try:
+                os.remove(os.path.join(self.path, segment))
+            except FileNotFoundError:
+                pass
+            total -= sizes[segment]
+            print(f"アーカイブのセグメント {segment} を削除しました。")
+        self._db.commit()
+
+
+def _read_frame(entry):
+    _ts, segment_path, offset, length = entry
+    with open(segment_path, "rb") as f:
+        f.seek(offset)
+        return f.read(length)
+
+
+def _probe_size(entry):
+    frame = cv2.imdecode(np.frombuffer(_read_frame(entry), dtype=np.uint8), cv2.IMREAD_COLOR)
+    height, width = frame.shape[:2]
+    # libx264 (yuv420p) は偶数のサイズしか扱えない
+    return width // 2 * 2, height // 2 * 2
+
+
+def _encode_chunk(entries, output, fps, size, ffmpeg_args):
+    # セグメントから読み出したJPEGをそのままffmpegに渡し、デコードとエンコードを任せる
+    width, height = size
+    command = (
+        [
+            "ffmpeg", "-y", "-loglevel", "error",
+            "-f", "image2pipe", "-c:v", "mjpeg", "-framerate", str(fps), "-i", "-",
+            "-vf", f"scale={width}:{height},setsar=1",
+        ]
+        + ffmpeg_args
+        + [output]
+    )
+    process = subprocess.Popen(command, stdin=subprocess.PIPE)
+    handles = {}
+    try:
+        for _ts, segment_path, offset, length in entries:
+            f = handles.get(segment_path)
+            if f is None:
+                f = handles[segment_path] = open(segment_path, "rb")
+            f.seek(offset)
+            process.stdin.write(f.read(length))
+    finally:
+        for f in handles.values():
+            f.close()
+        process.stdin.close()
+    return process.wait()
+
+
+def export_timelapse(archive, start, end, output, fps=30, workers=None, size=None, chunk_frames=3000, crf=23, preset="veryfast"):
+    """
+    指定した時間範囲のフレームから早送りのMP4を作成する
+
+    フレームをchunk_framesごとに分け、プロセスプールで並列にエンコードしてから
+    ffmpegのconcatで再エンコードせずに連結する。
+
+    :param start: 開始時刻 (UNIX時刻)
+    :param end: 終了時刻 (UNIX時刻)
+    :param size: 出力サイズ (width, height)、Noneなら最初のフレームのサイズ
+    :return: 書き出したフレーム数
+    """
+    entries = archive.lookup(start, end)
+    if not entries:
+        print("指定した範囲にフレームがありません。")
+        return 0
+
+    if size is None:
+        size = _probe_size(entries[0])
+
+    ffmpeg_args = shlex.split(f"-c:v libx264 -preset {preset} -crf {crf} -pix_fmt yuv420p -r {fps}")
+    chunks = [entries[i:i + chunk_frames] for i in range(0, len(entries), chunk_frames)]
+
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(output))) as tmpdir:
+        chunk_paths = [os.path.join(tmpdir, f"chunk{i:05d}.mp4") for i in range(len(chunks))]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(
+                executor.map(
+                    _encode_chunk,
+                    chunks,
+                    chunk_paths,
+                    [fps] * len(chunks),
+                    [size] * len(chunks),
+                    [ffmpeg_args] * len(chunks),
+                )
+            )
+        if any(returncode != 0 for returncode in results):
+            print("エラー: エンコードに失敗したチャンクがあります。")
+            return 0
+
+        list_path = os.path.join(tmpdir, "chunks.txt")
+        with open(list_path, "w", encoding="utf-8") as f:
+            for path in chunk_paths:
+                f.write(f"file '{path}'\n")
+        returncode = subprocess.call(
+            ["ffmpeg", "-y", "-loglevel", "error", "-f", "concat", "-safe", "0", "-i", list_path, "-c", "copy", output]
+        )
+        if returncode != 0:
+            print("エラー: チャンクの連結に失敗しました。")
+            return 0
+    return len(entries)
+
+
+def _parse_time(value):
+    return datetime.strptime(value, "%Y-%m-%d %H:%M").timestamp()
+
+
+def main():
+    from utils.config import DEFAULT_STREAM_ID, stream_settings
+
+    parser = argparse.ArgumentParser(description="保存したフレームのアーカイブを操作します")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export", help="指定した範囲の早送り動画を作成する")
+    export_parser.add_argument("--start", required=True, help="開始日時 (例: \"2025-01-01 00:00\")")
+    export_parser.add_argument("--end", required=True, help="終了日時 (例: \"2025-01-08 00:00\")")
+    export_parser.add_argument("--output", required=True, help="出力するMP4ファイル")
+    export_parser.add_argument("--fps", type=int, default=30, help="出力動画のFPS")
+    export_parser.add_argument("--workers", type=int, help="並列にエンコードするプロセス数、省略時はCPU数")
+    export_parser.add_argument("--size", help="出力サイズ (例: 1920x1080)、省略時は最初のフレームのサイズ")
+    export_parser.add_argument("--chunk-frames", type=int, default=3000, help="1プロセスが担当するフレーム数")
+
+    subparsers.add_parser("prune", help="保存期間と容量の上限に従って古いセグメントを削除する")
+    parser.add_argument("--stream", help="対象の配信ID、省略時は既定の配信")
+    args = parser.parse_args()
+
+    archive = FrameArchive.from_settings(stream_settings(args.stream or DEFAULT_STREAM_ID), args.stream)
+    try:
+        if args.command == "export":
+            size = tuple(map(int, args.size.split("x"))) if args.size else None
+            start = time.monotonic()
+            frames = export_timelapse(
+                archive,
+                _parse_time(args.start),
+                _parse_time(args.end),
+                args.output,
+                fps=args.fps,
+                workers=args.workers,
+                size=size,
+                chunk_frames=args.chunk_frames,
+            )
+            if frames:
+                print(f"{frames}フレームを {args.output} に書き出しました ({time.monotonic() - start:.1f}秒)。")
+        elif args.command == "prune":
+            archive.apply_retention()
+    finally:
+        archive.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+import argparse
+import resource
+import subprocess
+import time
+
+from utils.config import load_settings
+from utils.ffmpeg import encoder_args, encoder_profiles
+
+
+def run_encode(settings, profile, duration):
+    """
+    合成したタイムラプス映像をプロファイルでエンコードし、CPU時間と速度を計測する
+
+    testsrc2を1FPSで生成して出力FPSに複製するので、数秒に1回だけ画像が変わる
+    配信と同じような入力になる。出力はnullマルチプレクサに捨てる。
+    """
+    resolution = settings["resolution"]
+    fps = settings["fps"]
+    command = (
+        [
+            "ffmpeg", "-y", "-loglevel", "error",
+            "-f", "lavfi", "-i", f"testsrc2=size={resolution}:rate=1,fps={fps}",
+            "-t", str(duration),
+        ]
+        + encoder_args(settings, profile)
+        + ["-f", "null", "-"]
+    )
+
+    children_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    start = time.monotonic()
+    returncode = subprocess.call(command)
+    elapsed = time.monotonic() - start
+    children_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = (children_after.ru_utime - children_before.ru_utime) + (
+        children_after.ru_stime - children_before.ru_stime
+    )
+    return {
+        "cpu_s": cpu,
+        "wall_s": elapsed,
+        "speed": duration / elapsed if elapsed > 0 else 0.0,
+        "cpu_per_media_s": cpu / duration,
+        "returncode": returncode,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="エンコーダープロファイルごとのCPU時間と速度をオフラインで計測します")
+    parser.add_argument("--duration", type=float, default=30, help="エンコードする映像の長さ（秒）")
+    parser.add_argument("--resolution", action="append", help="解像度 (複数指定可)、省略時は設定値")
+    parser.add_argument("--fps", type=int, help="出力FPS、省略時は設定値")
+    parser.add_argument("--profile", action="append", help="計測するプロファイル (複数指定可)、省略時は全て")
+    args = parser.parse_args()
+
+    settings = dict(load_settings())
+    if args.fps:
+        settings["fps"] = args.fps
+    profiles = encoder_profiles(settings)
+    names = args.profile or list(profiles)
+
+    print(f"{'resolution':>10} {'profile':<10} {'cpu(s)':>7} {'speed':>7} {'cpu/s':>6}")
+    for resolution in args.resolution or [settings["resolution"]]:
+        for name in names:
+            result = run_encode({**settings, "resolution": resolution}, profiles[name], args.duration)
+            if result["returncode"] != 0:
+                print(f"{resolution:>10} {name:<10} エラー (終了コード: {result['returncode']})")
+                continue
+            print(
+                f"{resolution:>10} {name:<10} {result['cpu_s']:>7.2f} "
+                f"{result['speed']:>6.2f}x {result['cpu_per_media_s']:>6.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
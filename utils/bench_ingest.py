@@ -0,0 +1,92 @@
+import argparse
+import resource
+import subprocess
+import time
+
+import numpy as np
+
+from utils.config import load_settings
+from utils.ffmpeg import INGEST_MODES, build_ffmpeg_command, ingest_rate
+
+
+def run_ingest(settings, duration):
+    """
+    合成フレームをffmpegに書き込み、パイプの転送量とCPU時間を計測する
+
+    出力はnullマルチプレクサに捨てるので、ネットワークやYouTubeは不要
+    """
+    width, height = map(int, settings["resolution"].split("x"))
+    frame = np.random.randint(0, 255, (height, width, 3), dtype=np.uint8)
+    view = memoryview(frame).cast("B")
+
+    command = build_ffmpeg_command(settings, ["-f", "null", "-"])
+    command[1:1] = ["-loglevel", "error"]
+    write_interval = 1.0 / ingest_rate(settings)
+
+    children_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu_before = time.process_time()
+    start = time.monotonic()
+
+    process = subprocess.Popen(command, stdin=subprocess.PIPE)
+    frames_written = 0
+    next_tick = start
+    try:
+        while time.monotonic() - start < duration:
+            process.stdin.write(view)
+            frames_written += 1
+            next_tick += write_interval
+            delay = next_tick - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        # build_ffmpeg_commandは-shortestを付けるので、stdinを閉じると残りをエンコードして終了する
+        process.stdin.close()
+        process.wait(timeout=30)
+    finally:
+        # 書き込みに失敗した場合や終了しなかった場合もffmpegを残さない
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+
+    elapsed = time.monotonic() - start
+    cpu_python = time.process_time() - cpu_before
+    children_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu_ffmpeg = (children_after.ru_utime - children_before.ru_utime) + (
+        children_after.ru_stime - children_before.ru_stime
+    )
+    return {
+        "mode": settings.get("ingest_mode"),
+        "frames_written": frames_written,
+        "pipe_mb_per_s": frames_written * frame.nbytes / elapsed / 1e6,
+        "python_cpu_s": cpu_python,
+        "ffmpeg_cpu_s": cpu_ffmpeg,
+        "returncode": process.returncode,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ffmpegへの入力方式ごとのパイプ転送量とCPU時間を比較します")
+    parser.add_argument("--duration", type=float, default=20, help="1方式あたりの計測時間（秒）")
+    parser.add_argument("--resolution", help="解像度 (例: 1920x1080)、省略時は設定値")
+    parser.add_argument("--fps", type=int, help="出力FPS、省略時は設定値")
+    parser.add_argument("--ingest-fps", type=float, default=1, help="low_rateでの入力FPS")
+    args = parser.parse_args()
+
+    settings = dict(load_settings())
+    if args.resolution:
+        settings["resolution"] = args.resolution
+    if args.fps:
+        settings["fps"] = args.fps
+    settings["ingest_fps"] = args.ingest_fps
+
+    print(f"解像度: {settings['resolution']} / 出力FPS: {settings['fps']}")
+    print(f"{'mode':<9} {'frames':>7} {'pipe(MB/s)':>11} {'python(s)':>10} {'ffmpeg(s)':>10}")
+    for mode in INGEST_MODES:
+        result = run_ingest({**settings, "ingest_mode": mode}, args.duration)
+        print(
+            f"{result['mode']:<9} {result['frames_written']:>7} {result['pipe_mb_per_s']:>11.2f} "
+            f"{result['python_cpu_s']:>10.2f} {result['ffmpeg_cpu_s']:>10.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
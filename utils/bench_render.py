@@ -0,0 +1,202 @@
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+from PIL import Image
+
+from utils.config import DEFAULT_SETTINGS, FONT_PATH, RESOLUTION_CHOICES
+from utils.image_processing import RENDER_BACKENDS, CanvasPool, generate_frame, layer_cache
+from utils.text_layout import clear_caches
+
+GOLDEN_DIR = "golden"
+RESULTS_DIR = "bench_results"
+
+# 時刻の表示を固定して、毎回同じ画像になるようにする
+START_TIME = datetime(2025, 1, 1, 9, 0)
+NOW = datetime(2025, 1, 1, 12, 34)
+
+STAGES = ("capture", "resize", "effects", "text", "compose")
+
+MARKDOWN_TEXTS = {
+    "short": "# お知らせ\n- 工事中\n- 9時〜17時",
+    "long": "\n".join(
+        ["# 工事の進捗状況"]
+        + [f"- 第{i}工区: 基礎工事と配筋検査が完了し、来週から型枠の組み立てを開始する予定です" for i in range(1, 9)]
+        + ["* Long English lines are wrapped by words instead of characters for readability"]
+        + ["本日の作業は天候により変更となる場合があります。ご理解とご協力をお願いいたします。"]
+    ),
+}
+
+# バックエンドごとに自分のゴールデン画像と比べる（バックエンド間の差はimage_processing --compareで確認する）
+# 画素値の差がGOLDEN_TOLERANCEを超えた画素の割合がこれ以下なら一致とみなす
+GOLDEN_TOLERANCE = 1
+MAX_MISMATCH_RATIO = 0.001
+
+
+def iter_cases(resolutions=None):
+    for resolution in resolutions or [value for value, _label in RESOLUTION_CHOICES]:
+        for mosaic_size in (0, 10):
+            for grayscale in (False, True):
+                for text in MARKDOWN_TEXTS:
+                    yield {
+                        "resolution": resolution,
+                        "mosaic_size": mosaic_size,
+                        "grayscale": grayscale,
+                        "text": text,
+                    }
+
+
+def case_name(case):
+    effects = []
+    if case["mosaic_size"]:
+        effects.append(f"mosaic{case['mosaic_size']}")
+    if case["grayscale"]:
+        effects.append("gray")
+    return "_".join([case["resolution"], *(effects or ["plain"]), case["text"]])
+
+
+def case_settings(case):
+    return {
+        **DEFAULT_SETTINGS,
+        "lower_text": "ベンチマーク用の下部テキスト",
+        "right_long_text": MARKDOWN_TEXTS[case["text"]],
+        "font_path": FONT_PATH,
+        "resolution": case["resolution"],
+        "mosaic_size": case["mosaic_size"],
+        "grayscale": case["grayscale"],
+    }
+
+
+def render(settings, backend, timings=None, canvas_pool=None):
+    return generate_frame(
+        start_time=START_TIME,
+        example=True,
+        backend=backend,
+        settings=settings,
+        now=NOW,
+        timings=timings,
+        canvas_pool=canvas_pool,
+    )
+
+
+def run_case(case, backend, iterations):
+    """
+    1つの条件で描画を繰り返し、段階ごとの処理時間とピークメモリを計測する
+
+    1回目はキャッシュを消した状態（cold）、2回目以降はキャッシュが効いた状態（warm）
+    """
+    settings = case_settings(case)
+    canvas_pool = CanvasPool()
+    layer_cache.clear()
+    clear_caches()
+
+    tracemalloc.start()
+    cold = {}
+    start = time.perf_counter()
+    frame = render(settings, backend, cold, canvas_pool)
+    cold_total = time.perf_counter() - start
+
+    warm = {}
+    start = time.perf_counter()
+    for _ in range(iterations):
+        frame = render(settings, backend, warm, canvas_pool)
+    warm_total = (time.perf_counter() - start) / iterations
+    _current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return frame, {
+        "case": case_name(case),
+        **case,
+        "backend": backend,
+        "cold_ms": cold_total * 1000,
+        "warm_ms": warm_total * 1000,
+        "cold_stages_ms": {stage: cold.get(stage, 0.0) * 1000 for stage in STAGES},
+        "warm_stages_ms": {stage: warm.get(stage, 0.0) / iterations * 1000 for stage in STAGES},
+        "peak_memory_mb": peak / 1e6,
+    }
+
+
+def golden_path(name, backend):
+    return os.path.join(GOLDEN_DIR, backend, f"{name}.png")
+
+
+def check_golden(path, frame, tolerance=GOLDEN_TOLERANCE):
+    """
+    ゴールデン画像と比較する
+
+    :return: (結果 "ok" / "mismatch" / "missing", 差がtoleranceを超えた画素の割合)
+    """
+    if not os.path.exists(path):
+        return "missing", None
+    golden = np.asarray(Image.open(path).convert("RGB"))
+    if golden.shape != frame.shape:
+        return "mismatch", 1.0
+    diff = np.abs(golden.astype(np.int16) - frame.astype(np.int16))
+    ratio = float((diff > tolerance).mean())
+    return ("ok" if ratio <= MAX_MISMATCH_RATIO else "mismatch"), ratio
+
+
+def main():
+    parser = argparse.ArgumentParser(description="カメラなしで描画処理を計測し、ゴールデン画像と比較します")
+    parser.add_argument("--resolution", action="append", help="解像度 (複数指定可)、省略時は全て")
+    parser.add_argument("--backend", action="append", choices=RENDER_BACKENDS, help="描画バックエンド (複数指定可)、省略時は全て")
+    parser.add_argument("--iterations", type=int, default=10, help="warmの計測回数")
+    parser.add_argument("--update-golden", action="store_true", help="各バックエンドの出力でゴールデン画像を作り直す")
+    parser.add_argument("--output", help="結果を保存するJSONファイル、省略時はbench_results/に日時付きで保存")
+    args = parser.parse_args()
+
+    backends = args.backend or list(RENDER_BACKENDS)
+    results = []
+    failed = False
+
+    print(f"{'case':<36} {'backend':<6} {'cold(ms)':>9} {'warm(ms)':>9} {'peak(MB)':>9} golden")
+    for case in iter_cases(args.resolution):
+        name = case_name(case)
+        for backend in backends:
+            frame, result = run_case(case, backend, args.iterations)
+
+            path = golden_path(name, backend)
+            if args.update_golden:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                Image.fromarray(frame).save(path, optimize=True)
+            status, ratio = check_golden(path, frame)
+            result["golden"] = status
+            result["golden_mismatch_ratio"] = ratio
+            # ゴールデン画像がない場合も、確認できていないので失敗とする
+            failed = failed or status != "ok"
+            results.append(result)
+
+            print(
+                f"{name:<36} {backend:<6} {result['cold_ms']:>9.2f} {result['warm_ms']:>9.2f} "
+                f"{result['peak_memory_mb']:>9.2f} {status}"
+            )
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"render_{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "created_at": datetime.now().isoformat(),
+                "iterations": args.iterations,
+                "results": results,
+            },
+            f,
+            indent=4,
+            ensure_ascii=False,
+        )
+    print(f"結果を {output} に保存しました。")
+
+    if failed:
+        print("エラー: ゴールデン画像と一致しない、またはゴールデン画像がない出力があります。")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
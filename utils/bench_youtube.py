@@ -0,0 +1,96 @@
+import argparse
+import statistics
+import time
+
+from utils.youtube import PersistentIngest, YouTubeClient
+from utils.youtube_fake import FakeYouTubeService
+
+
+def make_client(fake, latency):
+    if fake:
+        return YouTubeClient(service=FakeYouTubeService(latency))
+    return YouTubeClient()
+
+
+def measure(client, title):
+    """
+    配信の開始（作成と紐付け）と停止にかかる時間を計測する
+
+    :return: (開始にかかった秒数, 停止にかかった秒数)
+    """
+    start = time.perf_counter()
+    _rtmp_url, _watch_url, broadcast_id = client.create_live(title, "計測用の配信", "private")
+    started = time.perf_counter()
+    client.stop_live(broadcast_id)
+    stopped = time.perf_counter()
+    return started - start, stopped - started
+
+
+def measure_persistent(ingest, title):
+    """
+    事前に作成したライブ配信を紐付けて開始し、停止するまでの時間を計測する
+
+    補充は裏で行われるので、次の計測の前に終わらせておく
+    """
+    start = time.perf_counter()
+    _rtmp_url, _watch_url, broadcast_id = ingest.start(title, "計測用の配信", "private")
+    started = time.perf_counter()
+    ingest.client.stop_live(broadcast_id)
+    stopped = time.perf_counter()
+    ingest.provision(title, "計測用の配信", "private")
+    return started - start, stopped - started
+
+
+def summary(values):
+    return f"{statistics.median(values) * 1000:>9.2f} {max(values) * 1000:>9.2f}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="YouTubeライブ配信の開始と停止にかかる時間を計測します")
+    parser.add_argument("--iterations", type=int, default=5, help="計測回数")
+    parser.add_argument("--real", action="store_true", help="偽物ではなく実際のYouTube APIを使う（配信が作成されます）")
+    parser.add_argument("--latency", type=float, default=0.0, help="偽物のAPIの1回の呼び出しにかかる時間（秒）")
+    parser.add_argument("--state", default=None, help="--realでpersistentの計測に使う状態ファイル")
+    args = parser.parse_args()
+
+    fake = not args.real
+    cold_start, cold_stop = [], []
+    for _ in range(args.iterations):
+        # 毎回クライアントを作り直す（認証情報の読み込みとクライアントの作成を含む）
+        client = make_client(fake, args.latency)
+        start = time.perf_counter()
+        _ = client.service
+        build_seconds = time.perf_counter() - start
+        start_seconds, stop_seconds = measure(client, "計測用 (cold)")
+        cold_start.append(build_seconds + start_seconds)
+        cold_stop.append(stop_seconds)
+
+    # 1つのクライアントを使い回す
+    client = make_client(fake, args.latency)
+    _ = client.service
+    warm_start, warm_stop = [], []
+    for _ in range(args.iterations):
+        start_seconds, stop_seconds = measure(client, "計測用 (warm)")
+        warm_start.append(start_seconds)
+        warm_stop.append(stop_seconds)
+
+    # 使い回すストリームと事前に作成したライブ配信を使う
+    ingest = PersistentIngest(client, "bench", state_path=None if fake else args.state)
+    ingest.provision("計測用 (persistent)", "計測用の配信", "private")
+    persistent_start, persistent_stop = [], []
+    for _ in range(args.iterations):
+        start_seconds, stop_seconds = measure_persistent(ingest, "計測用 (persistent)")
+        persistent_start.append(start_seconds)
+        persistent_stop.append(stop_seconds)
+
+    print(f"{'':<16} {'median(ms)':>9} {'max(ms)':>9}")
+    print(f"{'cold start':<16} {summary(cold_start)}")
+    print(f"{'cold stop':<16} {summary(cold_stop)}")
+    print(f"{'warm start':<16} {summary(warm_start)}")
+    print(f"{'warm stop':<16} {summary(warm_stop)}")
+    print(f"{'persistent start':<16} {summary(persistent_start)}")
+    print(f"{'persistent stop':<16} {summary(persistent_stop)}")
+
+
+if __name__ == "__main__":
+    main()
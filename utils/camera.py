@@ -0,0 +1,457 @@
+import argparse
+import threading
+import time
+
+import cv2
+
+DEFAULT_CAMERA_INDEX = 2
+TARGET_ASPECT = 16 / 9
+
+# カメラに要求するピクセルフォーマット（優先順）
+CAPTURE_FORMATS = ("MJPG", "YUYV")
+
+# 起動時にモードを計測するときの、モードごとの計測フレーム数
+STARTUP_PROBE_SAMPLES = 5
+
+# 一般的なUVCカメラが対応している解像度
+CANDIDATE_SIZES = [
+    (424, 240),
+    (640, 360),
+    (640, 480),
+    (848, 480),
+    (800, 600),
+    (960, 540),
+    (1024, 576),
+    (1280, 720),
+    (1280, 960),
+    (1600, 900),
+    (1920, 1080),
+    (2560, 1440),
+    (3840, 2160),
+]
+
+
+class CameraSession:
+    """
+    Webカメラを開いたまま保持し、専用スレッドで常にフレームを取得し続けるセッション
+
+    最新のフレームだけを1枠のバッファに保持するため、描画側はデバイスI/Oを行わずに
+    直近のフレームを受け取れる。デバイスが切断された場合は自動的に再接続する。
+
+    :param device_index: cv2.VideoCaptureに渡すカメラのインデックス
+    :param fourcc: 要求するピクセルフォーマット ("MJPG" / "YUYV")、Noneならドライバの既定値
+    :param frame_size: 要求する解像度 (width, height)、Noneならドライバの既定値
+    :param auto_size: frame_sizeを設定で指定せず、出力の大きさから選んだ場合はTrue
+    :param reconnect_interval: 再接続を試みる間隔（秒）
+    :param max_read_failures: 連続で読み込みに失敗したら再接続するまでの回数
+    """
+
+    def __init__(
+        self,
+        device_index=DEFAULT_CAMERA_INDEX,
+        fourcc=None,
+        frame_size=None,
+        auto_size=False,
+        reconnect_interval=2.0,
+        max_read_failures=10,
+    ):
+        self.device_index = device_index
+        self.fourcc = fourcc
+        self.frame_size = tuple(frame_size) if frame_size else None
+        self.auto_size = auto_size
+        self.reconnect_interval = reconnect_interval
+        self.max_read_failures = max_read_failures
+
+        self._cap = None
+        self._thread = None
+        self._is_running = False
+        self._frame_cond = threading.Condition()
+        self._latest_frame = None  # 最新フレーム (BGR) のみを保持する1枠バッファ
+        self._frame_seq = 0
+        self._frame_time = None
+
+    def start(self):
+        if self._is_running:
+            return
+        self._is_running = True
+        self._thread = threading.Thread(target=self._grab_loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._is_running = False
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=5)
+        self._thread = None
+        self._release()
+        with self._frame_cond:
+            self._latest_frame = None
+            self._frame_time = None
+            self._frame_cond.notify_all()
+
+    @property
+    def is_running(self):
+        return self._is_running
+
+    @property
+    def frame_seq(self):
+        return self._frame_seq
+
+    @property
+    def frame_time(self):
+        return self._frame_time
+
+    def get_frame(self, timeout=None):
+        """
+        最新のフレーム (BGR) を返す。まだ1枚も取得できていない場合はtimeout秒まで待つ
+
+        :return: numpy配列、取得できない場合はNone
+        """
+        with self._frame_cond:
+            if self._latest_frame is None and timeout:
+                self._frame_cond.wait_for(
+                    lambda: self._latest_frame is not None or not self._is_running,
+                    timeout=timeout,
+                )
+            return self._latest_frame
+
+    def _open(self):
+        cap = self._configure(cv2.VideoCapture(self.device_index))
+        if not cap.isOpened():
+            cap.release()
+            return False
+        self._cap = cap
+        print(f"Webカメラ (index: {self.device_index}) を開きました。")
+        return True
+
+    def _configure(self, cap):
+        # デバイスを開いた直後にフォーマットと解像度を要求する
+        return configure_capture(cap, self.fourcc, self.frame_size)
+
+    def _release(self):
+        if self._cap is not None:
+            self._cap.release()
+            self._cap = None
+
+    def _grab_loop(self):
+        failures = 0
+        while self._is_running:
+            if self._cap is None:
+                if not self._open():
+                    print(f"エラー: Webカメラ (index: {self.device_index}) を開けません。{self.reconnect_interval}秒後に再接続します。")
+                    time.sleep(self.reconnect_interval)
+                    continue
+                failures = 0
+
+            ret, frame = self._cap.read()
+            if not ret:
+                failures += 1
+                if failures >= self.max_read_failures:
+                    print("エラー: Webカメラから画像を取得できません。再接続します。")
+                    self._release()
+                    time.sleep(self.reconnect_interval)
+                continue
+
+            failures = 0
+            with self._frame_cond:
+                self._latest_frame = frame
+                self._frame_seq += 1
+                self._frame_time = time.monotonic()
+                self._frame_cond.notify_all()
+
+        self._release()
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+# 起動時に計測したカメラのモード（カメラのインデックスごと）
+_probed_modes = {}
+_probe_lock = threading.Lock()
+
+
+def _session_satisfies(session, fourcc, frame_size, auto_size):
+    if session.fourcc != fourcc or session.auto_size != auto_size:
+        return False
+    if not auto_size:
+        return session.frame_size == frame_size
+    # 自動で選んだ解像度どうしなら、今の解像度で足りる限り開き直さない（差はcrop_and_scaleで縮小する）
+    if session.frame_size is None or frame_size is None:
+        return session.frame_size == frame_size
+    return all(have >= need for have, need in zip(cropped_size(*session.frame_size), cropped_size(*frame_size)))
+
+
+def get_camera_session(device_index=DEFAULT_CAMERA_INDEX, fourcc=None, frame_size=None, auto_size=False):
+    """
+    プロセス内で共有するカメラセッションを取得する（未起動なら起動する）
+
+    設定で指定したフォーマットや解像度が変わった場合はセッションを開き直す。
+    auto_size（解像度を出力の大きさから選んでいる）の場合は、動いているセッションの解像度で
+    足りる限りそのまま使う。品質の調整で出力の解像度が下がるたびや、解像度の異なる配信が
+    同じカメラを使うたびにカメラを開き直すと、開くまでの待ち時間と露出の安定しない
+    最初のフレームが戻ってしまうため。
+    """
+    frame_size = tuple(frame_size) if frame_size else None
+    stale = None
+    with _sessions_lock:
+        session = _sessions.get(device_index)
+        if session is not None and not _session_satisfies(session, fourcc, frame_size, auto_size):
+            stale = session
+            session = None
+        if session is None:
+            session = CameraSession(device_index, fourcc=fourcc, frame_size=frame_size, auto_size=auto_size)
+            _sessions[device_index] = session
+    if stale is not None:
+        stale.stop()
+    if not session.is_running:
+        session.start()
+    return session
+
+
+def release_camera_session(device_index=None):
+    """
+    カメラセッションを停止する。device_indexがNoneなら全て停止する
+    """
+    with _sessions_lock:
+        if device_index is None:
+            targets = list(_sessions.keys())
+        else:
+            targets = [device_index] if device_index in _sessions else []
+        sessions = [_sessions.pop(index) for index in targets]
+    for session in sessions:
+        session.stop()
+
+
+def configure_capture(cap, fourcc=None, frame_size=None):
+    """
+    VideoCaptureにピクセルフォーマットと解像度を要求する
+    """
+    if not cap.isOpened():
+        return cap
+    if fourcc:
+        cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*fourcc))
+    if frame_size:
+        width, height = frame_size
+        cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+    # 最新フレームだけを使うのでドライバ側のバッファは最小にする
+    cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+    return cap
+
+
+def cropped_size(width, height, aspect=TARGET_ASPECT):
+    """
+    中央を16:9に切り抜いたときのサイズを返す
+    """
+    if width / height > aspect:
+        return int(height * aspect), height
+    elif width / height < aspect:
+        return width, int(width / aspect)
+    return width, height
+
+
+def webcam_paste_size(canvas_width, canvas_height, aspect=TARGET_ASPECT):
+    """
+    キャンバス上のウェブカメラ画像の貼り付けサイズ (width, height) を返す
+    """
+    paste_height = int(canvas_height * 0.85)
+    paste_width = int(paste_height * aspect)
+    return paste_width, paste_height
+
+
+def select_capture_size(paste_size, sizes=None, costs=None):
+    """
+    16:9に切り抜いた後も貼り付け領域を覆える解像度のうち、最も安いものを選ぶ
+
+    :param paste_size: 貼り付け領域 (width, height)
+    :param sizes: 候補となる解像度のリスト、Noneなら一般的な解像度から選ぶ
+    :param costs: {(width, height): 1フレームのデコードにかかる時間}、Noneなら最小の解像度を選ぶ
+    :return: (width, height)
+    """
+    paste_width, paste_height = paste_size
+    sizes = [tuple(size) for size in (sizes or CANDIDATE_SIZES)]
+    covering = [
+        size for size in sizes
+        if all(c >= p for c, p in zip(cropped_size(*size), (paste_width, paste_height)))
+    ]
+    if covering:
+        costs = costs or {}
+        return min(covering, key=lambda size: (costs.get(size, float("inf")), size[0] * size[1]))
+    # どの解像度でも足りない場合は最大のものを使う
+    return max(sizes, key=lambda size: size[0] * size[1])
+
+
+def startup_capture_modes(settings):
+    """
+    camera_modesが保存されていない場合に、最初に使うときに1度だけカメラのモードを計測する
+
+    結果はカメラごとにプロセス内にキャッシュする（計測できなかった場合も計測し直さない）。
+    カメラを開く前に呼ばれるよう、セッションを開くときの設定を決める処理から呼ぶ
+
+    :return: probe_capture_modesの結果、camera_probeがfalseなら空のリスト
+    """
+    if not settings.get("camera_probe", True):
+        return []
+    device_index = settings.get("camera_index", DEFAULT_CAMERA_INDEX)
+    with _probe_lock:
+        if device_index not in _probed_modes:
+            with _sessions_lock:
+                session = _sessions.get(device_index)
+            if session is not None and session.is_running:
+                # 開いているカメラは計測できないので、次に開き直すまでは一般的な解像度から選ぶ
+                return []
+            print(f"Webカメラ (index: {device_index}) の対応モードを計測しています...")
+            _probed_modes[device_index] = probe_capture_modes(device_index, samples=STARTUP_PROBE_SAMPLES)
+        return _probed_modes[device_index]
+
+
+def capture_config_from_settings(settings, paste_size):
+    """
+    設定からカメラに要求するフォーマットと解像度を決める
+
+    :return: (fourcc, frame_size, auto_size)、auto_sizeは解像度を貼り付けサイズから選んだ場合にTrue
+    """
+    fourcc = settings.get("camera_format", "MJPG")
+    if fourcc == "auto":
+        fourcc = None
+
+    camera_size = settings.get("camera_size", "auto")
+    auto_size = camera_size == "auto"
+    if auto_size:
+        # 計測済みのモードがあれば、貼り付け領域を覆えるうちデコードが最も速いものを選ぶ
+        costs = {}
+        for mode in settings.get("camera_modes") or startup_capture_modes(settings):
+            if fourcc is None or mode.get("format") == fourcc:
+                size = (mode["width"], mode["height"])
+                costs[size] = min(costs.get(size, float("inf")), mode["decode_ms"])
+        frame_size = select_capture_size(paste_size, list(costs) or None, costs)
+    elif camera_size:
+        frame_size = tuple(map(int, camera_size.split("x")))
+    else:
+        frame_size = None
+    return fourcc, frame_size, auto_size
+
+
+def camera_session_from_settings(settings):
+    """
+    描画と同じ取得設定（フォーマットと解像度）でカメラセッションを取得する
+
+    設定が違うとセッションが開き直されるので、描画以外でカメラの最新フレームを読む場合もこれを使う
+    """
+    canvas_width, canvas_height = map(int, settings.get("resolution", "1280x720").split("x"))
+    paste_size = webcam_paste_size(canvas_width, canvas_height)
+    fourcc, frame_size, auto_size = capture_config_from_settings(settings, paste_size)
+    return get_camera_session(
+        settings.get("camera_index", DEFAULT_CAMERA_INDEX), fourcc=fourcc, frame_size=frame_size, auto_size=auto_size
+    )
+
+
+def crop_and_scale(frame, target_size, aspect=TARGET_ASPECT):
+    """
+    BGRフレームの中央を16:9に切り抜き、target_sizeへ縮小したRGB配列を1度の処理で返す
+
+    切り抜きはスライスによるビューなのでコピーは発生しない
+    """
+    height, width = frame.shape[:2]
+    crop_width, crop_height = cropped_size(width, height, aspect)
+    left = (width - crop_width) // 2
+    top = (height - crop_height) // 2
+    roi = frame[top:top + crop_height, left:left + crop_width]
+
+    target_width, target_height = target_size
+    if (crop_width, crop_height) != (target_width, target_height):
+        interpolation = cv2.INTER_AREA if crop_width > target_width else cv2.INTER_LINEAR
+        roi = cv2.resize(roi, (target_width, target_height), interpolation=interpolation)
+    return cv2.cvtColor(roi, cv2.COLOR_BGR2RGB)
+
+
+def _fourcc_to_str(value):
+    value = int(value)
+    return "".join(chr((value >> (8 * i)) & 0xFF) for i in range(4))
+
+
+def probe_capture_modes(device_index=DEFAULT_CAMERA_INDEX, formats=CAPTURE_FORMATS, sizes=None, samples=10):
+    """
+    カメラが対応しているモードを調べ、モードごとの取得・デコードにかかる時間を計測する
+
+    :return: モードごとの計測結果のリスト
+    """
+    results = []
+    seen = set()
+    cap = cv2.VideoCapture(device_index)
+    if not cap.isOpened():
+        print(f"エラー: Webカメラ (index: {device_index}) を開けません")
+        return results
+
+    try:
+        for fourcc in formats:
+            for size in (sizes or CANDIDATE_SIZES):
+                configure_capture(cap, fourcc, size)
+                actual = (
+                    int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                    int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+                )
+                actual_format = _fourcc_to_str(cap.get(cv2.CAP_PROP_FOURCC))
+                # ドライバが別のモードにフォールバックした場合は未対応とみなす
+                if actual != tuple(size) or actual_format != fourcc:
+                    continue
+                if (actual_format, actual) in seen:
+                    continue
+                seen.add((actual_format, actual))
+
+                # 露出が安定するまでの最初の数フレームは捨てる
+                for _ in range(5):
+                    cap.read()
+
+                grab_times = []
+                decode_times = []
+                for _ in range(samples):
+                    t0 = time.perf_counter()
+                    if not cap.grab():
+                        break
+                    t1 = time.perf_counter()
+                    ret, _frame = cap.retrieve()
+                    t2 = time.perf_counter()
+                    if not ret:
+                        break
+                    grab_times.append(t1 - t0)
+                    decode_times.append(t2 - t1)
+                if not decode_times:
+                    continue
+
+                results.append({
+                    "format": fourcc,
+                    "width": actual[0],
+                    "height": actual[1],
+                    "grab_ms": sum(grab_times) / len(grab_times) * 1000,
+                    "decode_ms": sum(decode_times) / len(decode_times) * 1000,
+                })
+    finally:
+        cap.release()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Webカメラの対応モードとデコードコストを計測します")
+    parser.add_argument("--index", type=int, default=DEFAULT_CAMERA_INDEX, help="カメラのインデックス")
+    parser.add_argument("--samples", type=int, default=10, help="モードごとの計測フレーム数")
+    parser.add_argument("--save", action="store_true", help="計測結果をsettings.jsonのcamera_modesに保存する")
+    args = parser.parse_args()
+
+    results = probe_capture_modes(args.index, samples=args.samples)
+    if not results:
+        print("対応しているモードが見つかりませんでした。")
+        return
+
+    print(f"{'format':<6} {'size':>10} {'grab(ms)':>9} {'decode(ms)':>11}")
+    for mode in results:
+        size = f"{mode['width']}x{mode['height']}"
+        print(f"{mode['format']:<6} {size:>10} {mode['grab_ms']:>9.2f} {mode['decode_ms']:>11.2f}")
+
+    if args.save:
+        from utils.config import update_settings
+        update_settings({"camera_modes": results})
+        print("計測結果を settings.json に保存しました。")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+import argparse
+import os
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+
+from utils.config import load_settings
+from utils.ffmpeg import build_ffmpeg_command, build_output_args, ingest_rate
+
+STANDIN_URL = "rtmp://127.0.0.1:19350/live/standin"
+# 何も待ち受けていないポート（失敗する配信先の代わり）
+DEAD_URL = "rtmp://127.0.0.1:19351/live/dead"
+
+
+def probe_duration(path):
+    """
+    ffprobeで出力の長さを調べる
+
+    :param path: 調べるファイルのパス
+    :return: (長さ（秒）, 調べられなかった理由。調べられた場合はNone)
+    """
+    try:
+        output = subprocess.check_output(
+            ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "csv=p=0", path],
+            stderr=subprocess.DEVNULL,
+        )
+        return float(output.strip() or 0), None
+    except FileNotFoundError:
+        return 0.0, "ffprobeが見つかりません"
+    except (subprocess.CalledProcessError, ValueError):
+        return 0.0, None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="1回のエンコードから複数の配信先に送れるかをローカルで確認します")
+    parser.add_argument("--duration", type=float, default=10, help="送信する時間（秒）")
+    args = parser.parse_args()
+
+    settings = {**load_settings(), "resolution": "640x360", "fps": 30}
+    width, height = map(int, settings["resolution"].split("x"))
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        standin_path = os.path.join(tmpdir, "standin.flv")
+        file_path = os.path.join(tmpdir, "record.mp4")
+        hls_dir = os.path.join(tmpdir, "hls")
+        targets = [
+            {"type": "rtmp", "url": STANDIN_URL},
+            {"type": "rtmp", "url": DEAD_URL},
+            {"type": "file", "path": file_path},
+            {"type": "hls", "path": hls_dir},
+        ]
+
+        # RTMPの受信側の代わりにffmpegを待ち受けさせる
+        standin = subprocess.Popen(
+            ["ffmpeg", "-y", "-loglevel", "error", "-listen", "1", "-f", "flv", "-i", STANDIN_URL, "-c", "copy", standin_path]
+        )
+        time.sleep(1)
+
+        command = build_ffmpeg_command(settings, build_output_args(targets))
+        command[1:1] = ["-loglevel", "error"]
+        encoder = subprocess.Popen(command, stdin=subprocess.PIPE)
+
+        frame = np.zeros((height, width, 3), dtype=np.uint8)
+        interval = 1.0 / ingest_rate(settings)
+        start = time.monotonic()
+        i = 0
+        try:
+            try:
+                while time.monotonic() - start < args.duration and encoder.poll() is None:
+                    frame[:] = (i * 7) % 255
+                    encoder.stdin.write(memoryview(frame).cast("B"))
+                    i += 1
+                    time.sleep(interval)
+            except BrokenPipeError:
+                pass
+            # stdinを閉じると、-shortestにより映像の終わりで全ての出力を書き終えて終了する
+            try:
+                encoder.stdin.close()
+            except BrokenPipeError:
+                pass
+            encoder.wait(timeout=30)
+            standin.wait(timeout=30)
+        finally:
+            # 終了しなかった場合もffmpegを残さない
+            for process in (encoder, standin):
+                if process.poll() is None:
+                    process.kill()
+                    process.wait()
+
+        results = {
+            "rtmp (stand-in)": probe_duration(standin_path),
+            "file": probe_duration(file_path),
+            "hls": probe_duration(os.path.join(hls_dir, "index.m3u8")),
+        }
+        print(f"エンコーダーの終了コード: {encoder.returncode}")
+        print(f"失敗する配信先 ({DEAD_URL}) を含めて送信しました。")
+        ok = True
+        for name, (duration, error) in results.items():
+            status = "OK" if duration > 0 else "NG"
+            ok = ok and duration > 0
+            print(f"{name:<16} {duration:6.1f}秒 {status}" + (f" ({error})" if error else ""))
+        if ok:
+            print("✅ 1つの配信先が失敗しても、他の配信先には送信されました。")
+        else:
+            print("❌ 受信できなかった配信先があります。")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+import threading
+
+
+class LayerCache:
+    """
+    描画済みのレイヤーを入力値（キー）ごとにキャッシュする
+
+    レイヤー名ごとに直近の1枚だけを保持し、キーが変わったときだけ再描画する
+    """
+
+    def __init__(self):
+        self._layers = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, name, key, render):
+        """
+        nameのレイヤーを返す。キャッシュのキーがkeyと異なる場合はrender()で描画し直す
+
+        :param name: レイヤー名
+        :param key: レイヤーの内容を決める入力値のタプル
+        :param render: レイヤーを描画する引数なしの関数
+        """
+        with self._lock:
+            cached = self._layers.get(name)
+            if cached is not None and cached[0] == key:
+                self.hits += 1
+                return cached[1]
+
+        layer = render()
+        with self._lock:
+            self._layers[name] = (key, layer)
+            self.misses += 1
+        return layer
+
+    def clear(self):
+        with self._lock:
+            self._layers.clear()
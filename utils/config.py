@@ -1,42 +1,53 @@
+import copy
 import json
+import os
+import tempfile
+import threading
+import time
 
 FONT_PATH = "font/MPLUS1p-Regular.ttf"
 SETTINGS_JSON_PATH = "settings.json"
+DEFAULT_STREAM_ID = "default"
 
+# 選択できる解像度
+RESOLUTION_CHOICES = [
+    ("1920x1080", "1080p"),
+    ("1280x720", "720p"),
+    ("854x480", "480p"),
+    ("640x360", "360p"),
+    ("426x240", "240p"),
+]
 
-def load_settings():
-    default_settings = {
-        "lower_text": "テキスト",
-        "right_long_text": "# デフォルトテキスト\n- 例1\n- 例2",
-        "font_path": FONT_PATH,
-        "interval": 5,  # デフォルトのインターバル（秒）
-        "stream_key": "YOUR_YOUTUBE_STREAM_KEY",  # デフォルトのストリームキー
-        "resolution": "1280x720",  # デフォルトの解像度
-        "fps": 30,  # デフォルトのFPS
-        "youtube": {
-            "title": "テスト",
-            "description": "テスト配信",
-            "privacy": "unlisted",
-        },
-    }
-    try:
-        with open(SETTINGS_JSON_PATH, "r", encoding="utf-8") as f:
-            settings = json.load(f)
-            # 不足しているキーをデフォルト値で補完
-            return {**default_settings, **settings}
-    except FileNotFoundError:
-        print(
-            f"エラー: 設定ファイル {SETTINGS_JSON_PATH} が見つかりません。デフォルト値を使用します。"
-        )
-        return default_settings
-    except json.JSONDecodeError:
-        print(
-            f"エラー: 設定ファイル {SETTINGS_JSON_PATH} の読み込みに失敗しました。デフォルト値を使用します。"
-        )
-        return default_settings
-    except Exception as e:
-        print(f"エラー: 予期せぬエラーが発生しました: {e}。デフォルト値を使用します。")
-        return default_settings
+
+DEFAULT_SETTINGS = {
+    "lower_text": "テキスト",
+    "right_long_text": "# デフォルトテキスト\n- 例1\n- 例2",
+    "font_path": FONT_PATH,
+    "interval": 5,  # デフォルトのインターバル（秒）
+    "stream_key": "YOUR_YOUTUBE_STREAM_KEY",  # デフォルトのストリームキー
+    "resolution": "1280x720",  # デフォルトの解像度
+    "fps": 30,  # デフォルトのFPS
+    "ingest_mode": "full",  # ffmpegへの入力方式 ("full" / "low_rate")
+    "ingest_fps": 1,  # low_rateでffmpegに書き込むFPS
+    "write_stall_seconds": 0.5,  # パイプへの書き込みが停滞したとみなす時間（秒）
+    "write_queue_size": 2,  # 書き込み待ちのキューに入れておけるフレーム数
+    "write_queue_policy": "duplicate",  # キューが満杯のときの扱い ("drop": 捨てる / "duplicate": 追いついたら書き込み直す)
+    "encoder_profile": "auto",  # エンコーダープロファイル ("auto" / "eco" / "balanced" / "quality")
+    "cpu_budget": "medium",  # autoでプロファイルを選ぶときのCPU予算 ("low" / "medium" / "high")
+    "camera_index": 2,  # 使用するWebカメラのインデックス
+    "render_backend": "pil",  # 描画バックエンド ("pil" / "numpy")
+    "render_process": False,  # カメラ取得と描画を配信ごとの別プロセスで行う
+    "youtube": {
+        "enabled": True,  # falseならYouTubeのライブ配信を作成せず、outputsの配信先だけに出力する
+        "title": "テスト",
+        "description": "テスト配信",
+        "privacy": "unlisted",
+        "ingest": "per_start",  # 受信先 ("per_start": 開始ごとに作成 / "persistent": 固定のストリームを使い回す)
+        "broadcast_pool": 1,  # persistentで事前に作成しておくライブ配信の数
+        "fake": False,  # YouTube APIの代わりに通信しない偽物を使う（オフラインでの確認用）
+        "fake_latency": 0.0,  # 偽物のAPIの1回の呼び出しにかかる時間（秒）
+    },
+}
 
 
 def deep_merge(original, updates):
@@ -47,20 +58,181 @@ def deep_merge(original, updates):
             original[key] = value
     return original
 
+
+class SettingsStore:
+    """
+    settings.jsonの内容をメモリ上に保持する設定ストア
+
+    ファイルの更新時刻が変わったときだけ読み直し、書き込みはロックの下で
+    一時ファイルへの書き込みとリネームによってアトミックに行う。
+    変更があった場合は購読している関数に新しい設定を通知する。
+
+    :param path: 設定ファイルのパス
+    :param check_interval: ファイルの更新時刻を確認する最短間隔（秒）
+    """
+
+    def __init__(self, path=SETTINGS_JSON_PATH, check_interval=1.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._lock = threading.RLock()
+        self._raw = {}
+        self._snapshot = None
+        self._mtime = None
+        self._last_check = 0.0
+        self._subscribers = []
+
+    def get(self):
+        """
+        デフォルト値で補完した設定を返す（返り値は共有されるので書き換えないこと）
+        """
+        now = time.monotonic()
+        if self._snapshot is not None and now - self._last_check < self.check_interval:
+            return self._snapshot
+
+        changed = False
+        with self._lock:
+            self._last_check = now
+            mtime = self._current_mtime()
+            if self._snapshot is None or mtime != self._mtime:
+                changed = self._snapshot is not None
+                self._reload(mtime)
+            snapshot = self._snapshot
+        if changed:
+            self._notify(snapshot)
+        return snapshot
+
+    def update(self, updates):
+        """
+        設定を差分マージして保存する
+        """
+        with self._lock:
+            # 他のプロセスが書き換えている可能性があるので最新の内容にマージする
+            mtime = self._current_mtime()
+            if self._snapshot is None or mtime != self._mtime:
+                self._reload(mtime)
+
+            merged_data = deep_merge(copy.deepcopy(self._raw), updates)
+            self._write(merged_data)
+
+            self._raw = merged_data
+            self._snapshot = {**DEFAULT_SETTINGS, **merged_data}
+            self._mtime = self._current_mtime()
+            self._last_check = time.monotonic()
+            snapshot = self._snapshot
+        self._notify(snapshot)
+        return snapshot
+
+    def subscribe(self, callback):
+        """
+        設定が変更されたときに callback(settings) を呼び出すよう登録する
+        """
+        with self._lock:
+            if callback not in self._subscribers:
+                self._subscribers.append(callback)
+        return callback
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+
+    def _current_mtime(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _reload(self, mtime):
+        self._mtime = mtime
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self._raw = json.load(f)
+        except FileNotFoundError:
+            print(
+                f"エラー: 設定ファイル {self.path} が見つかりません。デフォルト値を使用します。"
+            )
+            self._raw = {}
+        except json.JSONDecodeError:
+            print(
+                f"エラー: 設定ファイル {self.path} の読み込みに失敗しました。デフォルト値を使用します。"
+            )
+            self._raw = {}
+        except Exception as e:
+            print(f"エラー: 予期せぬエラーが発生しました: {e}。デフォルト値を使用します。")
+            self._raw = {}
+        # 不足しているキーをデフォルト値で補完
+        self._snapshot = {**DEFAULT_SETTINGS, **self._raw}
+
+    def _write(self, data):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(prefix=".settings-", suffix=".json", dir=directory)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(data, f, indent=4, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _notify(self, snapshot):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for callback in subscribers:
+            try:
+                callback(snapshot)
+            except Exception as e:
+                print(f"エラー: 設定変更の通知中にエラーが発生しました: {e}")
+
+
+settings_store = SettingsStore()
+
+
+def load_settings():
+    return settings_store.get()
+
+
 def update_settings(updates):
-    # 設定ファイル読み込み
-    try:
-        with open(SETTINGS_JSON_PATH, 'r') as f:
-            original_data = json.load(f)
-    except FileNotFoundError:
-        original_data = {}
-
-    # 差分マージ
-    merged_data = deep_merge(original_data, updates)
-
-    # ファイルに保存
-    with open(SETTINGS_JSON_PATH, 'w') as f:
-        json.dump(merged_data, f, indent=4, ensure_ascii=False)
+    return settings_store.update(updates)
+
+
+def stream_ids(settings=None):
+    """
+    設定のstreamsに書かれた配信の一覧を返す（未設定なら既定の配信のみ）
+    """
+    settings = settings or load_settings()
+    return list(settings.get("streams", {}).keys()) or [DEFAULT_STREAM_ID]
+
+
+def stream_settings(stream_id=DEFAULT_STREAM_ID, settings=None):
+    """
+    共通の設定に、streamsに書かれた配信ごとの設定を上書きしたものを返す
+    """
+    settings = settings or load_settings()
+    profile = settings.get("streams", {}).get(stream_id)
+    if not profile:
+        return settings
+    return deep_merge(copy.deepcopy(settings), profile)
+
+
+def youtube_enabled(settings):
+    return settings.get("youtube", {}).get("enabled", True)
+
+
+def tweet_enabled(settings):
+    # tweetの設定が書かれていて、無効にされていなければ配信開始を投稿する
+    tweet = settings.get("tweet")
+    return bool(tweet) and tweet.get("enabled", True)
+
+
+def subscribe_settings(callback):
+    return settings_store.subscribe(callback)
+
+
+def unsubscribe_settings(callback):
+    settings_store.unsubscribe(callback)
 
 if __name__ == "__main__":
     # 設定の読み込み
@@ -0,0 +1,132 @@
+import time
+
+# 起動時間の計測の基準（このモジュールの読み込みが始まった時点）
+_LOAD_STARTED = time.perf_counter()
+
+import argparse
+import signal
+import sys
+import threading
+
+from utils.config import load_settings, stream_ids
+from utils.stream_state import ERROR, stream_states
+
+DEFAULT_DAEMON_SETTINGS = {
+    "streams": None,  # 起動時に開始する配信IDのリスト (Noneならstreamsに書かれた全ての配信)
+    "check_interval": 1.0,  # 配信が全て止まっていないか確認する間隔（秒）
+}
+
+# 起動時間に含めたくないライブラリ（読み込まれていれば表示する）
+OPTIONAL_MODULES = ("flask", "wtforms", "googleapiclient", "tweepy")
+
+
+def daemon_settings(settings):
+    return {**DEFAULT_DAEMON_SETTINGS, **settings.get("daemon", {})}
+
+
+def wait_for(condition, since, deadline, give_up=lambda: False, interval=0.01):
+    """
+    conditionがTrueを返すまで待ち、sinceからの経過秒数を返す
+
+    :return: 経過秒数、deadline（perf_counterの値）を過ぎたかgive_upがTrueを返した場合はNone
+    """
+    while time.perf_counter() < deadline:
+        if condition():
+            return time.perf_counter() - since
+        if give_up():
+            return None
+        time.sleep(interval)
+    return None
+
+
+def first_frame_published(streamer):
+    return streamer is not None and streamer.frame_handoff.latest()[0] > 0
+
+
+def first_frame_written(streamer):
+    return streamer is not None and streamer.writer is not None and streamer.writer.connected
+
+
+def report_startup(timings):
+    print("起動時間:")
+    for label, seconds in timings:
+        print(f"  {label:<24} {'未完了' if seconds is None else f'{seconds:.3f}秒'}")
+    loaded = [name for name in OPTIONAL_MODULES if name in sys.modules]
+    print(f"  読み込まれた連携ライブラリ: {', '.join(loaded) if loaded else 'なし'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Webインターフェースなしで、設定ファイルのとおりに配信を行います")
+    parser.add_argument("--stream", action="append", help="開始する配信ID（複数指定可、省略時は設定のdaemon.streams）")
+    parser.add_argument(
+        "--measure-startup",
+        action="store_true",
+        help="最初のフレームをffmpegに書き込むまでの時間を計測して終了する",
+    )
+    parser.add_argument("--timeout", type=float, default=60.0, help="--measure-startupで待つ最大の時間（秒）")
+    args = parser.parse_args()
+
+    settings = load_settings()
+    config = daemon_settings(settings)
+    targets = args.stream or config["streams"] or stream_ids(settings)
+
+    # 描画とエンコードに必要なモジュールだけを読み込む（Flask・YouTube・Twitterは使う場合だけ）
+    import_started = time.perf_counter()
+    from utils.manager import StreamManager
+
+    timings = [
+        ("設定の読み込みまで", import_started - _LOAD_STARTED),
+        ("配信処理の読み込み", time.perf_counter() - import_started),
+    ]
+
+    stop_event = threading.Event()
+
+    def request_stop(signum, _frame):
+        print(f"\nシグナル ({signal.Signals(signum).name}) を受け取りました。配信を終了します。")
+        stop_event.set()
+
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+
+    manager = StreamManager()
+    threading.Thread(target=manager.provision, daemon=True).start()
+    start_requested = time.perf_counter()
+    for stream_id in targets:
+        if not manager.start(stream_id):
+            print(f"警告: 配信 {stream_id} を開始できませんでした（設定のstreamsにありません）")
+
+    exit_code = 0
+    try:
+        if args.measure_startup:
+            # 全ての配信で最初のフレームを書き込むまで待って、起動時間を表示する
+            deadline = start_requested + args.timeout
+            for stream_id in targets:
+                # 配信の開始は別スレッドで行われるので、エラーで止まった場合だけあきらめる
+                stopped = lambda: stream_states.get(stream_id)["state"] == ERROR
+                published = wait_for(
+                    lambda: first_frame_published(manager.get(stream_id)), start_requested, deadline, stopped
+                )
+                written = wait_for(
+                    lambda: first_frame_written(manager.get(stream_id)), start_requested, deadline, stopped
+                )
+                timings.append((f"[{stream_id}] 最初のフレーム", published))
+                timings.append((f"[{stream_id}] 最初の書き込み", written))
+                if written is None:
+                    exit_code = 1
+            report_startup(timings)
+            return exit_code
+
+        report_startup(timings)
+        while not stop_event.wait(config["check_interval"]):
+            if not any(manager.is_running(stream_id) for stream_id in targets):
+                # 全ての配信がエラーで止まった。サービスの管理側に再起動を任せる
+                print("エラー: 実行中の配信がなくなりました。終了します。")
+                exit_code = 1
+                break
+        return exit_code
+    finally:
+        manager.stop_all()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,259 @@
+import os
+import shlex
+from datetime import datetime
+
+# ffmpegへの入力方式
+#   full: Python側で出力FPSのとおりにフレームを書き込む
+#   low_rate: 低いレートでフレームを書き込み、出力FPSへの複製はffmpegに任せる
+INGEST_MODES = ("full", "low_rate")
+
+# 解像度ごとのビットレート (kbps): (b:v, maxrate, bufsize)
+BITRATE_LADDER = {
+    "1920x1080": (4500, 6000, 9000),
+    "1280x720": (2500, 3000, 5000),
+    "854x480": (1200, 1500, 2400),
+    "640x360": (800, 1000, 1600),
+    "426x240": (400, 500, 800),
+}
+
+# ほぼ静止画のタイムラプス向けのエンコーダープロファイル
+#   bitrate_scale: BITRATE_LADDERに掛ける倍率
+#   keyframe_seconds: キーフレーム間隔（YouTubeの推奨は2秒、上限は4秒）
+#   threads: x264のスレッド数 (0は自動)
+ENCODER_PROFILES = {
+    "eco": {
+        "preset": "superfast",
+        "tune": "stillimage",
+        "threads": 1,
+        "bitrate_scale": 0.6,
+        "keyframe_seconds": 2,
+    },
+    "balanced": {
+        "preset": "veryfast",
+        "tune": "stillimage",
+        "threads": 2,
+        "bitrate_scale": 0.8,
+        "keyframe_seconds": 2,
+    },
+    "quality": {
+        "preset": "medium",
+        "tune": "stillimage",
+        "threads": 0,
+        "bitrate_scale": 1.0,
+        "keyframe_seconds": 2,
+    },
+}
+
+# cpu_budgetごとに自動で選ぶプロファイル（720pを超える解像度では1段階軽くする）
+PROFILE_BY_CPU_BUDGET = {
+    "low": ["eco", "eco"],
+    "medium": ["balanced", "eco"],
+    "high": ["quality", "balanced"],
+}
+
+
+def ingest_rate(settings):
+    """
+    ffmpegのパイプに1秒あたり何フレーム書き込むかを返す
+    """
+    fps = settings.get("fps", 30)
+    if settings.get("ingest_mode", "full") == "low_rate":
+        return min(settings.get("ingest_fps", 1), fps)
+    return fps
+
+
+def encoder_profiles(settings):
+    """
+    組み込みのプロファイルに、設定ファイルのencoder_profilesを上書きしたものを返す
+    """
+    profiles = {name: dict(profile) for name, profile in ENCODER_PROFILES.items()}
+    for name, overrides in settings.get("encoder_profiles", {}).items():
+        profiles[name] = {**profiles.get(name, ENCODER_PROFILES["balanced"]), **overrides}
+    return profiles
+
+
+def select_encoder_profile(settings):
+    """
+    設定の解像度とCPU予算からエンコーダープロファイルを選ぶ
+
+    :return: (プロファイル名, プロファイル)
+    """
+    profiles = encoder_profiles(settings)
+    name = settings.get("encoder_profile", "auto")
+    if name == "auto" or name not in profiles:
+        if name != "auto":
+            print(f"警告: エンコーダープロファイル {name} が見つかりません。自動で選択します。")
+        width, height = map(int, settings.get("resolution", "1280x720").split("x"))
+        candidates = PROFILE_BY_CPU_BUDGET.get(
+            settings.get("cpu_budget", "medium"), PROFILE_BY_CPU_BUDGET["medium"]
+        )
+        name = candidates[1] if width * height > 1280 * 720 else candidates[0]
+    return name, profiles[name]
+
+
+def bitrate_for(resolution, profile):
+    """
+    解像度とプロファイルから (b:v, maxrate, bufsize) をkbpsで返す
+    """
+    if resolution in BITRATE_LADDER:
+        ladder = BITRATE_LADDER[resolution]
+    else:
+        # 一覧にない解像度は画素数の比でスケールする
+        width, height = map(int, resolution.split("x"))
+        ratio = width * height / (1280 * 720)
+        ladder = tuple(value * ratio for value in BITRATE_LADDER["1280x720"])
+    scale = profile.get("bitrate_scale", 1.0)
+    return tuple(int(value * scale) for value in ladder)
+
+
+def encoder_args(settings, profile=None):
+    """
+    映像エンコーダー（libx264）の引数を返す
+    """
+    if profile is None:
+        _name, profile = select_encoder_profile(settings)
+    fps = settings.get("fps", 30)
+    bitrate, maxrate, bufsize = bitrate_for(settings.get("resolution", "1280x720"), profile)
+    gop = max(1, int(round(fps * profile.get("keyframe_seconds", 2))))
+
+    args = [
+        "-c:v", "libx264",
+        "-preset", profile.get("preset", "veryfast"),
+        "-pix_fmt", "yuv420p",
+        "-g", str(gop),
+        "-keyint_min", str(gop),
+        "-sc_threshold", "0",
+        "-threads", str(profile.get("threads", 0)),
+        "-b:v", f"{bitrate}k",
+        "-maxrate", f"{maxrate}k",
+        "-bufsize", f"{bufsize}k",
+    ]
+    if profile.get("tune"):
+        args += ["-tune", profile["tune"]]
+    return args
+
+
+def output_targets(settings, rtmp_url=None):
+    """
+    配信先の一覧を返す
+
+    rtmp_url（YouTubeのインジェストURL）を先頭に、設定のoutputsに書かれた
+    予備のRTMP・ローカルファイル・HLSを続ける。rtmp_urlの配信先はprimaryとする
+
+    :return: {"type": "rtmp" / "file" / "hls", ...} のリスト
+    """
+    targets = []
+    if rtmp_url:
+        targets.append({"type": "rtmp", "url": rtmp_url, "primary": True})
+    for target in settings.get("outputs", []):
+        if target.get("enabled", True):
+            targets.append(target)
+    return targets
+
+
+def _target_format(target):
+    # (マルチプレクサ, マルチプレクサのオプション, 出力先) を返す
+    kind = target.get("type", "rtmp")
+    if kind == "rtmp":
+        return "flv", {"flvflags": "no_duration_filesize"}, target["url"]
+    if kind == "file":
+        path = datetime.now().strftime(target.get("path", "recordings/%Y%m%d-%H%M%S.mp4"))
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        if path.endswith(".mp4"):
+            # 途中で終了しても再生できるよう断片化したMP4にする
+            return "mp4", {"movflags": "frag_keyframe+empty_moov"}, path
+        return target.get("format", "matroska"), {}, path
+    if kind == "hls":
+        directory = target.get("path", "hls")
+        os.makedirs(directory, exist_ok=True)
+        options = {
+            "hls_time": str(target.get("segment_seconds", 4)),
+            "hls_list_size": str(target.get("list_size", 10)),
+            "hls_flags": "delete_segments",
+        }
+        return "hls", options, os.path.join(directory, target.get("playlist", "index.m3u8"))
+    raise ValueError(f"不明な出力先の種類です: {kind}")
+
+
+def _tee_escape(value):
+    # teeの出力指定で特別な意味を持つ文字をエスケープする
+    for char in ("\\", "|", "[", "]"):
+        value = value.replace(char, "\\" + char)
+    return value
+
+
+def build_output_args(targets):
+    """
+    配信先の一覧からffmpegの出力引数を組み立てる
+
+    配信先が複数ある場合はteeマルチプレクサで1回のエンコード結果を全ての配信先に送る。
+    primaryの配信先（YouTube）以外は onfail=ignore を指定するベストエフォートの配信先で、
+    失敗しても他の配信先は止まらない。primaryの配信先は失敗したらffmpegごと終了させ
+    （接続時の失敗はteeが終了しないので、FFmpegSupervisorがfatal_output_patternsで検知する）、
+    起動し直して接続し直す。配信が止まったまま動いているように見えないようにするため。
+    """
+    if not targets:
+        raise ValueError("配信先が指定されていません")
+
+    if len(targets) == 1:
+        muxer, options, url = _target_format(targets[0])
+        args = ["-f", muxer]
+        for key, value in options.items():
+            args += [f"-{key}", value]
+        return args + [url]
+
+    slaves = []
+    for target in targets:
+        muxer, options, url = _target_format(target)
+        slave_options = [f"f={muxer}"]
+        if not target.get("primary"):
+            slave_options.append("onfail=ignore")
+        if options:
+            # マルチプレクサのオプションは ":" 区切りで渡し、値の中の ":" はエスケープする
+            slave_options += [key + "=" + value.replace(":", "\\:") for key, value in options.items()]
+        slaves.append("[" + ":".join(slave_options) + "]" + _tee_escape(url))
+    return ["-flags", "+global_header", "-f", "tee", "|".join(slaves)]
+
+
+def fatal_output_patterns(targets):
+    """
+    ffmpegの標準エラー出力のうち、primaryの配信先が失敗したことを示す行の正規表現を返す
+
+    teeマルチプレクサは接続時の失敗ではonfailの指定にかかわらず残りの配信先で動き続けるので、
+    FFmpegSupervisorはこの行を見つけたらffmpegを起動し直す
+    """
+    if len(targets) < 2:
+        # 配信先が1つならffmpegごと終了する
+        return ()
+    return tuple(rf"Slave muxer #{index} failed" for index, target in enumerate(targets) if target.get("primary"))
+
+
+def build_ffmpeg_command(settings, output_args):
+    """
+    設定からffmpegのコマンドラインを組み立てる
+
+    :param settings: 設定
+    :param output_args: 出力先を指定する引数のリスト (例: ["-f", "flv", "rtmp://..."])
+    :return: subprocess.Popenに渡す引数のリスト
+    """
+    resolution = settings.get("resolution")
+    fps = settings.get("fps")
+    input_fps = ingest_rate(settings)
+
+    if input_fps != fps:
+        # 入力は低いレートで受け取り、fpsフィルタで固定フレームレートに複製する
+        video_filter = f"-vf fps={fps} -r {fps} "
+    else:
+        video_filter = ""
+
+    return (
+        shlex.split(
+            f"ffmpeg -y -f rawvideo -vcodec rawvideo -pix_fmt rgb24 -s {resolution} -r {input_fps} -i - "
+            f"-f lavfi -i anullsrc=channel_layout=stereo:sample_rate=44100 "
+            f"{video_filter}"
+        )
+        + encoder_args(settings)
+        # 無音の音声入力は終わらないので、映像（stdin）が終わったら出力も終える
+        + shlex.split("-c:a aac -b:a 96k -ac 2 -ar 44100 -map 0:v -map 1:a -shortest")
+        + list(output_args)
+    )
@@ -0,0 +1,326 @@
+import re
+import subprocess
+import sys
+import threading
+import time
+
+from utils.metrics import FFMPEG_RESTARTS, FFMPEG_STALLS
+
+DEFAULT_SUPERVISOR_SETTINGS = {
+    "stall_seconds": 20,  # 進捗の報告がこの時間途絶えたら停滞とみなして再起動する
+    "initial_backoff": 1,  # 最初の再起動までの待ち時間（秒）、再起動のたびに2倍にする
+    "max_backoff": 30,  # 再起動までの待ち時間の上限（秒）
+    "stable_seconds": 60,  # この時間以上動き続けたら待ち時間を最初の値に戻す
+    "max_restarts": 0,  # 連続して再起動する回数の上限 (0なら無制限)
+}
+
+# -progressで報告される値のうち数値として扱うもの
+_INT_KEYS = ("frame", "dup_frames", "drop_frames", "total_size", "out_time_us")
+_FLOAT_KEYS = ("fps",)
+
+
+def supervisor_settings(settings):
+    return {**DEFAULT_SUPERVISOR_SETTINGS, **settings.get("ffmpeg_supervisor", {})}
+
+
+def parse_progress(block):
+    """
+    ffmpegの-progressの1回分の報告 ({キー: 文字列}) を数値に変換する
+
+    :return: fps, bitrate_kbps, speed, frame, dup_frames, drop_frames などの辞書
+    """
+    stats = {}
+    for key in _INT_KEYS:
+        try:
+            stats[key] = int(block[key])
+        except (KeyError, ValueError):
+            pass
+    for key in _FLOAT_KEYS:
+        try:
+            stats[key] = float(block[key])
+        except (KeyError, ValueError):
+            pass
+    bitrate = block.get("bitrate", "N/A")
+    if bitrate.endswith("kbits/s"):
+        try:
+            stats["bitrate_kbps"] = float(bitrate[: -len("kbits/s")])
+        except ValueError:
+            pass
+    speed = block.get("speed", "N/A").strip()
+    if speed.endswith("x"):
+        try:
+            stats["speed"] = float(speed[:-1])
+        except ValueError:
+            pass
+    return stats
+
+
+class FFmpegSupervisor:
+    """
+    ffmpegのプロセスを監視し、終了や停滞を検知したら待ち時間を伸ばしながら再起動する
+
+    進捗は `-progress pipe:1` の出力から読み取り、エンコードのFPS・ビットレート・速度・
+    複製/破棄されたフレーム数を構造化したデータとして保持する。
+    フレームはwrite()で渡す。再起動中のフレームは捨てられ、呼び出し側が最新のフレームを
+    書き込み続けることで再起動後すぐに出力が再開する。
+
+    :param command_factory: 起動のたびに呼び出してffmpegのコマンドラインを返す関数
+    :param name: ログとメトリクスに使う配信ID
+    :param fatal_patterns: 標準エラー出力にこの正規表現に一致する行があれば、ffmpegが動き続けていても
+        異常終了とみなして再起動する（teeのprimaryの配信先の失敗など）
+    """
+
+    def __init__(
+        self,
+        command_factory,
+        name="default",
+        stall_seconds=20,
+        initial_backoff=1,
+        max_backoff=30,
+        stable_seconds=60,
+        max_restarts=0,
+        fatal_patterns=(),
+    ):
+        self.command_factory = command_factory
+        self.name = name
+        self.stall_seconds = stall_seconds
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.stable_seconds = stable_seconds
+        self.max_restarts = max_restarts
+        self.fatal_patterns = [re.compile(pattern) for pattern in fatal_patterns]
+
+        self.failed = None  # 再起動をあきらめた場合はその理由
+        self.started_at = None
+        self.restarts = 0
+        self.last_exit_code = None
+        self._process = None
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._last_progress = None
+        self._fatal_output = None  # fatal_patternsに一致した行
+        self._stop_event = threading.Event()
+        self._restart_requested = threading.Event()
+        self._thread = None
+
+    @classmethod
+    def from_settings(cls, command_factory, settings, name="default", fatal_patterns=()):
+        config = supervisor_settings(settings)
+        return cls(
+            command_factory,
+            name=name,
+            fatal_patterns=fatal_patterns,
+            stall_seconds=config["stall_seconds"],
+            initial_backoff=config["initial_backoff"],
+            max_backoff=config["max_backoff"],
+            stable_seconds=config["stable_seconds"],
+            max_restarts=config["max_restarts"],
+        )
+
+    def start(self):
+        """
+        最初のffmpegを起動し、監視スレッドを開始する
+
+        :raises FileNotFoundError: ffmpegが見つからない場合
+        """
+        process = self._spawn()
+        self._thread = threading.Thread(target=self._run, args=(process,), daemon=True)
+        self._thread.start()
+
+    def is_alive(self):
+        process = self._process
+        return process is not None and process.poll() is None
+
+    def write(self, data):
+        """
+        フレームをffmpegに書き込む
+
+        :return: 書き込めた場合はTrue、ffmpegが起動していないか書き込みに失敗した場合はFalse
+        """
+        process = self._process
+        if process is None or process.poll() is not None:
+            return False
+        try:
+            process.stdin.write(data)
+            process.stdin.flush()
+            return True
+        except (BrokenPipeError, OSError, ValueError):
+            # パイプが閉じられた。再起動は監視スレッドが行う
+            return False
+
+    def stats(self):
+        """
+        エンコーダーの状態を返す
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            last_progress = self._last_progress
+        now = time.monotonic()
+        return {
+            **stats,
+            "running": self.is_alive(),
+            "pid": self._process.pid if self._process else None,
+            "uptime_seconds": now - self.started_at if self.started_at and self.is_alive() else 0.0,
+            "progress_age_seconds": now - last_progress if last_progress else None,
+            "restarts": self.restarts,
+            "last_exit_code": self.last_exit_code,
+            "failed": self.failed,
+        }
+
+    def restart(self):
+        """
+        設定の変更を反映するため、待ち時間なしでffmpegを起動し直す
+        """
+        with self._lock:
+            self._restart_requested.set()
+            process = self._process
+        if process is not None:
+            self._terminate(process)
+
+    def stop(self, timeout=5):
+        # _spawn()と同じロックの中で停止を記録するので、停止の直後に起動されたffmpegも_spawn()が終了させる
+        with self._lock:
+            self._stop_event.set()
+            process = self._process
+        if process is not None:
+            self._terminate(process, timeout)
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout=timeout)
+
+    def _spawn(self):
+        # これから起動するffmpegには最新の設定が反映されるので、それまでの再起動の要求は済んだことにする
+        # （残しておくと、次に異常終了したときに要求された再起動と誤り、待ち時間と回数の上限を飛ばしてしまう）
+        self._restart_requested.clear()
+        command = list(self.command_factory())
+        # 進捗を標準出力に key=value の形式で報告させる
+        command = command[:1] + ["-progress", "pipe:1"] + command[1:]
+        stderr = subprocess.PIPE if self.fatal_patterns else None
+        process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=stderr)
+        with self._lock:
+            self._stats = {}
+            self._last_progress = time.monotonic()  # 起動直後は進捗がなくても停滞とみなさない
+            self._fatal_output = None
+            self._process = process
+            self.started_at = time.monotonic()
+            stopped = self._stop_event.is_set()
+            # 起動している間に要求された再起動は、コマンドを作った後の設定の変更かもしれない
+            restart_requested = self._restart_requested.is_set()
+        threading.Thread(target=self._read_progress, args=(process,), daemon=True).start()
+        if stderr is not None:
+            threading.Thread(target=self._read_stderr, args=(process,), daemon=True).start()
+        if stopped or restart_requested:
+            # 停止した場合は監視スレッドがそのまま抜け、再起動の場合は待ち時間なしで起動し直す
+            self._terminate(process)
+        return process
+
+    def _read_stderr(self, process):
+        # ffmpegのログはそのまま表示し、fatal_patternsに一致する行を探す
+        for raw_line in process.stderr:
+            line = raw_line.decode("utf-8", "replace")
+            sys.stderr.write(line)
+            if any(pattern.search(line) for pattern in self.fatal_patterns):
+                with self._lock:
+                    if process is self._process and self._fatal_output is None:
+                        self._fatal_output = line.strip()
+
+    def _read_progress(self, process):
+        block = {}
+        for raw_line in process.stdout:
+            line = raw_line.decode("utf-8", "replace").strip()
+            if "=" not in line:
+                continue
+            key, value = line.split("=", 1)
+            block[key] = value
+            if key == "progress":
+                stats = parse_progress(block)
+                with self._lock:
+                    if process is self._process:
+                        self._stats = stats
+                        self._last_progress = time.monotonic()
+                block = {}
+
+    def _run(self, process):
+        backoff = self.initial_backoff
+        consecutive = 0
+        while True:
+            started = time.monotonic()
+            while not self._stop_event.is_set() and process.poll() is None:
+                with self._lock:
+                    progress_age = time.monotonic() - self._last_progress
+                    fatal_output = self._fatal_output
+                if fatal_output:
+                    print(f"[{self.name}] 警告: ffmpegの主な配信先が失敗しました ({fatal_output})。再起動します。")
+                    self._terminate(process)
+                    break
+                if progress_age > self.stall_seconds:
+                    print(f"[{self.name}] 警告: ffmpegの進捗が{progress_age:.0f}秒間ありません。再起動します。")
+                    FFMPEG_STALLS.inc(stream=self.name)
+                    self._terminate(process)
+                    break
+                self._stop_event.wait(0.5)
+            if self._stop_event.is_set():
+                return
+
+            self.last_exit_code = process.wait()
+            if self._restart_requested.is_set():
+                # 要求された再起動は失敗として数えない（要求は_spawn()が片付ける）
+                print(f"[{self.name}] ffmpegを新しい設定で再起動します。")
+                try:
+                    process = self._spawn()
+                except Exception as e:
+                    self.failed = f"ffmpegを再起動できませんでした: {e}"
+                    print(f"[{self.name}] エラー: {self.failed}")
+                    return
+                continue
+            if time.monotonic() - started >= self.stable_seconds:
+                backoff = self.initial_backoff
+                consecutive = 0
+            if self.max_restarts and consecutive >= self.max_restarts:
+                self.failed = f"ffmpegが{consecutive + 1}回続けて終了しました (終了コード: {self.last_exit_code})"
+                print(f"[{self.name}] エラー: {self.failed}")
+                return
+
+            print(f"[{self.name}] ffmpegが終了しました (終了コード: {self.last_exit_code})。{backoff}秒後に再起動します。")
+            if self._stop_event.wait(backoff):
+                return
+            backoff = min(backoff * 2, self.max_backoff)
+            try:
+                process = self._spawn()
+            except Exception as e:
+                self.failed = f"ffmpegを再起動できませんでした: {e}"
+                print(f"[{self.name}] エラー: {self.failed}")
+                return
+            consecutive += 1
+            self.restarts += 1
+            FFMPEG_RESTARTS.inc(stream=self.name)
+
+    @staticmethod
+    def _terminate(process, timeout=5):
+        """
+        stdinを閉じて入力の終わりを伝え、ffmpegがファイルやHLSの出力を書き終えて終了するのを待つ
+
+        timeout以内に終わらなければSIGTERM、それでも終わらなければSIGKILLを送る
+        """
+        # パイプが詰まっているとstdinのclose（残りの書き込み）が終わらないので、別スレッドで閉じる
+        closer = threading.Thread(target=_close_stdin, args=(process,), daemon=True)
+        closer.start()
+        try:
+            process.wait(timeout=timeout)
+            return
+        except subprocess.TimeoutExpired:
+            pass
+        print("警告: ffmpegプロセスが入力の終わりから時間内に終了しませんでした。終了シグナルを送ります。")
+        process.terminate()
+        try:
+            process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            print("警告: ffmpegプロセスが時間内に終了しませんでした。強制終了します。")
+            process.kill()
+            process.wait()
+
+
+def _close_stdin(process):
+    try:
+        process.stdin.close()
+    except (BrokenPipeError, OSError, ValueError):
+        pass
@@ -0,0 +1,65 @@
+import threading
+import time
+
+import numpy as np
+
+from utils.metrics import FRAME_BYTES_COPIED
+
+
+class FrameHandoff:
+    """
+    描画済みのフレームを書き込み用のバッファに1度だけ変換して受け渡す
+
+    ffmpegには `-pix_fmt rgb24` で渡すので、RGB順の連続したuint8配列として保持し、
+    書き込み側にはそのmemoryviewを渡す（以降のコピーは発生しない）。
+    """
+
+    def __init__(self):
+        self._lock = threading.Condition()
+        self._frame = None
+        self._view = None
+        self._seq = 0
+        self._published_at = None
+        self.bytes_copied = 0  # 変換とパイプへの書き込みでコピーしたバイト数の累計
+
+    def publish(self, frame_rgb):
+        """
+        新しいフレームを書き込み可能な形に変換して公開する
+
+        :param frame_rgb: (height, width, 3) のRGB配列またはPIL画像
+        """
+        buffer = np.asarray(frame_rgb, dtype=np.uint8)
+        if not buffer.flags["C_CONTIGUOUS"]:
+            buffer = np.ascontiguousarray(buffer)
+        if buffer is not frame_rgb:
+            self.count_copied(buffer.nbytes)
+        view = memoryview(buffer).cast("B")
+        with self._lock:
+            self._frame = buffer
+            self._view = view
+            self._seq += 1
+            self._published_at = time.monotonic()
+            self._lock.notify_all()
+        return buffer
+
+    def latest(self):
+        """
+        :return: (シーケンス番号, フレーム配列, memoryview, 公開時刻)
+        """
+        with self._lock:
+            return self._seq, self._frame, self._view, self._published_at
+
+    def wait_for_next(self, seq, timeout=None):
+        """
+        シーケンス番号がseqより新しいフレームが公開されるまで待つ
+
+        :return: latest()と同じ値（タイムアウトした場合は現在のフレーム）
+        """
+        with self._lock:
+            self._lock.wait_for(lambda: self._seq > seq, timeout=timeout)
+            return self._seq, self._frame, self._view, self._published_at
+
+    def count_copied(self, nbytes):
+        with self._lock:
+            self.bytes_copied += nbytes
+        FRAME_BYTES_COPIED.inc(nbytes)
@@ -0,0 +1,165 @@
+import queue
+import threading
+import time
+
+from utils.metrics import OUTPUT_TICKS_DROPPED, OUTPUT_TICKS_REPEATED, PIPE_WRITE_STALLS
+
+# キューが満杯のときの扱い
+WRITE_QUEUE_POLICIES = ("drop", "duplicate")
+
+_STOP = object()
+
+
+class FrameWriter:
+    """
+    フレームをffmpegのパイプに書き込む専用のスレッド
+
+    配信のループはフレームを小さな上限付きのキューに入れるだけで、パイプへの書き込みで
+    止まることはない。ffmpegの処理が追いつかずキューが満杯のときは、policyに従って
+
+    - "drop": そのフレームを捨てる（出力のフレーム数が実時間より少なくなる）
+    - "duplicate": 書き込めなかった回数を覚えておき、追いついたら最後のフレームをその回数だけ
+      書き込み直す（出力のフレーム数を実時間に合わせる。max_owedを上限とする）
+
+    書き込みがstall_secondsを超えて終わらない場合は停滞として数える。停滞が続いた場合は
+    ffmpegの監視が進捗の途絶えとして再起動するので、書き込み中のパイプも閉じられる。
+
+    :param sink: フレームを書き込む関数 (FFmpegSupervisor.write)。書き込めたらTrueを返す
+    :param on_written: 書き込むたびに on_written(seq, nbytes, published_at, write_start, write_seconds) を呼ぶ
+    :param maxsize: キューに入れておけるフレーム数
+    """
+
+    def __init__(self, sink, on_written=None, name="default", maxsize=2, policy="duplicate", stall_seconds=0.5, max_owed=30):
+        if policy not in WRITE_QUEUE_POLICIES:
+            raise ValueError(f"不明なキューの扱いです: {policy}")
+        self.sink = sink
+        self.on_written = on_written
+        self.name = name
+        self.policy = policy
+        self.stall_seconds = stall_seconds
+        self.max_owed = max_owed
+        self.write_load = 0.0  # 書き込み間隔のうちパイプへの書き込みに使った時間の割合（指数移動平均）
+        self.connected = False  # 最後の書き込みが成功していればTrue
+        self.dropped = 0
+        self.repeated = 0
+        self.stalls = 0
+        self._queue = queue.Queue(maxsize=max(1, maxsize))
+        self._owed = 0
+        self._lock = threading.Lock()
+        self._write_started = None
+        self._stall_counted = False
+        self._last = None
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def offer(self, seq, view, published_at, write_interval):
+        """
+        フレームを書き込み待ちのキューに入れる（ブロックしない）
+
+        :param write_interval: 入力レートでの1フレームの間隔（秒）。書き込みの負荷の計算に使う
+        :return: キューに入れた場合はTrue
+        """
+        if self._closed:
+            return False
+        self.check_stall()
+        try:
+            self._queue.put_nowait((seq, view, published_at, write_interval))
+            return True
+        except queue.Full:
+            pass
+        if self.policy == "duplicate":
+            with self._lock:
+                if self._owed < self.max_owed:
+                    self._owed += 1
+                    return False
+        self.dropped += 1
+        OUTPUT_TICKS_DROPPED.inc(stream=self.name)
+        return False
+
+    def check_stall(self):
+        """
+        書き込みがstall_secondsを超えて続いていれば、1回の書き込みにつき1度だけ停滞として数える
+
+        :return: 書き込みが続いている時間（秒）、書き込み中でなければ0
+        """
+        started = self._write_started
+        if started is None:
+            return 0.0
+        elapsed = time.monotonic() - started
+        if elapsed > self.stall_seconds and self._count_stall():
+            print(f"[{self.name}] 警告: ffmpegへの書き込みが{elapsed:.1f}秒間終わっていません")
+        return elapsed
+
+    def _count_stall(self):
+        with self._lock:
+            if self._stall_counted:
+                return False
+            self._stall_counted = True
+        self.stalls += 1
+        PIPE_WRITE_STALLS.inc(stream=self.name)
+        return True
+
+    def close(self, timeout=2.0):
+        """
+        書き込み待ちのフレームを捨ててスレッドを止める
+
+        パイプが詰まって書き込みが終わらない場合もtimeoutで戻る（スレッドはffmpegの終了とともに抜ける）
+        """
+        self._closed = True
+        try:
+            while True:
+                self._queue.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            self._queue.put_nowait(_STOP)
+        except queue.Full:
+            pass
+        self._thread.join(timeout=timeout)
+        return not self._thread.is_alive()
+
+    def _take_owed(self):
+        with self._lock:
+            if self._owed == 0:
+                return False
+            self._owed -= 1
+            return True
+
+    def _run(self):
+        while not self._closed:
+            try:
+                item = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if item is _STOP:
+                break
+            self._write(item)
+            self._last = item
+            if not self.connected:
+                # ffmpegを再起動している間の分は書き込み直さない
+                with self._lock:
+                    self._owed = 0
+            # キューが空いたら、書き込めなかった分だけ最後のフレームを書き込み直す
+            while not self._closed and self.connected and self._queue.empty() and self._take_owed():
+                self._write(self._last)
+                self.repeated += 1
+                OUTPUT_TICKS_REPEATED.inc(stream=self.name)
+
+    def _write(self, item):
+        seq, view, published_at, write_interval = item
+        write_start = time.monotonic()
+        with self._lock:
+            self._stall_counted = False
+        self._write_started = write_start
+        try:
+            written = self.sink(view)
+        finally:
+            self._write_started = None
+        write_seconds = time.monotonic() - write_start
+        if write_seconds > self.stall_seconds:
+            self._count_stall()
+        self.write_load = 0.9 * self.write_load + 0.1 * min(write_seconds / write_interval, 1.0)
+        self.connected = written
+        if written and self.on_written:
+            self.on_written(seq, view.nbytes, published_at, write_start, write_seconds)
@@ -1,163 +1,90 @@
+import argparse
+import sys
+import time
+from collections import namedtuple
+
 import cv2
-from PIL import Image, ImageDraw, ImageFont
+import numpy as np
+from PIL import Image, ImageDraw
 from datetime import datetime
 from utils.config import load_settings
-
-def capture():
-    cap = cv2.VideoCapture(2)
-    if not cap.isOpened():
-        print("エラー: Webカメラを開けません")
+from utils.compositor import LayerCache
+from utils.text_layout import get_font, layout_markdown, text_bbox
+from utils.camera import (
+    DEFAULT_CAMERA_INDEX,
+    capture_config_from_settings,
+    crop_and_scale,
+    cropped_size,
+    get_camera_session,
+    webcam_paste_size,
+)
+
+def capture_array(camera_index=DEFAULT_CAMERA_INDEX, target_size=None, fourcc=None, frame_size=None, auto_size=False):
+    # 常駐しているカメラセッションから最新フレームを受け取る（デバイスI/Oは行わない）
+    session = get_camera_session(camera_index, fourcc=fourcc, frame_size=frame_size, auto_size=auto_size)
+    frame = session.get_frame(timeout=5)
+
+    if frame is None:
+        print("エラー: Webカメラから画像を取得できません")
         return None
 
-    ret, frame = cap.read()
-    cap.release()
+    if target_size is None:
+        # 縮小せずに16:9の切り抜きだけ行う
+        height, width = frame.shape[:2]
+        target_size = cropped_size(width, height)
 
-    if not ret:
-        print("エラー: Webカメラから画像を取得できません")
-        return None
+    # 切り抜きと縮小をnumpy配列上で1度に行う
+    return crop_and_scale(frame, target_size)
 
-    rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-    camera_image = Image.fromarray(rgb_frame)
-
-    width, height = camera_image.size
-    target_aspect = 16 / 9
-    current_aspect = width / height
-
-    if current_aspect > target_aspect:
-        new_width = int(height * target_aspect)
-        left = (width - new_width) // 2
-        right = (width + new_width) // 2
-        cropped_image = camera_image.crop((left, 0, right, height))
-    elif current_aspect < target_aspect:
-        new_height = int(width / target_aspect)
-        top = (height - new_height) // 2
-        bottom = (height + new_height) // 2
-        cropped_image = camera_image.crop((0, top, width, bottom))
-    else:
-        cropped_image = camera_image
 
-    return cropped_image
+def capture(camera_index=DEFAULT_CAMERA_INDEX, target_size=None, fourcc=None, frame_size=None):
+    rgb_frame = capture_array(camera_index, target_size, fourcc, frame_size)
+    if rgb_frame is None:
+        return None
+    return Image.fromarray(rgb_frame)
 
 
 def draw_markdown(
     draw, text, x, y, width, font_path, base_font_size=20, color=(0, 0, 0)
 ):
-    lines = text.split("\n")
-    current_y = y
-    line_height = base_font_size * 1.2
-
-    for line in lines:
-        if line.startswith("# "):
-            font_size = base_font_size * 1.5
-            font = ImageFont.truetype(font_path, int(font_size))
-            text_content = line[2:]
-            draw.text((x, current_y), text_content, font=font, fill=color)
-            current_y += line_height * 1.5
-        elif line.startswith("- "):
-            font = ImageFont.truetype(font_path, int(base_font_size))
-            # 箇条書きの記号を描画
-            marker_radius = 5
-            marker_x = x + marker_radius
-            marker_y = current_y + base_font_size // 2
+    # 折り返しと計測はレイアウトキャッシュに任せ、ここでは描画だけを行う
+    boxes, height = layout_markdown(text, font_path, width, base_font_size)
+
+    for box in boxes:
+        if box.marker:
+            marker_x, marker_y, marker_radius = box.marker
             draw.ellipse(
                 (
-                    marker_x - marker_radius,
-                    marker_y - marker_radius,
-                    marker_x + marker_radius,
-                    marker_y + marker_radius,
+                    x + marker_x - marker_radius,
+                    y + marker_y - marker_radius,
+                    x + marker_x + marker_radius,
+                    y + marker_y + marker_radius,
                 ),
                 fill=color,
             )
-            text_content = line[2:]
-            draw.text(
-                (x + marker_radius * 3, current_y), text_content, font=font, fill=color
-            )
-            current_y += line_height
-        elif line.startswith("* "):  # 箇条書きの別記号
-            font = ImageFont.truetype(font_path, int(base_font_size))
-            text_content = line[2:]
-            draw.text(
-                (x + base_font_size // 2, current_y),
-                "• " + text_content,
-                font=font,
-                fill=color,
-            )
-            current_y += line_height
-        elif line.strip():
-            font = ImageFont.truetype(font_path, int(base_font_size))
-            draw.text((x, current_y), line, font=font, fill=color)
-            current_y += line_height
-
-        if current_y > y + 1000:  # Safety break to avoid infinite loops
-            break
-    return current_y
-
-def generate_image(start_time=datetime.now(), example=False):
-    if example:
-        webcam_image = Image.open("alt_webcam.png")
-    else:
-        webcam_image = capture()
-    if webcam_image is None:
-        print("エラー: Webカメラを開けません")
-        return None
-
-    settings = load_settings()  # 設定ファイルの読み込み
-
-    lower_text = settings.get("lower_text")
-    right_long_text = settings.get("right_long_text")
-    font_path = settings.get("font_path")
-    resolution_str = settings.get("resolution", "1280x720")
-    canvas_width, canvas_height = map(int, resolution_str.split("x"))
-    mosaic_size = settings.get("mosaic_size", 10)
-    grayscale = settings.get("grayscale", False)
+        font = get_font(font_path, box.font_size)
+        draw.text((x + box.x, y + box.y), box.text, font=font, fill=color)
+    return y + height
 
-    canvas = Image.new("RGB", (canvas_width, canvas_height), color="white")
-    draw = ImageDraw.Draw(canvas)
-
-    webcam_width, webcam_height = webcam_image.size
-    paste_height = int(canvas_height * 0.85)
-    paste_width = int(paste_height * webcam_width / webcam_height)
-    paste_x = 0
-    paste_y = int(canvas_height * 0.05)
-    resized_webcam_image = webcam_image.resize(
-        (paste_width, paste_height), Image.Resampling.LANCZOS
-    )
-    if mosaic_size > 0:
-        # モザイク処理
-        resized_webcam_image = resized_webcam_image.resize(
-            (paste_width // mosaic_size, paste_height // mosaic_size), Image.Resampling.LANCZOS
-        )
-        resized_webcam_image = resized_webcam_image.resize(
-            (paste_width, paste_height), Image.Resampling.NEAREST
-        )
+# layersを渡されなかった場合に使うキャッシュ（配信ではLiveStreamerごとのLayerCacheを渡す）
+layer_cache = LayerCache()
 
-    if grayscale:
-        # グレースケール処理
-        resized_webcam_image = resized_webcam_image.convert("L").convert("RGB")
+# numpyバックエンドとPILバックエンドの出力で許容する画素値の差と、それを超えてよい画素の割合
+# numpyバックエンドの縮小はINTER_AREA（平均）、PILはLANCZOSなので、くっきりした輪郭の周りだけ
+# 差が大きくなる（1080pのモザイクで最大50程度、約1.2%の画素）
+BACKEND_TOLERANCE = 8
+BACKEND_MAX_MISMATCH_RATIO = 0.02
 
-    canvas.paste(resized_webcam_image, (paste_x, paste_y))
 
-    # 2. ウェブカメラ画像の上部
-    upper_height = int(canvas_height * 0.05)
+def render_upper_layer(upper_left_text, current_time_str, font_path, paste_width, upper_height):
     upper_part = Image.new("RGB", (paste_width, upper_height), color="white")
     upper_draw = ImageDraw.Draw(upper_part)
 
     # 左側のテキスト
     font_size_upper = int(upper_height * 0.5)
-    try:
-        font_upper = ImageFont.truetype(font_path, font_size_upper)
-    except IOError:
-        font_upper = ImageFont.load_default()
-
-    now = datetime.now()
-    elapsed = now - start_time
+    font_upper = get_font(font_path, font_size_upper)
 
-    hours, remainder = divmod(elapsed.seconds, 3600)
-    minutes = remainder // 60
-    upper_left_text = f"経過時間: {hours}時間{minutes}分"
-
-    text_bbox_left = upper_draw.textbbox((0, 0), upper_left_text, font=font_upper)
-    text_width_left = text_bbox_left[2] - text_bbox_left[0]
+    text_bbox_left = text_bbox(upper_left_text, font_path, font_size_upper)
     text_height_left = text_bbox_left[3] - text_bbox_left[1]
     text_x_left = 0
     text_y_left = int(upper_height / 2 - text_height_left / 2)
@@ -166,8 +93,7 @@ def generate_image(start_time=datetime.now(), example=False):
     )
 
     # 右側の現在時間
-    current_time_str = now.strftime("%Y年%m月%d日 %H:%M")
-    text_bbox_right = upper_draw.textbbox((0, 0), current_time_str, font=font_upper)
+    text_bbox_right = text_bbox(current_time_str, font_path, font_size_upper)
     text_width_right = text_bbox_right[2] - text_bbox_right[0]
     text_height_right = text_bbox_right[3] - text_bbox_right[1]
     text_x_right = paste_width / 2 - text_width_right / 2  # ウェブカメラ画像の中央
@@ -175,53 +101,420 @@ def generate_image(start_time=datetime.now(), example=False):
     upper_draw.text(
         (text_x_right, text_y_right), current_time_str, font=font_upper, fill=(0, 0, 0)
     )
+    return upper_part
 
-    canvas.paste(upper_part, (0, 0))
 
-    # 3. ウェブカメラ画像の下部
-    lower_height = int(canvas_height * 0.10)
+def render_lower_layer(lower_text, font_path, paste_width, lower_height):
     lower_part = Image.new("RGB", (paste_width, lower_height), color="white")
     lower_draw = ImageDraw.Draw(lower_part)
     font_size_lower = int(lower_height * 0.6)
-    try:
-        font_lower = ImageFont.truetype(font_path, font_size_lower)
-    except IOError:
-        font_lower = ImageFont.load_default()
-    text_bbox_lower = lower_draw.textbbox((0, 0), lower_text, font=font_lower)
-    text_width_lower = text_bbox_lower[2] - text_bbox_lower[0]
+    font_lower = get_font(font_path, font_size_lower)
+    text_bbox_lower = text_bbox(lower_text, font_path, font_size_lower)
     text_height_lower = text_bbox_lower[3] - text_bbox_lower[1]
     text_x_lower = 0  # 左揃え
     text_y_lower = int(lower_height / 2 - text_height_lower / 2)
     lower_draw.text(
         (text_x_lower, text_y_lower), lower_text, font=font_lower, fill=(0, 0, 0)
     )
-    canvas.paste(lower_part, (0, paste_y + paste_height))
+    return lower_part
 
-    # 4. 右側の領域
-    right_width = canvas_width - paste_width
-    right_height = canvas_height
+
+def render_right_layer(right_long_text, font_path, right_width, right_height):
     right_part = Image.new("RGB", (right_width, right_height), color="white")
     right_draw = ImageDraw.Draw(right_part)
     markdown_x = 20
     markdown_y = 20
     markdown_width = right_width - 40
 
-    try:
-        font_markdown = ImageFont.truetype(font_path, 30)
-    except IOError:
-        font_markdown = ImageFont.load_default()
-
     draw_markdown(
         right_draw, right_long_text, markdown_x, markdown_y, markdown_width, font_path
     )
+    return right_part
+
 
+def render_background(canvas_width, canvas_height, paste_width, lower_y, lower_part, right_part):
+    # ウェブカメラ画像と上部以外の、フレームごとに変わらない部分
+    canvas = Image.new("RGB", (canvas_width, canvas_height), color="white")
+    canvas.paste(lower_part, (0, lower_y))
     canvas.paste(right_part, (paste_width, 0))
+    return canvas
+
+
+RENDER_BACKENDS = ("pil", "numpy")
+
+# numpyバックエンドで使い回すキャンバスの枚数（書き込み中のフレームを上書きしないよう複数枚持つ）
+CANVAS_POOL_SIZE = 3
+
+FrameLayout = namedtuple(
+    "FrameLayout",
+    [
+        "canvas_width",
+        "canvas_height",
+        "paste_x",
+        "paste_y",
+        "paste_width",
+        "paste_height",
+        "background_key",
+        "lower_key",
+        "right_key",
+        "upper_key",
+    ],
+)
+
+
+
+class CanvasPool:
+    """
+    numpyバックエンドで描画するキャンバスを解像度ごとに確保して順番に使い回す
+
+    描画したキャンバスはコピーせずにそのまま公開されるので、配信ごとに別のプールを持つ。
+    同じプールを複数の配信で共有すると、他の配信の描画で書き込み中のフレームが上書きされる。
+
+    :param size: 使い回すキャンバスの枚数
+    """
+
+    def __init__(self, size=CANVAS_POOL_SIZE):
+        self.size = size
+        self._buffers = {}
+        self._index = 0
+
+    def next(self, canvas_width, canvas_height):
+        buffers = self._buffers.get((canvas_width, canvas_height))
+        if buffers is None:
+            # 解像度が変わったら古いキャンバスは捨てる
+            buffers = [np.empty((canvas_height, canvas_width, 3), dtype=np.uint8) for _ in range(self.size)]
+            self._buffers = {(canvas_width, canvas_height): buffers}
+        canvas = buffers[self._index % self.size]
+        self._index += 1
+        return canvas
+
+
+class StageTimer:
+    """
+    描画の段階ごとの処理時間を累積する
+
+    :param timings: 結果を書き込む辞書、Noneなら計測しない
+    """
+
+    def __init__(self, timings=None):
+        self.timings = timings
+        self._last = time.perf_counter() if timings is not None else None
+
+    def mark(self, stage):
+        if self.timings is None:
+            return
+        now = time.perf_counter()
+        self.timings[stage] = self.timings.get(stage, 0.0) + (now - self._last)
+        self._last = now
+
+
+def _load_webcam_frame(settings, canvas_width, canvas_height, example):
+    # ウェブカメラ画像をRGBのnumpy配列で返す
+    if example:
+        return np.asarray(Image.open("alt_webcam.png").convert("RGB"))
+
+    # 貼り付けサイズで直接受け取り、後段のリサイズを不要にする
+    paste_size = webcam_paste_size(canvas_width, canvas_height)
+    fourcc, frame_size, auto_size = capture_config_from_settings(settings, paste_size)
+    return capture_array(
+        settings.get("camera_index", DEFAULT_CAMERA_INDEX),
+        target_size=paste_size,
+        fourcc=fourcc,
+        frame_size=frame_size,
+        auto_size=auto_size,
+    )
+
+
+def _frame_layout(settings, webcam_width, webcam_height, start_time, now=None):
+    lower_text = settings.get("lower_text")
+    right_long_text = settings.get("right_long_text")
+    font_path = settings.get("font_path")
+    resolution_str = settings.get("resolution", "1280x720")
+    canvas_width, canvas_height = map(int, resolution_str.split("x"))
+
+    paste_height = int(canvas_height * 0.85)
+    paste_width = int(paste_height * webcam_width / webcam_height)
+    paste_x = 0
+    paste_y = int(canvas_height * 0.05)
+    upper_height = int(canvas_height * 0.05)
+    lower_height = int(canvas_height * 0.10)
+    right_width = canvas_width - paste_width
+
+    # ウェブカメラ画像の上部の時刻は分単位なので1分に1回だけキーが変わる
+    now = now or datetime.now()
+    elapsed = now - start_time
+
+    hours, remainder = divmod(elapsed.seconds, 3600)
+    minutes = remainder // 60
+    upper_left_text = f"経過時間: {hours}時間{minutes}分"
+    current_time_str = now.strftime("%Y年%m月%d日 %H:%M")
+
+    lower_key = (lower_text, font_path, paste_width, lower_height)
+    right_key = (right_long_text, font_path, right_width, canvas_height)
+    return FrameLayout(
+        canvas_width=canvas_width,
+        canvas_height=canvas_height,
+        paste_x=paste_x,
+        paste_y=paste_y,
+        paste_width=paste_width,
+        paste_height=paste_height,
+        background_key=(canvas_width, canvas_height, paste_y + paste_height, lower_key, right_key),
+        lower_key=lower_key,
+        right_key=right_key,
+        upper_key=(upper_left_text, current_time_str, font_path, paste_width, upper_height),
+    )
+
+
+def _background_layer(layout, layers):
+    # 静的なレイヤー（背景・下部テキスト・右側の領域）は入力が変わったときだけ描画する
+    return layers.get(
+        "background",
+        layout.background_key,
+        lambda: render_background(
+            layout.canvas_width,
+            layout.canvas_height,
+            layout.paste_width,
+            layout.paste_y + layout.paste_height,
+            layers.get("lower", layout.lower_key, lambda: render_lower_layer(*layout.lower_key)),
+            layers.get("right", layout.right_key, lambda: render_right_layer(*layout.right_key)),
+        ),
+    )
+
+
+def _upper_layer(layout, layers):
+    return layers.get("upper", layout.upper_key, lambda: render_upper_layer(*layout.upper_key))
+
+
+def _compose_pil(settings, webcam_image, start_time, now=None, timer=None, layers=None):
+    timer = timer or StageTimer()
+    layers = layer_cache if layers is None else layers
+    mosaic_size = settings.get("mosaic_size", 10)
+    grayscale = settings.get("grayscale", False)
+
+    webcam_width, webcam_height = webcam_image.size
+    layout = _frame_layout(settings, webcam_width, webcam_height, start_time, now)
+    paste_width, paste_height = layout.paste_width, layout.paste_height
+
+    # 1. 静的なレイヤーを複製してキャンバスにする
+    background = _background_layer(layout, layers)
+    timer.mark("text")
+    canvas = background.copy()
+    timer.mark("compose")
+
+    if webcam_image.size == (paste_width, paste_height):
+        resized_webcam_image = webcam_image
+    else:
+        resized_webcam_image = webcam_image.resize(
+            (paste_width, paste_height), Image.Resampling.LANCZOS
+        )
+    timer.mark("resize")
+    if mosaic_size > 0:
+        # モザイク処理
+        resized_webcam_image = resized_webcam_image.resize(
+            (paste_width // mosaic_size, paste_height // mosaic_size), Image.Resampling.LANCZOS
+        )
+        resized_webcam_image = resized_webcam_image.resize(
+            (paste_width, paste_height), Image.Resampling.NEAREST
+        )
+
+    if grayscale:
+        # グレースケール処理
+        resized_webcam_image = resized_webcam_image.convert("L").convert("RGB")
+    timer.mark("effects")
+
+    canvas.paste(resized_webcam_image, (layout.paste_x, layout.paste_y))
+    timer.mark("compose")
+
+    # 2. ウェブカメラ画像の上部
+    upper_part = _upper_layer(layout, layers)
+    timer.mark("text")
+    canvas.paste(upper_part, (0, 0))
+    timer.mark("compose")
+
+    return canvas
+
+
+def _compose_numpy(settings, webcam_frame, start_time, now=None, timer=None, canvas_pool=None, layers=None):
+    timer = timer or StageTimer()
+    layers = layer_cache if layers is None else layers
+    mosaic_size = settings.get("mosaic_size", 10)
+    grayscale = settings.get("grayscale", False)
+
+    webcam_height, webcam_width = webcam_frame.shape[:2]
+    layout = _frame_layout(settings, webcam_width, webcam_height, start_time, now)
+    paste_width, paste_height = layout.paste_width, layout.paste_height
+
+    # 1. 静的なレイヤーはPILで1度だけ描画し、配列としてキャッシュする
+    background = layers.get(
+        "background_array", layout.background_key, lambda: np.asarray(_background_layer(layout, layers))
+    )
+    timer.mark("text")
+    if canvas_pool is None:
+        canvas = background.copy()
+    else:
+        canvas = canvas_pool.next(layout.canvas_width, layout.canvas_height)
+        np.copyto(canvas, background)
+    timer.mark("compose")
+
+    if (webcam_width, webcam_height) == (paste_width, paste_height):
+        resized_webcam_frame = webcam_frame
+    else:
+        resized_webcam_frame = cv2.resize(
+            webcam_frame, (paste_width, paste_height), interpolation=cv2.INTER_AREA
+        )
+    timer.mark("resize")
+    if mosaic_size > 0:
+        # モザイク処理
+        resized_webcam_frame = cv2.resize(
+            resized_webcam_frame,
+            (paste_width // mosaic_size, paste_height // mosaic_size),
+            interpolation=cv2.INTER_AREA,
+        )
+    if grayscale:
+        # グレースケール処理（PILの convert("L") と同じITU-R 601-2の係数、丸めの差は1以内）
+        # モザイクの場合は縮小した画像に対して行うので、変換する画素が1/100で済む
+        resized_webcam_frame = cv2.cvtColor(resized_webcam_frame, cv2.COLOR_RGB2GRAY)
+    if mosaic_size > 0:
+        # PILのNEARESTと同じく画素の中心で参照元を決める（INTER_NEARESTはブロックの境目がずれる）
+        resized_webcam_frame = cv2.resize(
+            resized_webcam_frame, (paste_width, paste_height), interpolation=cv2.INTER_NEAREST_EXACT
+        )
+    timer.mark("effects")
+
+    region = canvas[
+        layout.paste_y:layout.paste_y + paste_height,
+        layout.paste_x:layout.paste_x + paste_width,
+    ]
+    if grayscale:
+        # 1チャンネルの結果をキャンバス上に直接RGBの3チャンネルとして書き込む
+        cv2.cvtColor(resized_webcam_frame, cv2.COLOR_GRAY2RGB, dst=region)
+    else:
+        region[...] = resized_webcam_frame
+    timer.mark("compose")
+
+    # 2. ウェブカメラ画像の上部
+    upper = layers.get("upper_array", layout.upper_key, lambda: np.asarray(_upper_layer(layout, layers)))
+    timer.mark("text")
+    canvas[:upper.shape[0], :upper.shape[1]] = upper
+    timer.mark("compose")
 
     return canvas
 
 
+def generate_frame(
+    start_time=datetime.now(),
+    example=False,
+    backend=None,
+    settings=None,
+    now=None,
+    timings=None,
+    canvas_pool=None,
+    layers=None,
+):
+    """
+    配信用のフレームをRGBのnumpy配列で返す
+
+    :param backend: "pil" または "numpy"、Noneなら設定のrender_backendを使う
+    :param settings: 使用する設定、Noneなら設定ファイルの内容を使う
+    :param now: 時刻の表示に使う現在時刻、Noneなら実際の現在時刻
+    :param timings: 渡すと段階ごとの処理時間（秒）を書き込む
+    :param canvas_pool: numpyバックエンドでキャンバスを使い回すCanvasPool、Noneなら毎回確保する
+    :param layers: 描画済みのレイヤーのLayerCache。配信ごとに別のものを渡す（共有すると解像度や
+        テキストの異なる配信どうしで毎回描画し直しになる）。Noneならモジュールのlayer_cache
+    """
+    settings = settings or load_settings()  # 設定ファイルの読み込み
+    backend = backend or settings.get("render_backend", "pil")
+    canvas_width, canvas_height = map(int, settings.get("resolution", "1280x720").split("x"))
+    timer = StageTimer(timings)
+
+    webcam_frame = _load_webcam_frame(settings, canvas_width, canvas_height, example)
+    timer.mark("capture")
+    if webcam_frame is None:
+        print("エラー: Webカメラを開けません")
+        return None
+
+    if backend == "numpy":
+        return _compose_numpy(settings, webcam_frame, start_time, now, timer, canvas_pool, layers)
+    canvas = _compose_pil(settings, Image.fromarray(webcam_frame), start_time, now, timer, layers)
+    frame = np.asarray(canvas)
+    timer.mark("compose")
+    return frame
+
+
+def generate_image(start_time=datetime.now(), example=False, backend=None, settings=None, now=None, timings=None):
+    """
+    配信用のフレームをPIL画像で返す
+
+    引数はgenerate_frameと同じ
+    """
+    settings = settings or load_settings()  # 設定ファイルの読み込み
+    backend = backend or settings.get("render_backend", "pil")
+    if backend == "numpy":
+        frame = generate_frame(start_time, example, backend, settings, now, timings)
+        return Image.fromarray(frame) if frame is not None else None
+
+    canvas_width, canvas_height = map(int, settings.get("resolution", "1280x720").split("x"))
+    timer = StageTimer(timings)
+    webcam_frame = _load_webcam_frame(settings, canvas_width, canvas_height, example)
+    timer.mark("capture")
+    if webcam_frame is None:
+        print("エラー: Webカメラを開けません")
+        return None
+    return _compose_pil(settings, Image.fromarray(webcam_frame), start_time, now, timer)
+
+
+def compare_render_backends(start_time=None, settings_overrides=None):
+    """
+    サンプル画像をPILとnumpyの両方のバックエンドで描画し、画素値の差を返す
+
+    :return: {"max": 最大差, "mean": 平均差, "over_tolerance": 許容差を超えた画素の割合, "ok": 許容範囲内ならTrue}
+    """
+    start_time = start_time or datetime.now()
+    settings = {**load_settings(), **(settings_overrides or {})}
+    canvas_width, canvas_height = map(int, settings.get("resolution", "1280x720").split("x"))
+    webcam_frame = _load_webcam_frame(settings, canvas_width, canvas_height, example=True)
+
+    pil_frame = np.asarray(_compose_pil(settings, Image.fromarray(webcam_frame), start_time))
+    numpy_frame = _compose_numpy(settings, webcam_frame, start_time)
+    diff = np.abs(pil_frame.astype(np.int16) - numpy_frame.astype(np.int16))
+    over_tolerance = float((diff > BACKEND_TOLERANCE).mean())
+    return {
+        "max": int(diff.max()),
+        "mean": float(diff.mean()),
+        "over_tolerance": over_tolerance,
+        "ok": over_tolerance <= BACKEND_MAX_MISMATCH_RATIO,
+    }
+
+
 def main():
-    final_image = generate_image()
+    parser = argparse.ArgumentParser(description="配信用の画像を1枚生成します")
+    parser.add_argument("--example", action="store_true", help="カメラの代わりにalt_webcam.pngを使う")
+    parser.add_argument("--backend", choices=RENDER_BACKENDS, help="描画バックエンド")
+    parser.add_argument("--compare", action="store_true", help="PILとnumpyのバックエンドの出力を比較する")
+    args = parser.parse_args()
+
+    if args.compare:
+        failed = False
+        for mosaic_size in (0, 10):
+            for grayscale in (False, True):
+                result = compare_render_backends(
+                    settings_overrides={"mosaic_size": mosaic_size, "grayscale": grayscale}
+                )
+                failed = failed or not result["ok"]
+                print(
+                    f"mosaic={mosaic_size:<2} grayscale={grayscale!s:<5} "
+                    f"max={result['max']:>3} mean={result['mean']:.3f} "
+                    f"over_tolerance={result['over_tolerance'] * 100:.3f}% {'ok' if result['ok'] else 'NG'}"
+                )
+        if failed:
+            print(
+                f"エラー: 画素値の差が{BACKEND_TOLERANCE}を超えた画素が"
+                f"{BACKEND_MAX_MISMATCH_RATIO * 100:.1f}%を超えています。"
+            )
+            sys.exit(1)
+        return
+
+    final_image = generate_image(example=args.example, backend=args.backend)
     if final_image:
         final_image.save("final_webcam_image.png")
         print("画像を final_webcam_image.png として保存しました。")
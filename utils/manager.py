@@ -0,0 +1,125 @@
+import threading
+
+from utils.config import stream_ids, stream_settings, youtube_enabled
+from utils.metrics import FFMPEG_UPTIME_SECONDS, STREAMING
+from utils.stream import LiveStreamer
+from utils.stream_state import CREATING, stream_states
+
+
+class StreamManager:
+    """
+    複数の配信（カメラ・設定・配信先の組）をそれぞれ独立したLiveStreamerとして管理する
+
+    配信の一覧は設定のstreamsから読み込む。streamsがない場合は既定の配信だけを扱う。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._streamers = {}
+        self._threads = {}
+
+    def stream_ids(self):
+        return stream_ids()
+
+    def get(self, stream_id):
+        with self._lock:
+            return self._streamers.get(stream_id)
+
+    def is_running(self, stream_id):
+        streamer = self.get(stream_id)
+        return bool(streamer and streamer._is_running)
+
+    def start(self, stream_id):
+        """
+        :return: 開始した場合はTrue、すでに実行中または不明な配信の場合はFalse
+        """
+        if stream_id not in self.stream_ids():
+            return False
+        with self._lock:
+            streamer = self._streamers.get(stream_id)
+            if streamer is not None and streamer._is_running:
+                return False
+            streamer = LiveStreamer(stream_id)
+            thread = threading.Thread(target=streamer.start_streaming, daemon=True)
+            self._streamers[stream_id] = streamer
+            self._threads[stream_id] = thread
+        # 画面の再読み込みがスレッドの開始より先でも作成中と表示されるようにする
+        stream_states.set(stream_id, CREATING)
+        thread.start()
+        return True
+
+    def stop(self, stream_id, timeout=10):
+        """
+        :return: 停止した場合はTrue、実行されていない場合はFalse
+        """
+        with self._lock:
+            streamer = self._streamers.get(stream_id)
+            thread = self._threads.get(stream_id)
+        if streamer is None or not streamer._is_running:
+            return False
+
+        streamer.stop_streaming()
+        # スレッドの終了を待機 (オプション)
+        if thread and thread.is_alive():
+            thread.join(timeout=timeout)
+        with self._lock:
+            if self._streamers.get(stream_id) is streamer:
+                del self._streamers[stream_id]
+                self._threads.pop(stream_id, None)
+        return True
+
+    def provision(self):
+        """
+        配信開始時にYouTube APIの準備を待たずに済むよう、起動時に裏で呼ぶ
+
+        - YouTubeに配信する配信があれば、認証情報の読み込み・更新とAPIクライアントの作成を済ませ、
+          認証情報のバックグラウンドでの更新を開始する
+        - youtube.ingestが"persistent"の配信について、受信ストリームとライブ配信を事前に用意する
+        """
+        if any(youtube_enabled(stream_settings(stream_id)) for stream_id in self.stream_ids()):
+            from utils.youtube import warm_up_youtube_client
+
+            warm_up_youtube_client()
+        for stream_id in self.stream_ids():
+            settings = stream_settings(stream_id)
+            youtube_settings = settings["youtube"]
+            if not youtube_enabled(settings) or youtube_settings.get("ingest") != "persistent":
+                continue
+            # 事前に作成する配信がある場合だけYouTube APIのライブラリを読み込む
+            from utils.youtube import persistent_ingest
+
+            ingest = persistent_ingest(stream_id, youtube_settings)
+            if ingest is None:
+                continue
+            try:
+                ingest.provision(youtube_settings["title"], youtube_settings["description"], youtube_settings["privacy"])
+                print(f"[{stream_id}] ライブ配信を事前に作成しました。")
+            except Exception as e:
+                print(f"[{stream_id}] 警告: ライブ配信の事前作成に失敗しました: {e}")
+
+    def stop_all(self):
+        with self._lock:
+            running = list(self._streamers)
+        for stream_id in running:
+            self.stop(stream_id)
+
+    def status(self, stream_id=None):
+        """
+        配信の状態を返す。stream_idを省略すると全ての配信の状態を返す
+        """
+        if stream_id is not None:
+            streamer = self.get(stream_id)
+            if streamer is None:
+                return {"stream_id": stream_id, "running": False, **stream_states.get(stream_id)}
+            return streamer.status()
+        return {stream_id: self.status(stream_id) for stream_id in self.stream_ids()}
+
+    def update_metrics(self):
+        with self._lock:
+            streamers = dict(self._streamers)
+        for stream_id in self.stream_ids():
+            if stream_id in streamers:
+                streamers[stream_id].update_metrics()
+            else:
+                STREAMING.set(0, stream=stream_id)
+                FFMPEG_UPTIME_SECONDS.set(0, stream=stream_id)
@@ -0,0 +1,218 @@
+import bisect
+import threading
+
+# 秒単位の処理時間向けのバケット
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in labels
+    )
+    return "{" + pairs + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    type_name = None
+
+    def __init__(self, name, documentation, registry=None):
+        self.name = name
+        self.documentation = documentation
+        self._lock = threading.Lock()
+        self._values = {}
+        (registry if registry is not None else REGISTRY).register(self)
+
+    @staticmethod
+    def _key(labels):
+        return tuple(sorted(labels.items()))
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}",
+        ]
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_value(key, value))
+        return lines
+
+    def _render_value(self, key, value):
+        return [f"{self.name}{_format_labels(key)} {_format_value(value)}"]
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    type_name = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def remove(self, **labels):
+        with self._lock:
+            self._values.pop(self._key(labels), None)
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, buckets=DEFAULT_BUCKETS, registry=None):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, registry)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+                self._values[key] = state
+            state["counts"][index] += 1
+            state["sum"] += value
+            state["count"] += 1
+
+    def _render_value(self, key, state):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), state["counts"]):
+            cumulative += count
+            labels = key + (("le", _format_value(bound)),)
+            lines.append(f"{self.name}_bucket{_format_labels(labels)} {cumulative}")
+        lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(state['sum'])}")
+        lines.append(f"{self.name}_count{_format_labels(key)} {state['count']}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+
+    def render(self):
+        """
+        Prometheusのテキスト形式で全てのメトリクスを返す
+        """
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+CAPTURE_SECONDS = Histogram(
+    "timelapse_capture_seconds", "カメラ画像の取得にかかった時間"
+)
+RENDER_STAGE_SECONDS = Histogram(
+    "timelapse_render_stage_seconds", "描画の段階ごとの処理時間"
+)
+RENDER_SECONDS = Histogram(
+    "timelapse_render_seconds", "1フレームの描画全体にかかった時間"
+)
+FRAME_AGE_SECONDS = Histogram(
+    "timelapse_frame_age_seconds",
+    "ffmpegに書き込んだ時点でのフレームの経過時間",
+    buckets=(0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0),
+)
+PIPE_WRITE_SECONDS = Histogram(
+    "timelapse_pipe_write_seconds", "ffmpegのパイプへの書き込みにかかった時間"
+)
+PIPE_WRITE_STALLS = Counter(
+    "timelapse_pipe_write_stalls_total", "しきい値を超えて停滞したパイプへの書き込みの回数"
+)
+OUTPUT_FRAMES = Counter(
+    "timelapse_output_frames_total", "ffmpegに書き込んだフレーム数"
+)
+DUPLICATED_FRAMES = Counter(
+    "timelapse_output_frames_duplicated_total", "前回と同じ内容を書き込んだフレーム数"
+)
+DROPPED_FRAMES = Counter(
+    "timelapse_output_frames_dropped_total", "描画されたがffmpegに書き込まれなかったフレーム数"
+)
+OUTPUT_TICKS_DROPPED = Counter(
+    "timelapse_output_ticks_dropped_total", "書き込み待ちのキューが満杯で書き込まなかったフレーム数"
+)
+OUTPUT_TICKS_REPEATED = Counter(
+    "timelapse_output_ticks_repeated_total", "キューが満杯だった分を後から書き込み直したフレーム数"
+)
+FRAME_BYTES_COPIED = Counter(
+    "timelapse_frame_bytes_copied_total", "フレームの受け渡しでコピーしたバイト数"
+)
+FFMPEG_UPTIME_SECONDS = Gauge(
+    "timelapse_ffmpeg_uptime_seconds", "ffmpegプロセスが起動してからの時間"
+)
+FFMPEG_RESTARTS = Counter(
+    "timelapse_ffmpeg_restarts_total", "終了または停滞したffmpegを再起動した回数"
+)
+FFMPEG_STALLS = Counter(
+    "timelapse_ffmpeg_stalls_total", "進捗の報告が途絶えたffmpegを検知した回数"
+)
+ENCODER_FPS = Gauge(
+    "timelapse_encoder_fps", "ffmpegが報告したエンコードのFPS"
+)
+ENCODER_SPEED = Gauge(
+    "timelapse_encoder_speed", "ffmpegが報告したエンコード速度（1以上なら実時間に間に合っている）"
+)
+ENCODER_BITRATE_KBPS = Gauge(
+    "timelapse_encoder_bitrate_kbps", "ffmpegが報告した出力ビットレート"
+)
+ENCODER_DUP_FRAMES = Gauge(
+    "timelapse_encoder_dup_frames", "現在のffmpegプロセスが複製したフレーム数"
+)
+ENCODER_DROP_FRAMES = Gauge(
+    "timelapse_encoder_drop_frames", "現在のffmpegプロセスが破棄したフレーム数"
+)
+QUALITY_LEVEL = Gauge(
+    "timelapse_quality_level", "適応的な品質制御の段階 (0が設定どおりの品質、大きいほど軽い)"
+)
+CHANGE_SCORE = Gauge(
+    "timelapse_change_score", "前回描画したときからのシーンの変化量 (0〜1)"
+)
+SKIPPED_RENDERS = Counter(
+    "timelapse_skipped_renders_total", "シーンが変化していないため描画を省略した回数"
+)
+CAPTURE_INTERVAL_SECONDS = Gauge(
+    "timelapse_capture_interval_seconds", "シーンの変化量に応じて決めた撮影のインターバル"
+)
+TICK_LATENESS_SECONDS = Histogram(
+    "timelapse_tick_lateness_seconds", "撮影・書き込みの予定時刻からの遅れ"
+)
+TICKS_SKIPPED = Counter(
+    "timelapse_ticks_skipped_total", "予定時刻に間に合わず飛ばした撮影・書き込みの回数"
+)
+STREAMING = Gauge(
+    "timelapse_streaming", "配信処理が実行中なら1"
+)
@@ -0,0 +1,177 @@
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+from utils.camera import camera_session_from_settings
+
+DEFAULT_MOTION_SETTINGS = {
+    "enabled": False,
+    "min_interval": 2,  # 動きがあるときのインターバル（秒）
+    "max_interval": 60,  # 静止しているときに伸ばすインターバルの上限（秒）
+    "still_threshold": 0.01,  # 変化量がこれ未満なら静止とみなし、描画を省略してインターバルを伸ばす
+    "motion_threshold": 0.05,  # 変化量がこれ以上なら動きがあるとみなし、インターバルをmin_intervalにする
+    "stretch": 1.5,  # 静止している間、インターバルに掛けていく倍率
+    "analysis_width": 64,  # 変化量を計算するときに縮小する幅（ピクセル）
+}
+
+
+def motion_settings(settings):
+    return {**DEFAULT_MOTION_SETTINGS, **settings.get("motion", {})}
+
+
+def sample_camera(settings):
+    """
+    カメラセッションが保持している最新フレーム (BGR) を返す（カメラのI/Oは行わない）
+
+    描画と同じ取得設定でセッションを取得するので、セッションが開き直されることはない
+    """
+    return camera_session_from_settings(settings).get_frame(timeout=5)
+
+
+def small_gray(frame, width=64):
+    """
+    変化量の計算用に、縮小したグレースケールの配列を返す（縮小してから変換するので軽い）
+    """
+    height = max(1, round(frame.shape[0] * width / frame.shape[1]))
+    small = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+
+
+def change_score(reference, current):
+    """
+    2つの縮小したグレースケール画像の差の平均を0〜1で返す
+    """
+    diff = cv2.absdiff(reference, current)
+    return float(np.mean(diff)) / 255.0
+
+
+class MotionDetector:
+    """
+    最後に描画したときのカメラ画像と最新のカメラ画像を比べて、シーンの変化量を求める
+
+    少しずつの変化（日の出など）も積み重なれば検出できるよう、比較の基準は
+    描画したとき（accept()を呼んだとき）だけ更新する。
+    """
+
+    def __init__(self, analysis_width=64):
+        self.analysis_width = analysis_width
+        self._reference = None
+        self._candidate = None
+
+    def score(self, frame):
+        """
+        :param frame: カメラ画像 (BGR)
+        :return: 変化量 (0〜1)、比較の基準がまだなければNone
+        """
+        self._candidate = small_gray(frame, self.analysis_width)
+        if self._reference is None or self._reference.shape != self._candidate.shape:
+            return None
+        return change_score(self._reference, self._candidate)
+
+    def accept(self):
+        # 最後にscore()に渡した画像を比較の基準にする
+        if self._candidate is not None:
+            self._reference = self._candidate
+
+
+class AdaptiveInterval:
+    """
+    変化量に応じて撮影のインターバルを伸び縮みさせる
+
+    - 変化量がmotion_threshold以上: すぐにmin_intervalにする
+    - 変化量がstill_threshold未満: stretch倍ずつmax_intervalまで伸ばす
+    - その間: 設定のintervalに戻す
+
+    設定のintervalがmin_intervalより短い場合はintervalを下限にする（動きがあるときに
+    設定より撮影が遅くならないようにする）
+    """
+
+    def __init__(self, interval, min_interval=2, max_interval=60, still_threshold=0.01, motion_threshold=0.05, stretch=1.5):
+        self.base_interval = interval
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval, min_interval)
+        self.still_threshold = still_threshold
+        self.motion_threshold = motion_threshold
+        self.stretch = stretch
+        self.interval = interval
+
+    @classmethod
+    def from_settings(cls, settings):
+        config = motion_settings(settings)
+        return cls(
+            settings.get("interval", 5),
+            min_interval=config["min_interval"],
+            max_interval=config["max_interval"],
+            still_threshold=config["still_threshold"],
+            motion_threshold=config["motion_threshold"],
+            stretch=config["stretch"],
+        )
+
+    @property
+    def lower_bound(self):
+        return min(self.min_interval, self.base_interval)
+
+    def is_still(self, score):
+        return score is not None and score < self.still_threshold
+
+    def next(self, score):
+        """
+        :param score: 今回の変化量、計算できなかった場合はNone
+        :return: 次の撮影までのインターバル（秒）
+        """
+        if score is None:
+            self.interval = self.base_interval
+        elif score >= self.motion_threshold:
+            self.interval = self.lower_bound
+        elif score < self.still_threshold:
+            self.interval = min(self.interval * self.stretch, self.max_interval)
+        else:
+            self.interval = self.base_interval
+        self.interval = min(max(self.interval, self.lower_bound), self.max_interval)
+        return self.interval
+
+
+class MotionGate:
+    """
+    撮影のたびに、描画するかどうかと次の撮影までのインターバルを決める
+
+    配信のスレッドと描画用のワーカープロセスの両方で同じ判断をするためのもの。
+    """
+
+    def __init__(self, settings):
+        config = motion_settings(settings)
+        self.detector = MotionDetector(config["analysis_width"])
+        self.interval = AdaptiveInterval.from_settings(settings)
+        self._force_render = True
+        self._rendered_minute = None
+
+    def check(self, frame):
+        """
+        :param frame: カメラセッションの最新フレーム (BGR)、取得できなければNone
+        :return: (変化量またはNone, 描画する必要があればTrue)
+        """
+        score = None if frame is None else self.detector.score(frame)
+        if self._force_render or not self.interval.is_still(score):
+            return score, True
+        # 時刻の表示は分単位なので、分が変わったら静止していても描画する
+        return score, datetime.now().strftime("%Y%m%d%H%M") != self._rendered_minute
+
+    def rendered(self):
+        # 描画したときのカメラ画像を次の比較の基準にする
+        self.detector.accept()
+        self._force_render = False
+        self._rendered_minute = datetime.now().strftime("%Y%m%d%H%M")
+
+    def invalidate(self, interval=None):
+        """
+        表示内容が変わった可能性があるので、シーンが静止していても次は描画する
+
+        :param interval: 設定のintervalが変わった場合はその値
+        """
+        if interval is not None:
+            self.interval.base_interval = interval
+        self._force_render = True
+
+    def next_interval(self, score):
+        return self.interval.next(score)
@@ -0,0 +1,116 @@
+import threading
+import time
+
+import cv2
+
+# 縮小表示で選べる幅（これ以外の幅は近いものに丸めて、キャッシュが増えないようにする）
+PREVIEW_WIDTHS = (160, 320, 640, 1280)
+
+PREVIEW_FORMATS = {
+    "jpeg": (".jpg", "image/jpeg", cv2.IMWRITE_JPEG_QUALITY),
+    "webp": (".webp", "image/webp", cv2.IMWRITE_WEBP_QUALITY),
+}
+
+MJPEG_BOUNDARY = "frame"
+
+
+def preview_width(width):
+    """
+    要求された幅をPREVIEW_WIDTHSのうち最も近いものに丸める（Noneなら縮小しない）
+    """
+    if not width:
+        return None
+    return min(PREVIEW_WIDTHS, key=lambda candidate: abs(candidate - width))
+
+
+class FramePreview:
+    """
+    配信中の最新フレームをJPEG/WebPに変換して配る
+
+    変換はフレーム・形式・幅の組ごとに1度だけ行い、同時に見ている全てのクライアントで
+    結果を共有する。フレームはFrameHandoffから読むだけなので、カメラを開くことはない。
+
+    :param handoff: 配信中のFrameHandoff
+    :param quality: JPEG/WebPの品質
+    """
+
+    def __init__(self, handoff, quality=80):
+        self.handoff = handoff
+        self.quality = quality
+        self._lock = threading.Lock()
+        self._seq = None
+        self._encoded = {}
+        self._closed = False
+        # 配信を開始し直すとシーケンス番号が1から始まるので、ETagに開始時刻を含める
+        self._epoch = f"{time.time_ns():x}"
+        self.encode_count = 0
+
+    def snapshot(self, fmt="jpeg", width=None, not_modified=None):
+        """
+        :param not_modified: ETagを受け取り、クライアントが同じものを持っていればTrueを返す関数。
+            Trueを返した場合は変換しない
+        :return: (ETag, 変換後のバイト列、クライアントが同じものを持っていればNone)、まだフレームがなければNone
+        """
+        seq, frame, _view, _published_at = self.handoff.latest()
+        if frame is None:
+            return None
+        # ETagはシーケンス番号から決まるので、304で済む場合は変換せずに返す
+        etag = self.etag(seq, fmt, width)
+        if not_modified is not None and not_modified(etag):
+            return etag, None
+        return etag, self._encode(seq, frame, fmt, preview_width(width))
+
+    def etag(self, seq, fmt="jpeg", width=None):
+        return f"{self._epoch}-{seq}-{fmt}-{preview_width(width) or 'full'}"
+
+    def close(self):
+        # 配信の停止後はMJPEGの送信を終える
+        self._closed = True
+
+    def mjpeg(self, width=None, max_fps=2.0, timeout=5.0):
+        """
+        新しいフレームが公開されるたびにJPEGを送るmultipart/x-mixed-replaceのジェネレーター
+
+        :param max_fps: 送信する最大のFPS（描画のインターバルより速くはならない）
+        :param timeout: 新しいフレームが来ない場合に同じフレームを送り直す間隔（秒）、配信の停止もこの間隔で確認する
+        """
+        width = preview_width(width)
+        seq = 0
+        min_interval = 1.0 / max_fps if max_fps else 0.0
+        while not self._closed:
+            started = time.monotonic()
+            seq, frame, _view, _published_at = self.handoff.wait_for_next(seq, timeout=timeout)
+            if frame is not None:
+                data = self._encode(seq, frame, "jpeg", width)
+                yield (
+                    f"--{MJPEG_BOUNDARY}\r\nContent-Type: image/jpeg\r\nContent-Length: {len(data)}\r\n\r\n".encode()
+                    + data
+                    + b"\r\n"
+                )
+            wait = min_interval - (time.monotonic() - started)
+            if wait > 0:
+                time.sleep(wait)
+
+    def _encode(self, seq, frame, fmt, width):
+        key = (fmt, width)
+        with self._lock:
+            if seq != self._seq:
+                # 新しいフレームが来たら古いフレームの変換結果は捨てる
+                self._seq = seq
+                self._encoded = {}
+            data = self._encoded.get(key)
+            if data is not None:
+                return data
+
+            extension, _mimetype, quality_flag = PREVIEW_FORMATS[fmt]
+            image = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
+            if width and width < image.shape[1]:
+                height = max(1, round(image.shape[0] * width / image.shape[1]))
+                image = cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA)
+            ret, encoded = cv2.imencode(extension, image, [quality_flag, self.quality])
+            if not ret:
+                raise RuntimeError(f"プレビューの{fmt}への変換に失敗しました")
+            data = encoded.tobytes()
+            self._encoded[key] = data
+            self.encode_count += 1
+            return data
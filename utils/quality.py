@@ -0,0 +1,152 @@
+import time
+
+from utils.ffmpeg import BITRATE_LADDER, select_encoder_profile
+
+DEFAULT_QUALITY_SETTINGS = {
+    "enabled": False,
+    "down_speed": 0.95,  # エンコード速度がこれを下回り続けたら品質を下げる
+    "max_write_load": 0.8,  # パイプへの書き込みに使った時間の割合がこれを上回り続けても下げる
+    "down_seconds": 30,  # 品質を下げるまでに負荷が続く必要がある時間（秒）
+    "up_speed": 0.99,  # 品質を上げるにはエンコード速度がこれ以上である必要がある
+    "up_write_load": 0.3,  # 品質を上げるには書き込みの割合がこれ以下である必要がある
+    "up_seconds": 600,  # 品質を上げるまでに余裕が続く必要がある時間（秒）
+    "hold_seconds": 120,  # 段階を変えた後、次に変えるまで待つ時間（秒）
+    "min_fps": 15,  # 下げるときのFPSの下限
+    "min_resolution": "854x480",  # 下げるときの解像度の下限
+}
+
+
+def quality_settings(settings):
+    return {**DEFAULT_QUALITY_SETTINGS, **settings.get("adaptive_quality", {})}
+
+
+def quality_levels(settings):
+    """
+    設定の解像度・FPS・プロファイルを最高として、負荷の軽い順に並べた段階の一覧を返す
+
+    プリセットを軽くする → FPSを下げる → 解像度を下げる の順に下げる。
+
+    :return: 設定に上書きする値の辞書のリスト（先頭は設定そのまま）
+    """
+    config = quality_settings(settings)
+    resolution = settings.get("resolution", "1280x720")
+    fps = settings.get("fps", 30)
+    levels = [{}]
+
+    name, _profile = select_encoder_profile(settings)
+    if name != "eco":
+        levels.append({"encoder_profile": "eco"})
+    low_fps = min(fps, config["min_fps"])
+    if low_fps < fps:
+        levels.append({"encoder_profile": "eco", "fps": low_fps})
+
+    # BITRATE_LADDERは解像度の高い順に並んでいる
+    resolutions = list(BITRATE_LADDER)
+    if resolution in resolutions and config["min_resolution"] in resolutions:
+        lowest = resolutions.index(config["min_resolution"])
+        for lower in resolutions[resolutions.index(resolution) + 1: lowest + 1]:
+            levels.append({"encoder_profile": "eco", "fps": low_fps, "resolution": lower})
+    return levels
+
+
+class AdaptiveQualityController:
+    """
+    エンコード速度とパイプへの書き込みの負荷から、出力の品質の段階を上げ下げする
+
+    負荷がdown_seconds続いたら1段階下げ、余裕がup_seconds続いたら1段階上げる。
+    下げるしきい値と上げるしきい値を離し、変更後はhold_seconds待つことで段階が
+    行ったり来たりしないようにする。上げた直後にまた下げることになった場合は、
+    次に上げるまでに必要な時間を2倍にする。
+
+    :param levels: quality_levels()の返り値
+    """
+
+    def __init__(
+        self,
+        levels,
+        down_speed=0.95,
+        max_write_load=0.8,
+        down_seconds=30,
+        up_speed=0.99,
+        up_write_load=0.3,
+        up_seconds=600,
+        hold_seconds=120,
+    ):
+        self.levels = levels
+        self.down_speed = down_speed
+        self.max_write_load = max_write_load
+        self.down_seconds = down_seconds
+        self.up_speed = up_speed
+        self.up_write_load = up_write_load
+        self.up_seconds = up_seconds
+        self.hold_seconds = hold_seconds
+
+        self.level = 0
+        self._pressure_since = None
+        self._headroom_since = None
+        self._changed_at = None
+        self._last_step_up = None
+        self._up_penalty = 1
+
+    @classmethod
+    def from_settings(cls, settings):
+        config = quality_settings(settings)
+        return cls(
+            quality_levels(settings),
+            down_speed=config["down_speed"],
+            max_write_load=config["max_write_load"],
+            down_seconds=config["down_seconds"],
+            up_speed=config["up_speed"],
+            up_write_load=config["up_write_load"],
+            up_seconds=config["up_seconds"],
+            hold_seconds=config["hold_seconds"],
+        )
+
+    def overrides(self):
+        """
+        現在の段階で設定に上書きする値を返す
+        """
+        return dict(self.levels[self.level])
+
+    def update(self, speed, write_load, now=None):
+        """
+        最新の測定値を渡し、段階を変える必要があれば変更する
+
+        :param speed: ffmpegが報告したエンコード速度、まだ報告がなければNone
+        :param write_load: 書き込み間隔のうちパイプへの書き込みに使った時間の割合
+        :return: 段階を変えた場合はTrue
+        """
+        now = time.monotonic() if now is None else now
+        if speed is None:
+            return False
+
+        pressure = speed < self.down_speed or write_load > self.max_write_load
+        headroom = speed >= self.up_speed and write_load <= self.up_write_load
+        self._pressure_since = (self._pressure_since or now) if pressure else None
+        self._headroom_since = (self._headroom_since or now) if headroom else None
+
+        if self._changed_at is not None and now - self._changed_at < self.hold_seconds:
+            return False
+
+        if self._pressure_since is not None and now - self._pressure_since >= self.down_seconds:
+            if self.level + 1 >= len(self.levels):
+                return False
+            if self._last_step_up is not None and now - self._last_step_up < self.hold_seconds + self.down_seconds:
+                # 上げた直後に負荷が戻ったので、次に上げるまでの時間を伸ばす
+                self._up_penalty = min(self._up_penalty * 2, 16)
+            self._set_level(self.level + 1, now)
+            return True
+
+        if self._headroom_since is not None and now - self._headroom_since >= self.up_seconds * self._up_penalty:
+            if self.level == 0:
+                return False
+            self._set_level(self.level - 1, now)
+            self._last_step_up = now
+            return True
+        return False
+
+    def _set_level(self, level, now):
+        self.level = level
+        self._changed_at = now
+        self._pressure_since = None
+        self._headroom_since = None
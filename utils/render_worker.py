@@ -0,0 +1,364 @@
+import multiprocessing
+import queue
+import sys
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from utils.config import RESOLUTION_CHOICES
+from utils.metrics import FRAME_BYTES_COPIED
+
+# 共有メモリの先頭に置くヘッダー
+#   整数 (int64): 通し番号, 最新の枠, 枠0の番号, 枠1の番号, 枠0の幅, 枠0の高さ, 枠1の幅, 枠1の高さ
+#   （枠の番号は書き込み中は_WRITINGになる）
+#   実数 (float64): 枠0の公開時刻, 枠1の公開時刻, ワーカーの生存確認の時刻
+_SEQ, _ACTIVE = 0, 1
+_INT_FIELDS = 8
+_FLOAT_FIELDS = 3
+_HEARTBEAT = 2
+_HEADER_SIZE = 128
+_WRITING = -1
+RESOLUTION_SIZES = [resolution for resolution, _label in RESOLUTION_CHOICES]
+
+# ワーカーの生存確認がこの時間途絶えたら、止まっているとみなして起動し直す（秒）
+HEARTBEAT_TIMEOUT = 30
+
+
+def _attach_shared_memory(name):
+    # 作成したプロセスだけが削除するよう、アタッチする側ではresource_trackerに登録しない
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    # 3.12以前はアタッチしても登録されるが、spawnで起動したワーカーは作成した側と同じ
+    # resource_trackerを使うので、同じ名前が登録し直されるだけで済む。ここで登録を解除すると
+    # 作成した側の登録まで消え、削除したときにresource_trackerがKeyErrorを表示する
+    return shared_memory.SharedMemory(name=name)
+
+
+class SharedFrameBuffer:
+    """
+    共有メモリ上のダブルバッファでフレームをプロセス間に受け渡す
+
+    書き込む側は表示中ではない方の枠にフレームを書き、書き終えてから最新の枠と
+    通し番号を更新する。読む側は新しいフレームが公開されるたびに1度だけ自分のメモリに
+    コピーし、次のフレームまで同じ配列とmemoryviewを返す（pickleは発生しない）。
+    FrameHandoffと同じ読み出しのインターフェースを持つ。
+
+    ffmpegへの書き込みが詰まるなどして読む側が遅れても書きかけのフレームを使わないよう、
+    コピーはseqlockの手順で行う。書き込む側は枠の番号を_WRITINGにしてから書き込み、
+    読む側はコピーの前後で枠の番号が変わっていないことを確かめ、変わっていればやり直す。
+
+    :param capacity: 1枠の大きさ（バイト）、作成するときだけ指定する
+    """
+
+    def __init__(self, shm, capacity, owner):
+        self._shm = shm
+        self.capacity = capacity
+        self._owner = owner
+        self._ints = np.ndarray((_INT_FIELDS,), dtype=np.int64, buffer=shm.buf, offset=0)
+        self._floats = np.ndarray((_FLOAT_FIELDS,), dtype=np.float64, buffer=shm.buf, offset=_INT_FIELDS * 8)
+        self._slots = [
+            np.ndarray((capacity,), dtype=np.uint8, buffer=shm.buf, offset=_HEADER_SIZE + i * capacity)
+            for i in range(2)
+        ]
+        self.bytes_copied = 0
+        self._lock = threading.Lock()
+        self._latest = (0, None, None, None)
+
+    @classmethod
+    def create(cls, capacity):
+        shm = shared_memory.SharedMemory(create=True, size=_HEADER_SIZE + 2 * capacity)
+        buffer = cls(shm, capacity, owner=True)
+        buffer._ints[:] = 0
+        buffer._floats[:] = 0.0
+        return buffer
+
+    @classmethod
+    def attach(cls, name, capacity):
+        return cls(_attach_shared_memory(name), capacity, owner=False)
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    def publish(self, frame):
+        """
+        フレームを表示中ではない方の枠に書き込んでから公開する（書き込む側のプロセスで呼ぶ）
+
+        :param frame: (height, width, 3) のRGB配列
+        """
+        frame = np.asarray(frame, dtype=np.uint8)
+        height, width = frame.shape[:2]
+        if frame.nbytes > self.capacity:
+            raise ValueError(f"フレーム ({width}x{height}) が共有メモリの枠より大きいです")
+        seq = int(self._ints[_SEQ]) + 1
+        slot = 1 - int(self._ints[_ACTIVE]) if seq > 1 else 0
+        # 前のフレームをコピー中の読む側が、書き込みの途中だと気づけるようにする
+        self._ints[2 + slot] = _WRITING
+        self._ints[4 + 2 * slot] = width
+        self._ints[5 + 2 * slot] = height
+        self._slots[slot][: frame.nbytes] = frame.reshape(-1)
+        self._floats[slot] = time.monotonic()
+        self._ints[2 + slot] = seq
+        # 最後に最新の枠と通し番号を更新する
+        self._ints[_ACTIVE] = slot
+        self._ints[_SEQ] = seq
+
+    def heartbeat(self):
+        self._floats[_HEARTBEAT] = time.monotonic()
+
+    def last_heartbeat(self):
+        return float(self._floats[_HEARTBEAT])
+
+    def latest(self):
+        """
+        :return: (通し番号, フレーム配列, memoryview, 公開時刻)、まだフレームがなければ (0, None, None, None)
+        """
+        with self._lock:
+            ints = self._ints
+            if ints is None or int(ints[_SEQ]) == 0:
+                # まだフレームがないか、配信の停止後で共有メモリを閉じている
+                return 0, None, None, None
+            while True:
+                seq = int(ints[_SEQ])
+                if seq == self._latest[0]:
+                    return self._latest
+                slot = int(ints[_ACTIVE])
+                width = int(ints[4 + 2 * slot])
+                height = int(ints[5 + 2 * slot])
+                published_at = float(self._floats[slot])
+                # 最新の枠と通し番号の更新の間に読んだ場合は、枠の番号が通し番号と一致しない
+                if int(ints[2 + slot]) == seq and width * height * 3 <= self.capacity:
+                    frame = self._slots[slot][: width * height * 3].reshape(height, width, 3).copy()
+                    if int(ints[2 + slot]) == seq:
+                        break
+                # コピーの途中で次の書き込みが始まった
+                time.sleep(0.001)
+            self.count_copied(frame.nbytes)
+            self._latest = (seq, frame, memoryview(frame).cast("B"), published_at)
+            return self._latest
+
+    def wait_for_next(self, seq, timeout=None, poll_interval=0.05):
+        """
+        通し番号がseqより新しいフレームが公開されるまで待つ（プロセス間なので短い間隔で確認する）
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._ints is not None and int(self._ints[_SEQ]) <= seq:
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            time.sleep(poll_interval)
+        return self.latest()
+
+    def count_copied(self, nbytes):
+        self.bytes_copied += nbytes
+        FRAME_BYTES_COPIED.inc(nbytes)
+
+    def close(self):
+        self._ints = self._floats = None
+        self._slots = []
+        try:
+            self._shm.close()
+        except BufferError:
+            # 書き込み中のmemoryviewが残っている場合は、参照がなくなった時点で解放される
+            pass
+        if self._owner:
+            try:
+                self._shm.unlink()
+            except FileNotFoundError:
+                pass
+
+
+# ワーカープロセスの中だけで使われる関数
+# カメラセッションはワーカープロセスの中に常駐し、描画もそのプロセスで行う
+
+
+def _capture_render_main(shm_name, capacity, stream_id, start_time, control, stats, stop_event):
+    from utils.camera import release_camera_session
+    from utils.config import stream_settings
+    from utils.image_processing import CanvasPool, generate_frame
+    from utils.motion import MotionGate, motion_settings, sample_camera
+    from utils.scheduler import TickScheduler, scheduler_settings
+
+    frames = SharedFrameBuffer.attach(shm_name, capacity)
+    overrides = {}
+    # 描画したフレームは共有メモリにコピーしてから公開するので、キャンバスは1枚で足りる
+    canvas_pool = CanvasPool(size=1)
+    settings = stream_settings(stream_id)
+    gate = MotionGate(settings) if motion_settings(settings)["enabled"] else None
+
+    def sleep(seconds):
+        # 待っている間も生存確認を更新し、長いインターバルを停止とみなされないようにする
+        deadline = time.monotonic() + seconds
+        while not stop_event.wait(min(1.0, max(0.0, deadline - time.monotonic()))):
+            frames.heartbeat()
+            if time.monotonic() >= deadline:
+                break
+
+    config = scheduler_settings(settings)
+    schedule = TickScheduler(
+        settings.get("interval", 5),
+        policy=config["capture_policy"],
+        max_late_seconds=config["max_late_seconds"],
+        sleep=sleep,
+    )
+    lateness, skipped_ticks = None, 0
+
+    try:
+        while not stop_event.is_set():
+            frames.heartbeat()
+            try:
+                while True:
+                    message = control.get_nowait()
+                    overrides = message.get("overrides", overrides)
+                    if gate and message.get("invalidate"):
+                        gate.invalidate(message.get("interval"))
+            except queue.Empty:
+                pass
+            settings = {**stream_settings(stream_id), **overrides}
+
+            report = {
+                "score": None,
+                "skipped": False,
+                "timings": {},
+                "render_seconds": None,
+                "lateness": lateness,  # この回の撮影の予定時刻からの遅れ
+                "skipped_ticks": skipped_ticks,
+            }
+            if gate:
+                score, needs_render = gate.check(sample_camera(settings))
+                report["score"] = score
+                if not needs_render:
+                    report["skipped"] = True
+            if not report["skipped"]:
+                render_start = time.perf_counter()
+                try:
+                    frame = generate_frame(
+                        start_time=start_time, settings=settings, timings=report["timings"], canvas_pool=canvas_pool
+                    )
+                except Exception as e:
+                    print(f"エラー: 画像の生成中にエラーが発生しました: {e}")
+                    frame = None
+                report["render_seconds"] = time.perf_counter() - render_start
+                if frame is not None:
+                    try:
+                        frames.publish(frame)
+                    except ValueError as e:
+                        print(f"エラー: {e}")
+                    else:
+                        if gate:
+                            gate.rendered()
+
+            interval = gate.next_interval(report["score"]) if gate else settings.get("interval", 5)
+            report["interval"] = interval if gate else None
+            try:
+                stats.put_nowait(report)
+            except queue.Full:
+                pass
+            lateness, skipped_ticks = schedule.wait(interval)
+    finally:
+        release_camera_session()
+        frames.close()
+
+
+class RenderProcess:
+    """
+    1つの配信のカメラ取得と描画を専用のワーカープロセスで行う
+
+    ワーカーは撮影のインターバルに合わせて自分で描画を続け、フレームを共有メモリの
+    ダブルバッファ（frames）に公開する。配信側はそれを読むだけなので、描画がGILを
+    奪い合うことも、フレームをpickleでやり取りすることもない。カメラやドライバーが
+    原因でワーカーが落ちたり止まったりしても、配信側のプロセスは影響を受けず、
+    ワーカーを起動し直す。
+
+    :param resolution: 設定の解像度。共有メモリの枠は選択できる解像度のうち最大のものも入る大きさにする
+    """
+
+    def __init__(self, stream_id, resolution, start_time):
+        # 配信中に解像度を変更されても作り直さずに済むようにする
+        capacity = max(
+            width * height * 3
+            for width, height in (map(int, choice.split("x")) for choice in [resolution, *RESOLUTION_SIZES])
+        )
+        self.stream_id = stream_id
+        self.start_time = start_time
+        self.frames = SharedFrameBuffer.create(capacity)
+        # Flaskやスレッドを抱えたプロセスをforkしないようspawnで起動する
+        self._context = multiprocessing.get_context("spawn")
+        self._control = self._context.Queue()
+        self._stats = self._context.Queue(maxsize=100)
+        self._stop_event = self._context.Event()
+        self._process = None
+        self._overrides = {}
+        self.restarts = 0
+
+    def start(self):
+        self._process = self._context.Process(
+            target=_capture_render_main,
+            args=(
+                self.frames.name,
+                self.frames.capacity,
+                self.stream_id,
+                self.start_time,
+                self._control,
+                self._stats,
+                self._stop_event,
+            ),
+            daemon=True,
+        )
+        self._process.start()
+        self.frames.heartbeat()
+        if self._overrides:
+            self._control.put({"overrides": self._overrides})
+
+    def is_alive(self):
+        return self._process is not None and self._process.is_alive()
+
+    def restart(self):
+        """
+        落ちた、または応答しなくなったワーカーを起動し直す（公開済みのフレームはそのまま残る）
+        """
+        if self._process is not None and self._process.is_alive():
+            self._process.terminate()
+            self._process.join(timeout=5)
+        self.restarts += 1
+        self.start()
+
+    def set_overrides(self, overrides):
+        # 品質の段階に応じて解像度やFPSを上書きする
+        self._overrides = dict(overrides)
+        self._control.put({"overrides": self._overrides})
+
+    def invalidate(self, interval=None):
+        # 設定が変わったので、シーンが静止していても次は描画させる
+        self._control.put({"invalidate": True, "interval": interval})
+
+    def drain_stats(self, timeout=0.5):
+        """
+        ワーカーが描画のたびに送る報告を取り出す
+
+        :return: {"score", "skipped", "timings", "render_seconds", "interval", "lateness", "skipped_ticks"} のリスト
+        """
+        reports = []
+        try:
+            reports.append(self._stats.get(timeout=timeout))
+            while True:
+                reports.append(self._stats.get_nowait())
+        except queue.Empty:
+            pass
+        return reports
+
+    def heartbeat_age(self):
+        return time.monotonic() - self.frames.last_heartbeat()
+
+    def close(self):
+        self._stop_event.set()
+        if self._process is not None:
+            self._process.join(timeout=10)
+            if self._process.is_alive():
+                print("警告: 描画プロセスが時間内に終了しませんでした。強制終了します。")
+                self._process.terminate()
+                self._process.join(timeout=5)
+        self._control.close()
+        self._stats.close()
+        self.frames.close()
@@ -0,0 +1,105 @@
+import time
+
+from utils.metrics import TICK_LATENESS_SECONDS, TICKS_SKIPPED
+
+DEFAULT_SCHEDULER_SETTINGS = {
+    "capture_policy": "skip",  # 撮影が遅れたときの扱い ("skip": 間に合わなかった回を飛ばす / "catch_up": 続けて実行して追いつく)
+    "output_policy": "catch_up",  # ffmpegへの書き込みが遅れたときの扱い
+    "max_late_seconds": 1.0,  # catch_upでもこれ以上遅れた場合は飛ばす（秒）
+}
+
+SCHEDULE_POLICIES = ("skip", "catch_up")
+
+
+def scheduler_settings(settings):
+    return {**DEFAULT_SCHEDULER_SETTINGS, **settings.get("scheduler", {})}
+
+
+class TickStats:
+    """
+    予定の時刻からの遅れを集計する
+
+    :param stream: メトリクスに記録する配信ID、Noneなら記録しない（ワーカープロセスの中など）
+    :param loop: メトリクスのラベル ("capture" / "output")
+    """
+
+    def __init__(self, stream=None, loop="capture"):
+        self.stream = stream
+        self.loop = loop
+        self.ticks = 0
+        self.skipped = 0
+        self.last_lateness = 0.0
+        self.max_lateness = 0.0
+        self._total_lateness = 0.0
+
+    def record(self, lateness, skipped=0):
+        self.ticks += 1
+        self.skipped += skipped
+        self.last_lateness = lateness
+        self.max_lateness = max(self.max_lateness, lateness)
+        self._total_lateness += lateness
+        if self.stream is not None:
+            TICK_LATENESS_SECONDS.observe(lateness, stream=self.stream, loop=self.loop)
+            if skipped:
+                TICKS_SKIPPED.inc(skipped, stream=self.stream, loop=self.loop)
+
+    def snapshot(self):
+        return {
+            "ticks": self.ticks,
+            "skipped": self.skipped,
+            "last_lateness_seconds": self.last_lateness,
+            "mean_lateness_seconds": self._total_lateness / self.ticks if self.ticks else 0.0,
+            "max_lateness_seconds": self.max_lateness,
+        }
+
+
+class TickScheduler:
+    """
+    time.monotonic()の絶対的な予定時刻で一定の周期を刻む
+
+    処理の後に周期の分だけsleepすると、処理にかかった時間の分だけ周期が伸びていくが、
+    ここでは前回の予定時刻に周期を足した時刻まで待つので、長時間動かしても周期がずれない。
+    予定時刻に間に合わなかった場合はpolicyに従う。
+
+    - "skip": 間に合わなかった回を飛ばし、予定の刻みに合わせて今回をすぐに実行する
+    - "catch_up": 待たずに続けて実行して遅れを取り戻す（max_late_secondsを超えて遅れた分は飛ばす）
+
+    :param period: 周期（秒）、wait()のたびに変えることもできる
+    :param sleep: 待つための関数（停止の確認などを挟む場合に差し替える）
+    """
+
+    def __init__(self, period, policy="skip", max_late_seconds=1.0, stats=None, sleep=time.sleep, clock=time.monotonic):
+        if policy not in SCHEDULE_POLICIES:
+            raise ValueError(f"不明なスケジュールの扱いです: {policy}")
+        self.period = period
+        self.policy = policy
+        self.max_late_seconds = max_late_seconds
+        self.stats = stats or TickStats()
+        self._sleep = sleep
+        self._clock = clock
+        self._deadline = clock()  # 最初の回は作成した時点の予定とする
+
+    def wait(self, period=None):
+        """
+        次の予定時刻まで待つ
+
+        :param period: 今回からの周期（秒）、Noneなら前回と同じ
+        :return: (予定時刻からの遅れ（秒）, 飛ばした回数)
+        """
+        if period is not None:
+            self.period = period
+        period = max(self.period, 1e-3)
+        deadline = self._deadline + period
+        late = self._clock() - deadline
+        skipped = 0
+        if late > 0:
+            if self.policy == "skip" or late > self.max_late_seconds:
+                # 刻みはそのままに、間に合わなかった回を飛ばす
+                skipped = int(late // period)
+                deadline += skipped * period
+        else:
+            self._sleep(-late)
+        self._deadline = deadline
+        lateness = max(0.0, self._clock() - deadline)
+        self.stats.record(lateness, skipped)
+        return lateness, skipped
@@ -1,49 +1,371 @@
-import cv2
-import numpy as np
 from datetime import datetime
 import time
-import subprocess
-import shlex
 import threading
-from utils.image_processing import generate_image
-from utils.config import load_settings
-from utils.youtube import create_youtube_live, stop_youtube_live
-from utils.tweet import tweet_stream_info
+import cv2
+import numpy as np
+from utils.compositor import LayerCache
+from utils.image_processing import CanvasPool, generate_frame
+from utils.frame_buffer import FrameHandoff
+from utils.preview import FramePreview
+from utils.ffmpeg import build_ffmpeg_command, build_output_args, fatal_output_patterns, ingest_rate, output_targets
+from utils.ffmpeg_supervisor import FFmpegSupervisor
+from utils.frame_writer import FrameWriter
+from utils.scheduler import TickScheduler, TickStats, scheduler_settings
+from utils.quality import AdaptiveQualityController, quality_settings
+from utils.motion import MotionGate, motion_settings, sample_camera
+from utils.config import (
+    DEFAULT_STREAM_ID,
+    stream_settings,
+    subscribe_settings,
+    tweet_enabled,
+    unsubscribe_settings,
+    youtube_enabled,
+)
+from utils.camera import DEFAULT_CAMERA_INDEX, camera_session_from_settings, release_camera_session
+from utils.archive import FrameArchive, archive_settings
+from utils.render_worker import HEARTBEAT_TIMEOUT, RenderProcess
+from utils.stream_state import CONNECTING, CREATING, ERROR, IDLE, LIVE, STOPPING, stream_states
+from utils.metrics import (
+    CAPTURE_INTERVAL_SECONDS,
+    CAPTURE_SECONDS,
+    CHANGE_SCORE,
+    DROPPED_FRAMES,
+    DUPLICATED_FRAMES,
+    ENCODER_BITRATE_KBPS,
+    ENCODER_DROP_FRAMES,
+    ENCODER_DUP_FRAMES,
+    ENCODER_FPS,
+    ENCODER_SPEED,
+    FFMPEG_UPTIME_SECONDS,
+    FRAME_AGE_SECONDS,
+    OUTPUT_FRAMES,
+    PIPE_WRITE_SECONDS,
+    QUALITY_LEVEL,
+    RENDER_SECONDS,
+    RENDER_STAGE_SECONDS,
+    SKIPPED_RENDERS,
+    STREAMING,
+)
+
+# 品質の段階を見直す間隔（秒）
+QUALITY_CHECK_INTERVAL = 5
+
+# 描画プロセスを起動し直すまでの待ち時間の上限（秒）
+RENDER_PROCESS_MAX_BACKOFF = 30
 
 class LiveStreamer:
-    def __init__(self):
+    def __init__(self, stream_id=DEFAULT_STREAM_ID):
+        self.stream_id = stream_id
         self.latest_frame = None
         self.frame_lock = threading.Lock()
+        self.frame_handoff = FrameHandoff()
+        self.canvas_pool = CanvasPool()  # 公開したフレームを他の配信の描画で上書きしないよう配信ごとに持つ
+        self.layers = LayerCache()  # 解像度やテキストの異なる配信どうしでレイヤーのキャッシュを奪い合わないようにする
+        self.preview = FramePreview(self.frame_handoff)
         self.image_thread = None
-        self.ffmpeg_process = None
+        self.render_process = None
+        self.archive = None
+        self.ffmpeg = None
+        self.writer = None
+        self._last_written_seq = None
+        self.quality = None
+        self.quality_overrides = {}  # 負荷に応じて下げた解像度・FPS・プロファイル
+        self._resized = None
+        self.motion = None
+        self.capture_stats = TickStats(stream_id, "capture")
+        self.output_stats = TickStats(stream_id, "output")
         self._is_running = False
         self.youtube_broadcast_id = None # broadcast IDを保存する変数
+        settings = self.settings()
+        self.interval = settings.get("interval")
+        self.write_stall_seconds = settings.get("write_stall_seconds", 0.5)
+
+    def set_state(self, state, **details):
+        # 画面に配信する状態を更新する
+        stream_states.set(self.stream_id, state, **details)
+
+    def settings(self):
+        # 共通の設定にこの配信の設定を上書きしたもの（品質を下げている場合はさらにその値を上書き）
+        return {**stream_settings(self.stream_id), **self.quality_overrides}
+
+    def on_settings_changed(self, settings):
+        # 配信中に変更されたインターバルを次の撮影から反映する
+        self.interval = stream_settings(self.stream_id, settings).get("interval", self.interval)
+        # 表示内容が変わった可能性があるので、シーンが静止していても次は描画する
+        if self.motion:
+            self.motion.invalidate(self.interval)
+        if self.render_process:
+            self.render_process.invalidate(self.interval)
+
+    def change_score(self, settings):
+        """
+        カメラの最新フレームを前回描画したときと比べ、(変化量またはNone, 描画する必要があればTrue) を返す
+        """
+        try:
+            return self.motion.check(sample_camera(settings))
+        except Exception as e:
+            print(f"エラー: シーンの変化量の計算中にエラーが発生しました: {e}")
+            return None, True
 
     def generate_image_loop(self, start_time):
-        settings = load_settings()
-        interval = settings.get("interval")
+        config = scheduler_settings(self.settings())
+        # 撮影の周期は描画にかかった時間を含めて、前回の予定時刻から数える
+        schedule = TickScheduler(
+            self.interval,
+            policy=config["capture_policy"],
+            max_late_seconds=config["max_late_seconds"],
+            stats=self.capture_stats,
+        )
         while self._is_running:
-            canvas = generate_image(start_time=start_time)
-            if canvas:
-                frame_rgb = np.array(canvas, dtype=np.uint8)
-                with self.frame_lock:
-                    self.latest_frame = frame_rgb
-            time.sleep(interval)
+            report = {"score": None, "skipped": False, "timings": {}, "render_seconds": None, "interval": None}
+            settings = self.settings()
+            needs_render = True
+            if self.motion:
+                report["score"], needs_render = self.change_score(settings)
+            if needs_render:
+                render_start = time.perf_counter()
+                try:
+                    canvas = generate_frame(
+                        start_time=start_time,
+                        settings=settings,
+                        timings=report["timings"],
+                        canvas_pool=self.canvas_pool,
+                        layers=self.layers,
+                    )
+                except Exception as e:
+                    print(f"エラー: 画像の生成中にエラーが発生しました: {e}")
+                    canvas = None
+                report["render_seconds"] = time.perf_counter() - render_start
+                if canvas is not None:
+                    # ffmpegへ書き込める形への変換はフレームごとに1度だけ行う
+                    frame_rgb = self.frame_handoff.publish(canvas)
+                    self.frame_rendered(frame_rgb)
+                    if self.motion:
+                        self.motion.rendered()
+            else:
+                # シーンが変わっていないので、前回のフレームをそのまま使い続ける
+                report["skipped"] = True
+            if self.motion:
+                report["interval"] = self.motion.next_interval(report["score"])
+            self.record_render(report)
+            schedule.wait(report["interval"] or self.interval)
 
-    def stream_to_ffmpeg(self):
-        settings = load_settings()
-        resolution = settings.get("resolution")
-        fps = settings.get("fps")
+    def watch_render_process(self):
+        """
+        描画プロセスの報告をメトリクスに記録し、新しいフレームをアーカイブする
 
+        プロセスが落ちたり生存確認が途絶えたりした場合は、待ち時間を伸ばしながら起動し直す
+        """
+        last_seq = 0
+        backoff = 1
+        healthy_since = time.monotonic()
+        while self._is_running:
+            for report in self.render_process.drain_stats(timeout=0.5):
+                self.record_render(report)
+            # 共有メモリの枠はフレームごとに1度だけコピーされているので、そのまま保持できる
+            seq, frame, _view, _published_at = self.frame_handoff.latest()
+            if frame is not None and seq != last_seq:
+                last_seq = seq
+                self.frame_rendered(frame)
+
+            alive = self.render_process.is_alive()
+            if alive and self.render_process.heartbeat_age() <= HEARTBEAT_TIMEOUT:
+                if time.monotonic() - healthy_since >= 60:
+                    backoff = 1
+                continue
+            reason = "終了しました" if not alive else f"{HEARTBEAT_TIMEOUT}秒以上応答しません"
+            print(f"[{self.stream_id}] 警告: 描画プロセスが{reason}。{backoff}秒後に起動し直します。")
+            time.sleep(backoff)
+            if not self._is_running:
+                break
+            backoff = min(backoff * 2, RENDER_PROCESS_MAX_BACKOFF)
+            self.render_process.restart()
+            healthy_since = time.monotonic()
+
+    def frame_rendered(self, frame_rgb):
+        with self.frame_lock:
+            self.latest_frame = frame_rgb
+        self.archive_frame(frame_rgb)
+
+    def record_render(self, report):
+        """
+        1回分の撮影の結果（描画または省略）をメトリクスに記録する
+        """
+        if report["score"] is not None:
+            CHANGE_SCORE.set(report["score"], stream=self.stream_id)
+        if report["skipped"]:
+            SKIPPED_RENDERS.inc(stream=self.stream_id)
+        if report["render_seconds"] is not None:
+            RENDER_SECONDS.observe(report["render_seconds"], stream=self.stream_id)
+        for stage, seconds in report["timings"].items():
+            if stage == "capture":
+                CAPTURE_SECONDS.observe(seconds, stream=self.stream_id)
+            else:
+                RENDER_STAGE_SECONDS.observe(seconds, stream=self.stream_id, stage=stage)
+        if report["interval"] is not None:
+            CAPTURE_INTERVAL_SECONDS.set(report["interval"], stream=self.stream_id)
+        if report.get("lateness") is not None:
+            # 描画プロセスの撮影の予定時刻からの遅れ
+            self.capture_stats.record(report["lateness"], report["skipped_ticks"])
+
+    def archive_frame(self, frame_rgb):
+        if self.archive is None:
+            return
+        settings = self.settings()
+        try:
+            if archive_settings(settings)["source"] == "raw" and not self.render_process:
+                # カメラセッションが保持している最新フレームをそのまま保存する
+                # （描画と同じ取得設定で取得し、セッションを開き直さない）
+                raw_frame = camera_session_from_settings(settings).get_frame()
+                if raw_frame is not None:
+                    self.archive.append(raw_frame, is_rgb=False)
+            else:
+                self.archive.append(frame_rgb)
+        except Exception as e:
+            print(f"エラー: フレームのアーカイブ中にエラーが発生しました: {e}")
+
+    def stream_to_ffmpeg(self):
+        settings = self.settings()
         youtube_settings = settings.get("youtube")
         title = youtube_settings["title"]
         description = youtube_settings["description"]
         privacy = youtube_settings["privacy"]
-        rtmp_url, youtube_watch_url, self.youtube_broadcast_id = create_youtube_live( # broadcast IDを受け取る
-            title=title,
-            description=description,
-            privacy=privacy
+        ingest = None
+        rtmp_url = youtube_watch_url = None
+        try:
+            if youtube_enabled(settings):
+                # YouTube APIのライブラリは読み込みに時間がかかるので、使う場合だけ読み込む
+                from utils.youtube import create_youtube_live, persistent_ingest
+
+                ingest = persistent_ingest(self.stream_id, youtube_settings)
+                if ingest:
+                    # 受信URLは固定なので、ライブ配信の紐付けを待たずにffmpegを接続できる
+                    rtmp_url = ingest.ingest_url(title)
+                else:
+                    rtmp_url, youtube_watch_url, self.youtube_broadcast_id = create_youtube_live( # broadcast IDを受け取る
+                        title=title,
+                        description=description,
+                        privacy=privacy
+                    )
+                    self.announce(settings, youtube_watch_url)
+        except Exception as e:
+            print(f"エラー: YouTubeライブ配信の作成中にエラーが発生しました: {e}")
+            self.stop_streaming(error=f"YouTubeライブ配信を作成できませんでした: {e}")
+            return
+
+        # YouTubeと設定に書かれた全ての配信先に1回のエンコード結果を送る
+        targets = output_targets(settings, rtmp_url)
+        if not targets:
+            print("エラー: 配信先がありません。youtube.enabledを有効にするか、outputsを設定してください。")
+            self.stop_streaming(error="配信先がありません")
+            return
+        # 再起動のたびに出力引数を組み立て直す（同じ受信URL、ファイルは新しい名前になる）
+        self.ffmpeg = FFmpegSupervisor.from_settings(
+            lambda: build_ffmpeg_command(self.output_settings(settings), build_output_args(targets)),
+            settings,
+            self.stream_id,
+            # YouTubeへの送信が失敗したらffmpegごと起動し直す（予備の配信先だけで動き続けないようにする）
+            fatal_patterns=fatal_output_patterns(targets),
+        )
+
+        try:
+            self.ffmpeg.start()
+            if ingest:
+                _rtmp_url, youtube_watch_url, self.youtube_broadcast_id = ingest.start(title, description, privacy)
+                self.announce(settings, youtube_watch_url)
+            self.set_state(CONNECTING, watch_url=youtube_watch_url)
+            print(f"[{self.stream_id}] 配信を開始しました: {rtmp_url} (YouTube Broadcast ID: {self.youtube_broadcast_id})")
+
+            # パイプへの書き込みは専用のスレッドで行い、このループは書き込みを待たない
+            self.writer = FrameWriter(
+                self.ffmpeg.write,
+                on_written=self.record_write,
+                name=self.stream_id,
+                maxsize=settings.get("write_queue_size", 2),
+                policy=settings.get("write_queue_policy", "duplicate"),
+                stall_seconds=self.write_stall_seconds,
+                max_owed=max(1, round(ingest_rate(self.output_settings(settings)))),  # 最大1秒分まで書き込み直す
+            )
+            self._last_written_seq = None
+            connected = False
+            next_quality_check = time.monotonic() + QUALITY_CHECK_INTERVAL
+            config = scheduler_settings(settings)
+            schedule = TickScheduler(
+                1.0 / ingest_rate(self.output_settings(settings)),
+                policy=config["output_policy"],
+                max_late_seconds=config["max_late_seconds"],
+                stats=self.output_stats,
+            )
+            while self._is_running and not self.ffmpeg.failed:
+                output_settings = self.output_settings(settings)
+                write_interval = 1.0 / ingest_rate(output_settings)
+                seq, frame, frame_view, published_at = self.frame_handoff.latest()
+                if frame is not None:
+                    frame_view = self.fit_output_size(seq, frame, frame_view, output_settings["resolution"])
+                if frame_view is not None:
+                    # 変換済みバッファのmemoryviewをそのまま書き込み待ちのキューに入れる
+                    self.writer.offer(seq, frame_view, published_at, write_interval)
+                if self.writer.connected != connected:
+                    # 再起動を待つ間も最新のフレームは入れ続け、再起動後すぐに書き込む
+                    connected = self.writer.connected
+                    self.set_state(LIVE if connected else CONNECTING)
+                if self.quality and time.monotonic() >= next_quality_check:
+                    next_quality_check = time.monotonic() + QUALITY_CHECK_INTERVAL
+                    self.adjust_quality(self.writer.write_load)
+                schedule.wait(write_interval) # 入力レートの予定時刻まで待機
+
+            if self.ffmpeg.failed and self._is_running:
+                self.stop_streaming(error=self.ffmpeg.failed)
+
+        except FileNotFoundError:
+            print("エラー: ffmpegが見つかりません。インストールされていることを確認してください。")
+            self.stop_streaming(error="ffmpegが見つかりません")
+        except Exception as e:
+            print(f"エラー: ffmpegの起動またはストリーミング中にエラーが発生しました: {e}")
+            self.stop_streaming(error=f"ffmpegの起動またはストリーミング中にエラーが発生しました: {e}")
+
+    def output_settings(self, settings):
+        # ffmpegに渡す設定（品質を下げている場合はその値を上書き）
+        return {**settings, **self.quality_overrides}
+
+    def fit_output_size(self, seq, frame, frame_view, resolution):
+        """
+        品質の段階を変えた直後は描画が前の解像度のままなので、出力の解像度に縮小して返す
+
+        縮小は同じフレームにつき1度だけ行う
+        """
+        width, height = map(int, resolution.split("x"))
+        if frame.shape[1] == width and frame.shape[0] == height:
+            return frame_view
+        if self._resized is None or self._resized[0] != seq or self._resized[1] != resolution:
+            resized = np.ascontiguousarray(cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA))
+            self.frame_handoff.count_copied(resized.nbytes)
+            self._resized = (seq, resolution, memoryview(resized).cast("B"))
+        return self._resized[2]
+
+    def adjust_quality(self, write_load):
+        """
+        エンコード速度と書き込みの負荷から品質の段階を見直し、変わった場合はffmpegを起動し直す
+        """
+        speed = self.ffmpeg.stats().get("speed")
+        if not self.quality.update(speed, write_load):
+            return
+        self.quality_overrides = self.quality.overrides()
+        if self.render_process:
+            self.render_process.set_overrides(self.quality_overrides)
+        QUALITY_LEVEL.set(self.quality.level, stream=self.stream_id)
+        print(
+            f"[{self.stream_id}] 出力の品質を段階{self.quality.level}に変更します "
+            f"(速度: {speed:.2f}x, 書き込みの割合: {write_load:.2f}): {self.quality_overrides or '設定どおり'}"
         )
+        self.ffmpeg.restart()
+
+    def announce(self, settings, youtube_watch_url):
+        if not tweet_enabled(settings):
+            return
+        # tweepyは投稿する場合だけ読み込む
+        from utils.tweet import tweet_stream_info
+
         tweet_stream_info(
             contents={
                 "comment": settings["youtube"].get("title", "配信開始しました！"),
@@ -51,59 +373,131 @@ class LiveStreamer:
             }
         )
 
-        command = shlex.split(
-            f"ffmpeg -y -f rawvideo -vcodec rawvideo -pix_fmt rgb24 -s {resolution} -r {fps} -i - "
-            f"-f lavfi -i anullsrc=channel_layout=stereo:sample_rate=44100 "
-            f"-b:v 2500k -maxrate 3000k -bufsize 5000k -c:a aac -b:a 96k -ac 2 -ar 44100 "
-            f"-map 0:v -map 1:a -f flv {rtmp_url}"
-        )
+    def record_write(self, seq, nbytes, published_at, write_start, write_seconds):
+        # 書き込み用のスレッドから、ffmpegに書き込めたフレームごとに呼ばれる
+        self.frame_handoff.count_copied(nbytes)
+        OUTPUT_FRAMES.inc(stream=self.stream_id)
+        PIPE_WRITE_SECONDS.observe(write_seconds, stream=self.stream_id)
+        FRAME_AGE_SECONDS.observe(write_start - published_at, stream=self.stream_id)
+        last_seq = self._last_written_seq
+        if last_seq is not None:
+            if seq == last_seq:
+                DUPLICATED_FRAMES.inc(stream=self.stream_id)
+            elif seq > last_seq + 1:
+                DROPPED_FRAMES.inc(seq - last_seq - 1, stream=self.stream_id)
+        self._last_written_seq = seq
 
-        try:
-            self.ffmpeg_process = subprocess.Popen(command, stdin=subprocess.PIPE)
-            print(f"配信を開始しました: {rtmp_url} (YouTube Broadcast ID: {self.youtube_broadcast_id})")
-
-            while self._is_running and self.ffmpeg_process.poll() is None:
-                with self.frame_lock:
-                    frame_to_send = self.latest_frame
-                if frame_to_send is not None:
-                    frame_bgr = cv2.cvtColor(frame_to_send, cv2.COLOR_RGB2BGR)
-                    try:
-                        self.ffmpeg_process.stdin.write(frame_bgr.tobytes())
-                        self.ffmpeg_process.stdin.flush()
-                    except BrokenPipeError:
-                        print("エラー: ffmpegパイプが閉じられました。配信を終了します。")
-                        self.stop_streaming()
-                        break
-                time.sleep(1.0 / fps) # FPSに合わせて待機
-
-            if self.ffmpeg_process and self.ffmpeg_process.returncode is not None:
-                print(f"ffmpegプロセスが終了しました (終了コード: {self.ffmpeg_process.returncode})。")
+    def update_metrics(self):
+        """
+        スクレイプ時点の値で配信状態のゲージを更新する
+        """
+        STREAMING.set(1 if self._is_running else 0, stream=self.stream_id)
+        stats = self.encoder_stats()
+        FFMPEG_UPTIME_SECONDS.set(stats.get("uptime_seconds", 0), stream=self.stream_id)
+        ENCODER_FPS.set(stats.get("fps", 0), stream=self.stream_id)
+        ENCODER_SPEED.set(stats.get("speed", 0), stream=self.stream_id)
+        ENCODER_BITRATE_KBPS.set(stats.get("bitrate_kbps", 0), stream=self.stream_id)
+        ENCODER_DUP_FRAMES.set(stats.get("dup_frames", 0), stream=self.stream_id)
+        ENCODER_DROP_FRAMES.set(stats.get("drop_frames", 0), stream=self.stream_id)
 
-        except FileNotFoundError:
-            print("エラー: ffmpegが見つかりません。インストールされていることを確認してください。")
-            self.stop_streaming()
-        except Exception as e:
-            print(f"エラー: ffmpegの起動またはストリーミング中にエラーが発生しました: {e}")
-            self.stop_streaming()
+    def encoder_stats(self):
+        """
+        ffmpegが報告したエンコードの状態（FPS・ビットレート・速度・複製/破棄フレーム数・再起動回数など）を返す
+        """
+        if self.ffmpeg is None:
+            return {"running": False}
+        return self.ffmpeg.stats()
+
+    def status(self):
+        """
+        配信の状態を返す
+        """
+        settings = self.settings()
+        return {
+            "stream_id": self.stream_id,
+            "running": self._is_running,
+            **stream_states.get(self.stream_id),
+            "camera_index": settings.get("camera_index", DEFAULT_CAMERA_INDEX),
+            "resolution": settings.get("resolution"),
+            "broadcast_id": self.youtube_broadcast_id,
+            "ffmpeg_running": bool(self.ffmpeg and self.ffmpeg.is_alive()),
+            "encoder": self.encoder_stats(),
+            "quality_level": self.quality.level if self.quality else 0,
+            "quality_overrides": dict(self.quality_overrides),
+            "writer": self.writer_stats(),
+            "schedule": {"capture": self.capture_stats.snapshot(), "output": self.output_stats.snapshot()},
+        }
+
+    def writer_stats(self):
+        """
+        書き込み用のスレッドの状態（キューが満杯で捨てた・書き込み直したフレーム数、停滞の回数）を返す
+        """
+        if self.writer is None:
+            return {}
+        return {
+            "dropped": self.writer.dropped,
+            "repeated": self.writer.repeated,
+            "stalls": self.writer.stalls,
+            "write_load": self.writer.write_load,
+        }
+
+    def frame_stats(self):
+        """
+        フレームの受け渡しでコピーしたバイト数の累計を返す
+        """
+        return {"bytes_copied": self.frame_handoff.bytes_copied}
 
     def start_streaming(self):
         if not self._is_running:
             self._is_running = True
+            self.set_state(CREATING)
+            subscribe_settings(self.on_settings_changed)
+            self.quality_overrides = {}
+            self.capture_stats = TickStats(self.stream_id, "capture")
+            self.output_stats = TickStats(self.stream_id, "output")
+            settings = self.settings()
+            # 負荷に応じて出力の品質を上げ下げする
+            self.quality = (
+                AdaptiveQualityController.from_settings(settings) if quality_settings(settings)["enabled"] else None
+            )
+            QUALITY_LEVEL.set(0, stream=self.stream_id)
+            if archive_settings(settings)["enabled"]:
+                self.archive = FrameArchive.from_settings(settings, self.stream_id)
             start_time = datetime.now()
-            self.image_thread = threading.Thread(target=self.generate_image_loop, args=(start_time,), daemon=True)
+            if settings.get("render_process", False):
+                # カメラ取得と描画を専用のプロセスで行い、フレームは共有メモリで受け取る
+                self.render_process = RenderProcess(self.stream_id, settings.get("resolution", "1280x720"), start_time)
+                self.frame_handoff = self.render_process.frames
+                self.preview = FramePreview(self.frame_handoff)
+                self.render_process.start()
+                self.image_thread = threading.Thread(target=self.watch_render_process, daemon=True)
+            else:
+                self.frame_handoff = FrameHandoff()
+                self.preview = FramePreview(self.frame_handoff)
+                # シーンの変化量に応じて撮影のインターバルを変え、変化がなければ描画を省略する
+                self.motion = MotionGate(settings) if motion_settings(settings)["enabled"] else None
+                self.image_thread = threading.Thread(target=self.generate_image_loop, args=(start_time,), daemon=True)
             self.image_thread.start()
             threading.Thread(target=self.stream_to_ffmpeg, daemon=True).start()
-            print("配信処理を開始しました。")
+            print(f"[{self.stream_id}] 配信処理を開始しました。")
         else:
             print("配信はすでに開始されています。")
 
-    def stop_streaming(self):
+    def stop_streaming(self, error=None):
+        """
+        :param error: エラーで停止する場合はその内容。画面にerror状態として表示する
+        """
         if self._is_running:
             self._is_running = False
+            unsubscribe_settings(self.on_settings_changed)
+            self.set_state(STOPPING)
+            self.preview.close()
             print("配信を停止します...")
 
             # YouTubeライブ配信を停止
             if self.youtube_broadcast_id:
+                from utils.youtube import stop_youtube_live
+
                 stop_youtube_live(self.youtube_broadcast_id)
                 self.youtube_broadcast_id = None
 
@@ -112,19 +506,31 @@ class LiveStreamer:
                 self.image_thread.join(timeout=5)
                 print("画像生成スレッドを停止しました。")
 
-            # FFmpegプロセスの終了
-            if self.ffmpeg_process and self.ffmpeg_process.poll() is None:
+            if self.archive:
+                self.archive.close()
+                self.archive = None
+
+            # Webカメラセッションの解放（この配信のカメラだけ）
+            if self.render_process:
+                self.render_process.close()
+                self.render_process = None
+            else:
+                release_camera_session(self.settings().get("camera_index", DEFAULT_CAMERA_INDEX))
+
+            # 書き込み待ちのフレームを捨てる。パイプが詰まっていても待ち続けない
+            if self.writer:
+                self.writer.close()
+
+            # FFmpegプロセスの終了（監視による再起動も止める）
+            if self.ffmpeg:
                 print("ffmpegプロセスに終了シグナルを送信します...")
-                self.ffmpeg_process.terminate()
-                try:
-                    self.ffmpeg_process.wait(timeout=5)
-                except subprocess.TimeoutExpired:
-                    print("警告: ffmpegプロセスが時間内に終了しませんでした。強制終了します。")
-                    self.ffmpeg_process.kill()
+                self.ffmpeg.stop()
                 print("ffmpegプロセスを終了しました。")
-            elif self.ffmpeg_process:
-                print("ffmpegプロセスはすでに終了しています。")
 
+            if error:
+                self.set_state(ERROR, error=error)
+            else:
+                self.set_state(IDLE)
             print("配信を完全に停止しました。")
         else:
             print("配信は現在実行されていません。")
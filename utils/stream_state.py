@@ -0,0 +1,81 @@
+import json
+import threading
+import time
+
+# 配信の状態
+IDLE = "idle"  # 停止中
+CREATING = "creating"  # YouTubeのライブ配信を作成中
+CONNECTING = "connecting"  # ffmpegを起動し、最初のフレームを送信中
+LIVE = "live"  # 配信中
+ERROR = "error"  # エラーで停止した
+STOPPING = "stopping"  # 停止処理中
+
+STATES = (IDLE, CREATING, CONNECTING, LIVE, ERROR, STOPPING)
+ACTIVE_STATES = (CREATING, CONNECTING, LIVE, STOPPING)
+
+
+class StreamStateBroadcaster:
+    """
+    全ての配信の状態を保持し、変更をServer-Sent Eventsの購読者に配信する
+
+    状態が変わったときだけイベントの本文を1度だけ組み立て、購読者はConditionで
+    変更を待つので、閲覧している画面の数が増えてもポーリングや再計算は発生しない。
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._states = {}
+        self._version = 0
+        self._payload = self._encode()
+
+    def set(self, stream_id, state, **details):
+        """
+        配信の状態を変更する
+
+        :param state: STATESのいずれか
+        :param details: 共有URLやエラーの内容など、画面に表示する追加の情報
+        """
+        if state not in STATES:
+            raise ValueError(f"不明な状態です: {state}")
+        with self._cond:
+            previous = self._states.get(stream_id, {})
+            entry = {"state": state, "updated_at": time.time()}
+            if state not in (IDLE, CREATING):
+                # 同じ配信の間は共有URLなどを引き継ぐ
+                entry = {**{k: v for k, v in previous.items() if k != "error"}, **entry}
+            entry.update(details)
+            self._states[stream_id] = entry
+            self._version += 1
+            self._payload = self._encode()
+            self._cond.notify_all()
+
+    def get(self, stream_id):
+        with self._cond:
+            return dict(self._states.get(stream_id, {"state": IDLE}))
+
+    def snapshot(self):
+        with self._cond:
+            return self._version, {stream_id: dict(entry) for stream_id, entry in self._states.items()}
+
+    def _encode(self):
+        data = json.dumps({"version": self._version, "streams": self._states}, ensure_ascii=False)
+        return f"id: {self._version}\nevent: state\ndata: {data}\n\n".encode("utf-8")
+
+    def events(self, heartbeat=15.0):
+        """
+        現在の状態と、以降の変更をServer-Sent Eventsの形式で返し続けるジェネレーター
+
+        :param heartbeat: 変更がない場合に接続維持のコメントを送る間隔（秒）
+        """
+        with self._cond:
+            version, payload = self._version, self._payload
+        yield payload
+        while True:
+            with self._cond:
+                changed = self._cond.wait_for(lambda: self._version != version, timeout=heartbeat)
+                version, payload = self._version, self._payload
+            # 待っている間に複数回変わった場合も最新の状態だけを送る
+            yield payload if changed else b": keepalive\n\n"
+
+
+stream_states = StreamStateBroadcaster()
@@ -0,0 +1,192 @@
+import threading
+import unicodedata
+from collections import OrderedDict, namedtuple
+
+from PIL import ImageFont
+
+# 行頭に置かない約物（直前の文字と一緒に折り返す）
+NO_BREAK_BEFORE = set("、。，．,.!?！？）」』】〕〉》〟’”ー～・：；:;)]}")
+
+# 描画位置が計測済みの1行分
+# x, y: 描画領域の左上からの位置 / marker: 箇条書きの記号の中心 (x, y, 半径) またはNone
+LineBox = namedtuple("LineBox", ["text", "x", "y", "font_size", "marker"])
+
+_fonts = {}
+_fonts_lock = threading.Lock()
+
+
+def get_font(font_path, size):
+    """
+    (フォントパス, サイズ) ごとに1度だけ読み込んだフォントを返す
+    """
+    key = (font_path, int(size))
+    with _fonts_lock:
+        font = _fonts.get(key)
+        if font is None:
+            try:
+                font = ImageFont.truetype(font_path, int(size))
+            except IOError:
+                font = ImageFont.load_default()
+            _fonts[key] = font
+        return font
+
+
+class _LRUCache:
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, compute):
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                return self._items[key]
+        value = compute()
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+_bbox_cache = _LRUCache(maxsize=512)
+_layout_cache = _LRUCache(maxsize=64)
+
+
+def text_bbox(text, font_path, size):
+    """
+    textbboxの計測結果をキャッシュして返す
+    """
+    return _bbox_cache.get(
+        (text, font_path, int(size)),
+        lambda: get_font(font_path, size).getbbox(text),
+    )
+
+
+def _is_cjk(char):
+    return unicodedata.east_asian_width(char) in ("W", "F")
+
+
+def _tokenize(text):
+    # 英単語と空白はまとめ、CJK文字は1文字ずつ折り返し可能な単位に分ける
+    tokens = []
+    word = ""
+    for char in text:
+        if _is_cjk(char) or char.isspace():
+            if word:
+                tokens.append(word)
+                word = ""
+            if char in NO_BREAK_BEFORE and tokens:
+                tokens[-1] += char
+            else:
+                tokens.append(char)
+        elif char in NO_BREAK_BEFORE and not word and tokens:
+            tokens[-1] += char
+        else:
+            word += char
+    if word:
+        tokens.append(word)
+    return tokens
+
+
+def wrap_text(text, font, width):
+    """
+    幅widthに収まるようにテキストを折り返す（日本語は文字単位、英語は単語単位）
+
+    :return: 行のリスト
+    """
+    if width <= 0 or font.getlength(text) <= width:
+        return [text]
+
+    lines = []
+    line = ""
+    for token in _tokenize(text):
+        candidate = line + token
+        if font.getlength(candidate) <= width:
+            line = candidate
+            continue
+        if line.strip():
+            lines.append(line.rstrip())
+        line = token.lstrip()
+        # 1単語で幅を超える場合は文字単位で分割する
+        while line and font.getlength(line) > width:
+            cut = max(len(line) - 1, 1)
+            while cut > 1 and font.getlength(line[:cut]) > width:
+                cut -= 1
+            lines.append(line[:cut])
+            line = line[cut:]
+    if line.strip():
+        lines.append(line.rstrip())
+    return lines or [""]
+
+
+def layout_markdown(text, font_path, width, base_font_size=20, max_height=1000):
+    """
+    マークダウンを折り返して各行の描画位置を計測する
+
+    結果は (テキスト, フォント, 幅) ごとにキャッシュされるので、変わらない文章は再計測されない
+
+    :return: (LineBoxのタプル, 全体の高さ)
+    """
+    return _layout_cache.get(
+        (text, font_path, width, base_font_size, max_height),
+        lambda: _layout_markdown(text, font_path, width, base_font_size, max_height),
+    )
+
+
+def _layout_markdown(text, font_path, width, base_font_size, max_height):
+    boxes = []
+    current_y = 0
+    line_height = base_font_size * 1.2
+
+    for line in text.split("\n"):
+        if line.startswith("# "):
+            font_size = int(base_font_size * 1.5)
+            font = get_font(font_path, font_size)
+            for wrapped in wrap_text(line[2:], font, width):
+                boxes.append(LineBox(wrapped, 0, current_y, font_size, None))
+                current_y += line_height * 1.5
+        elif line.startswith("- "):
+            font_size = int(base_font_size)
+            font = get_font(font_path, font_size)
+            # 箇条書きの記号を描画
+            marker_radius = 5
+            text_x = marker_radius * 3
+            marker = (marker_radius, current_y + base_font_size // 2, marker_radius)
+            for wrapped in wrap_text(line[2:], font, width - text_x):
+                boxes.append(LineBox(wrapped, text_x, current_y, font_size, marker))
+                marker = None
+                current_y += line_height
+        elif line.startswith("* "):  # 箇条書きの別記号
+            font_size = int(base_font_size)
+            font = get_font(font_path, font_size)
+            text_x = base_font_size // 2
+            indent = font.getlength("• ")
+            wrapped_lines = wrap_text(line[2:], font, width - text_x - indent)
+            for i, wrapped in enumerate(wrapped_lines):
+                if i == 0:
+                    boxes.append(LineBox("• " + wrapped, text_x, current_y, font_size, None))
+                else:
+                    boxes.append(LineBox(wrapped, text_x + indent, current_y, font_size, None))
+                current_y += line_height
+        elif line.strip():
+            font_size = int(base_font_size)
+            font = get_font(font_path, font_size)
+            for wrapped in wrap_text(line, font, width):
+                boxes.append(LineBox(wrapped, 0, current_y, font_size, None))
+                current_y += line_height
+
+        if current_y > max_height:  # Safety break to avoid infinite loops
+            break
+    return tuple(boxes), current_y
+
+
+def clear_caches():
+    _bbox_cache.clear()
+    _layout_cache.clear()
@@ -4,14 +4,20 @@ from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from datetime import datetime, timezone
+import json
 import os
+import tempfile
+import threading
 
 SCOPES = ["https://www.googleapis.com/auth/youtube"]
+TOKEN_PATH = "token.json"
+# 使い回すライブストリームと待機中のライブ配信のIDを保存するファイル
+YOUTUBE_STATE_PATH = "youtube_state.json"
 
 def get_youtube_credentials():
     creds = None
-    if os.path.exists('token.json'):
-        creds = Credentials.from_authorized_user_file('token.json', SCOPES)
+    if os.path.exists(TOKEN_PATH):
+        creds = Credentials.from_authorized_user_file(TOKEN_PATH, SCOPES)
     if not creds or not creds.valid:
         if creds and creds.expired and creds.refresh_token:
             creds.refresh(Request())
@@ -19,50 +25,171 @@ def get_youtube_credentials():
             flow = InstalledAppFlow.from_client_secrets_file('client_secret.json', SCOPES)
             creds = flow.run_local_server(port=0, open_browser=False)
 
-        with open('token.json', 'w') as token:
+        with open(TOKEN_PATH, 'w') as token:
             token.write(creds.to_json())
     return creds
 
-def create_youtube_live(title: str, description: str = "", privacy: str = "unlisted") -> tuple:
+def _rtmp_url(stream):
+    # RTMP URL取得
+    ingestion_info = stream['cdn']['ingestionInfo']
+    return f"{ingestion_info['ingestionAddress']}/{ingestion_info['streamName']}"
+
+
+def watch_url(broadcast_id: str) -> str:
+    # YouTubeの共有URL
+    return f"https://www.youtube.com/watch?v={broadcast_id}"
+
+
+class YouTubeClient:
     """
-    YouTubeライブ配信を作成し、RTMP URL、共有URL、broadcast IDを返す
+    認証済みのYouTube APIクライアントを使い回すための長寿命のクライアント
 
-    :param title: 配信タイトル
-    :param description: 概要欄（説明文）
-    :param privacy: 公開範囲 ("public" / "unlisted" / "private")
-    :param scheduled_start_time: 予約開始時間 (ISO8601形式, UTC), Noneなら即時配信
-    :return: (rtmp_url, youtube_watch_url, broadcast_id)
+    - APIの定義（discovery document）は通信せずにgoogle-api-python-clientに同梱のものを読み込む
+    - 認証情報は有効期限が近づくとバックグラウンドで更新する
+    - 認証済みのHTTPセッションを全ての呼び出しで共有する
+
+    :param service: APIのリソース。省略時は認証情報から作成する（FakeYouTubeServiceも渡せる）
+    :param refresh_margin: 有効期限の何秒前に認証情報を更新するか
     """
-    credentials = get_youtube_credentials()
-    youtube = build('youtube', 'v3', credentials=credentials)
-
-    # ライブ配信作成
-    broadcast_body = {
-        "snippet": {
-            "title": title,
-            "description": description,
-            "scheduledStartTime": datetime.now(timezone.utc).replace(microsecond=0).isoformat()
-        },
-        "status": {
-            "privacyStatus": privacy
-        },
-        "contentDetails": {
-            "enableAutoStart": True,
-            "enableAutoStop": True
+
+    def __init__(self, service=None, credentials=None, refresh_margin=300):
+        self.refresh_margin = refresh_margin
+        self._credentials = credentials
+        self._service = service
+        # httplib2のセッションはスレッドセーフではないので呼び出しを直列化する
+        self._lock = threading.RLock()
+        self._refresh_thread = None
+        self._stop_event = threading.Event()
+
+    @property
+    def service(self):
+        with self._lock:
+            if self._service is None:
+                self._service = self._build_service()
+            return self._service
+
+    def _build_service(self):
+        import httplib2
+        from google_auth_httplib2 import AuthorizedHttp
+
+        if self._credentials is None:
+            self._credentials = get_youtube_credentials()
+        http = AuthorizedHttp(self._credentials, http=httplib2.Http(timeout=30))
+        # static_discovery=Trueでgoogle-api-python-clientに同梱されている定義を使う（通信しない）
+        return build("youtube", "v3", http=http, static_discovery=True, cache_discovery=False)
+
+    def start_background_refresh(self):
+        """
+        有効期限が近づいた認証情報をバックグラウンドで更新するスレッドを開始する
+        """
+        if self._refresh_thread and self._refresh_thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._refresh_thread = threading.Thread(target=self._refresh_loop, daemon=True)
+        self._refresh_thread.start()
+
+    def stop_background_refresh(self):
+        self._stop_event.set()
+
+    def _refresh_loop(self):
+        while not self._stop_event.is_set():
+            wait = 60
+            credentials = self._credentials
+            if credentials is not None and getattr(credentials, "expiry", None):
+                if not credentials.refresh_token:
+                    print("警告: YouTubeの認証情報に更新用のトークンがないため、バックグラウンドでの更新を停止します。")
+                    return
+                remaining = (credentials.expiry - datetime.utcnow()).total_seconds()
+                if remaining <= self.refresh_margin:
+                    # 更新後の有効期限もまだ近い場合に更新を繰り返し続けないよう、更新した後も待つ
+                    self.refresh_credentials()
+                else:
+                    wait = min(wait, remaining - self.refresh_margin)
+            self._stop_event.wait(max(wait, 1))
+
+    def refresh_credentials(self):
+        credentials = self._credentials
+        if credentials is None or not credentials.refresh_token:
+            return
+        try:
+            with self._lock:
+                credentials.refresh(Request())
+            with open(TOKEN_PATH, 'w') as token:
+                token.write(credentials.to_json())
+        except Exception as e:
+            print(f"エラー: YouTubeの認証情報の更新に失敗しました: {e}")
+            self._stop_event.wait(30)
+
+    def execute(self, request):
+        with self._lock:
+            return request.execute()
+
+    def insert_broadcast(self, title: str, description: str = "", privacy: str = "unlisted") -> str:
+        """
+        ライブ配信（broadcast）を作成し、そのIDを返す
+        """
+        # ライブ配信作成
+        broadcast_body = {
+            "snippet": {
+                "title": title,
+                "description": description,
+                "scheduledStartTime": datetime.now(timezone.utc).replace(microsecond=0).isoformat()
+            },
+            "status": {
+                "privacyStatus": privacy
+            },
+            "contentDetails": {
+                "enableAutoStart": True,
+                "enableAutoStop": True
+            }
         }
-    }
 
-    broadcast_response = youtube.liveBroadcasts().insert(
-        part="snippet,status,contentDetails",
-        body=broadcast_body
-    ).execute()
+        broadcast_response = self.execute(self.service.liveBroadcasts().insert(
+            part="snippet,status,contentDetails",
+            body=broadcast_body
+        ))
+        return broadcast_response['id']
+
+    def update_broadcast(self, broadcast_id: str, title: str, description: str = "", privacy: str = "unlisted"):
+        """
+        作成済みのライブ配信のタイトル・説明文・公開範囲を書き換える
+        """
+        self.execute(self.service.liveBroadcasts().update(
+            part="snippet,status",
+            body={
+                "id": broadcast_id,
+                "snippet": {
+                    "title": title,
+                    "description": description,
+                    "scheduledStartTime": datetime.now(timezone.utc).replace(microsecond=0).isoformat()
+                },
+                "status": {
+                    "privacyStatus": privacy
+                }
+            }
+        ))
 
-    broadcast_id = broadcast_response['id']
+    def broadcast_statuses(self, broadcast_ids) -> dict:
+        """
+        :return: {broadcast ID: lifeCycleStatus}、存在しないIDは含まれない
+        """
+        if not broadcast_ids:
+            return {}
+        response = self.execute(self.service.liveBroadcasts().list(
+            part="id,status",
+            id=",".join(broadcast_ids),
+            maxResults=50
+        ))
+        return {item["id"]: item["status"]["lifeCycleStatus"] for item in response.get("items", [])}
 
-    # ライブストリーム作成
-    stream_response = youtube.liveStreams().insert(
-        part="snippet,cdn",
-        body={
+    def insert_stream(self, title: str, reusable: bool = False) -> tuple:
+        """
+        ライブストリーム（映像の受信先）を作成する
+
+        :param reusable: Trueなら複数のライブ配信で使い回せるストリームにする
+        :return: (stream ID, RTMP URL)
+        """
+        body = {
             "snippet": {
                 "title": f"{title}"
             },
@@ -72,48 +199,282 @@ def create_youtube_live(title: str, description: str = "", privacy: str = "unlis
                 "resolution": "1080p"
             }
         }
-    ).execute()
+        part = "snippet,cdn"
+        if reusable:
+            body["contentDetails"] = {"isReusable": True}
+            part += ",contentDetails"
+        stream_response = self.execute(self.service.liveStreams().insert(part=part, body=body))
+        return stream_response['id'], _rtmp_url(stream_response)
 
-    stream_id = stream_response['id']
+    def get_stream(self, stream_id: str):
+        """
+        :return: (stream ID, RTMP URL)、ストリームが存在しない場合はNone
+        """
+        response = self.execute(self.service.liveStreams().list(part="id,cdn", id=stream_id))
+        items = response.get("items", [])
+        if not items:
+            return None
+        return items[0]['id'], _rtmp_url(items[0])
 
-    # 配信とストリームを紐付け
-    youtube.liveBroadcasts().bind(
-        part="id,contentDetails",
-        id=broadcast_id,
-        streamId=stream_id
-    ).execute()
+    def bind(self, broadcast_id: str, stream_id: str):
+        # 配信とストリームを紐付け
+        self.execute(self.service.liveBroadcasts().bind(
+            part="id,contentDetails",
+            id=broadcast_id,
+            streamId=stream_id
+        ))
 
-    # RTMP URL取得
-    ingestion_info = stream_response['cdn']['ingestionInfo']
-    rtmp_url = f"{ingestion_info['ingestionAddress']}/{ingestion_info['streamName']}"
+    def create_live(self, title: str, description: str = "", privacy: str = "unlisted") -> tuple:
+        """
+        YouTubeライブ配信を作成し、RTMP URL、共有URL、broadcast IDを返す
 
-    # YouTubeの共有URL
-    youtube_watch_url = f"https://www.youtube.com/watch?v={broadcast_id}"
+        :param title: 配信タイトル
+        :param description: 概要欄（説明文）
+        :param privacy: 公開範囲 ("public" / "unlisted" / "private")
+        :return: (rtmp_url, youtube_watch_url, broadcast_id)
+        """
+        broadcast_id = self.insert_broadcast(title, description, privacy)
+        stream_id, rtmp_url = self.insert_stream(title)
+        self.bind(broadcast_id, stream_id)
+        return rtmp_url, watch_url(broadcast_id), broadcast_id
 
-    return rtmp_url, youtube_watch_url, broadcast_id
+    def stop_live(self, broadcast_id: str):
+        """
+        指定されたbroadcast IDのYouTubeライブ配信を停止する
 
-def stop_youtube_live(broadcast_id: str):
+        :param broadcast_id: 停止するライブ配信のID
+        """
+        try:
+            self.execute(self.service.liveBroadcasts().update(
+                part="status",
+                body={
+                    "id": broadcast_id,
+                    "status": {
+                        "lifeCycleStatus": "complete"
+                    }
+                }
+            ))
+            print(f"YouTubeライブ配信 (ID: {broadcast_id}) を正常に停止しました。")
+        except Exception as e:
+            print(f"YouTubeライブ配信の停止中にエラーが発生しました: {e}")
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_youtube_client():
     """
-    指定されたbroadcast IDのYouTubeライブ配信を停止する
+    プロセス内で共有するYouTubeClientを返す
 
-    :param broadcast_id: 停止するライブ配信のID
+    設定のyoutube.fakeがtrueの場合は、通信しない偽物のAPIを使う
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            from utils.config import load_settings
+
+            youtube_settings = load_settings().get("youtube", {})
+            if youtube_settings.get("fake"):
+                from utils.youtube_fake import FakeYouTubeService
+
+                _client = YouTubeClient(service=FakeYouTubeService(youtube_settings.get("fake_latency", 0.0)))
+            else:
+                _client = YouTubeClient()
+                _client.start_background_refresh()
+        return _client
+
+
+def warm_up_youtube_client():
     """
-    credentials = get_youtube_credentials()
-    youtube = build('youtube', 'v3', credentials=credentials)
+    共有するYouTubeClientを作成してAPIのリソースまで用意し、認証情報の更新を開始する
 
+    認証情報の読み込み・更新とクライアントの作成を配信開始の処理から外すため、起動時に呼ぶ
+    """
     try:
-        youtube.liveBroadcasts().update(
-            part="status",
-            body={
-                "id": broadcast_id,
-                "status": {
-                    "lifeCycleStatus": "complete"
-                }
-            }
-        ).execute()
-        print(f"YouTubeライブ配信 (ID: {broadcast_id}) を正常に停止しました。")
+        client = get_youtube_client()
+        client.service  # 認証情報の読み込み・更新とAPIのリソースの作成
+        client.start_background_refresh()
     except Exception as e:
-        print(f"YouTubeライブ配信の停止中にエラーが発生しました: {e}")
+        print(f"警告: YouTube APIクライアントを準備できませんでした（配信開始時にもう一度試します）: {e}")
+
+
+def set_youtube_client(client):
+    """
+    共有するYouTubeClientを差し替える（オフラインでの計測や確認用）
+    """
+    global _client
+    with _client_lock:
+        _client = client
+
+
+class PersistentIngest:
+    """
+    使い回せるライブストリーム（固定の受信URL）と、事前に作成しておいたライブ配信を使う配信開始
+
+    ライブストリームのIDと待機中のライブ配信のIDは状態ファイルに保存するので、
+    再起動後も同じストリームキーで配信でき、開始時のAPI呼び出しは紐付けの1回だけになる。
+
+    :param client: YouTubeClient
+    :param key: 状態ファイル内のキー（配信ID）
+    :param pool_size: 事前に作成しておくライブ配信の数
+    :param state_path: 状態ファイルのパス、Noneなら保存しない
+    """
+
+    def __init__(self, client, key, pool_size=1, state_path=YOUTUBE_STATE_PATH):
+        self.client = client
+        self.key = key
+        self.pool_size = max(1, pool_size)
+        self.state_path = state_path
+        self._lock = threading.Lock()
+        self._state = self._load_state()
+
+    def _load_state(self):
+        state = {}
+        if self.state_path and os.path.exists(self.state_path):
+            try:
+                with open(self.state_path, "r", encoding="utf-8") as f:
+                    state = json.load(f).get(self.key, {})
+            except (OSError, ValueError) as e:
+                print(f"警告: {self.state_path} を読み込めませんでした: {e}")
+        return {"stream_id": state.get("stream_id"), "rtmp_url": state.get("rtmp_url"), "broadcasts": list(state.get("broadcasts", []))}
+
+    def _save_state(self):
+        if not self.state_path:
+            return
+        with _state_file_lock:
+            data = {}
+            if os.path.exists(self.state_path):
+                try:
+                    with open(self.state_path, "r", encoding="utf-8") as f:
+                        data = json.load(f)
+                except (OSError, ValueError):
+                    data = {}
+            data[self.key] = self._state
+            directory = os.path.dirname(os.path.abspath(self.state_path))
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".youtube_state.", suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump(data, f, indent=4, ensure_ascii=False)
+                os.replace(tmp_path, self.state_path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+
+    def ingest_url(self, title: str) -> str:
+        """
+        固定の受信URLを返す。保存済みのストリームがなければ作成する
+        """
+        with self._lock:
+            if self._state["stream_id"] is None:
+                self._state["stream_id"], self._state["rtmp_url"] = self.client.insert_stream(title, reusable=True)
+                self._save_state()
+                print(f"使い回せるライブストリームを作成しました (ID: {self._state['stream_id']})。")
+            return self._state["rtmp_url"]
+
+    def provision(self, title: str, description: str = "", privacy: str = "unlisted"):
+        """
+        保存済みのストリームと待機中のライブ配信が有効か確認し、pool_sizeまで補充する
+        """
+        with self._lock:
+            if self._state["stream_id"] is not None:
+                stream = self.client.get_stream(self._state["stream_id"])
+                if stream is None:
+                    print("保存されていたライブストリームが見つからないため作り直します。")
+                    self._state["stream_id"] = self._state["rtmp_url"] = None
+                    self._state["broadcasts"] = []
+                else:
+                    self._state["rtmp_url"] = stream[1]
+            if self._state["stream_id"] is None:
+                self._state["stream_id"], self._state["rtmp_url"] = self.client.insert_stream(title, reusable=True)
+
+            # 開始済み・終了済みのライブ配信は紐付けられないので取り除く
+            statuses = self.client.broadcast_statuses([b["id"] for b in self._state["broadcasts"]])
+            self._state["broadcasts"] = [
+                b for b in self._state["broadcasts"] if statuses.get(b["id"]) in ("created", "ready")
+            ]
+            while len(self._state["broadcasts"]) < self.pool_size:
+                broadcast_id = self.client.insert_broadcast(title, description, privacy)
+                self._state["broadcasts"].append(
+                    {"id": broadcast_id, "title": title, "description": description, "privacy": privacy}
+                )
+            self._save_state()
+
+    def start(self, title: str, description: str = "", privacy: str = "unlisted") -> tuple:
+        """
+        待機中のライブ配信を固定のストリームに紐付けて配信を開始する
+
+        :return: (rtmp_url, youtube_watch_url, broadcast_id)
+        """
+        rtmp_url = self.ingest_url(title)
+        with self._lock:
+            broadcast = self._state["broadcasts"].pop(0) if self._state["broadcasts"] else None
+            self._save_state()
+
+        if broadcast is None:
+            broadcast_id = self.client.insert_broadcast(title, description, privacy)
+        else:
+            broadcast_id = broadcast["id"]
+            if (broadcast["title"], broadcast["description"], broadcast["privacy"]) != (title, description, privacy):
+                # 作成後に設定が変わった場合だけ書き換える
+                self.client.update_broadcast(broadcast_id, title, description, privacy)
+        try:
+            self.client.bind(broadcast_id, self._state["stream_id"])
+        except Exception as e:
+            print(f"警告: 待機中のライブ配信を紐付けられませんでした。新しく作成します: {e}")
+            broadcast_id = self.client.insert_broadcast(title, description, privacy)
+            self.client.bind(broadcast_id, self._state["stream_id"])
+
+        # 次回の開始に備えて裏で補充する
+        threading.Thread(target=self._refill, args=(title, description, privacy), daemon=True).start()
+        return rtmp_url, watch_url(broadcast_id), broadcast_id
+
+    def _refill(self, title, description, privacy):
+        try:
+            self.provision(title, description, privacy)
+        except Exception as e:
+            print(f"警告: ライブ配信の事前作成に失敗しました: {e}")
+
+
+_ingests = {}
+_state_file_lock = threading.Lock()
+
+
+def persistent_ingest(key: str, youtube_settings: dict):
+    """
+    設定のyoutube.ingestが"persistent"の場合にPersistentIngestを返す（それ以外はNone）
+    """
+    if youtube_settings.get("ingest", "per_start") != "persistent":
+        return None
+    client = get_youtube_client()
+    with _client_lock:
+        ingest = _ingests.get(key)
+        if ingest is None or ingest.client is not client:
+            # 偽物のAPIを使う場合は状態をファイルに保存しない
+            state_path = None if youtube_settings.get("fake") else YOUTUBE_STATE_PATH
+            ingest = PersistentIngest(client, key, youtube_settings.get("broadcast_pool", 1), state_path)
+            _ingests[key] = ingest
+        return ingest
+
+
+def create_youtube_live(title: str, description: str = "", privacy: str = "unlisted") -> tuple:
+    """
+    YouTubeライブ配信を作成し、RTMP URL、共有URL、broadcast IDを返す
+
+    :param title: 配信タイトル
+    :param description: 概要欄（説明文）
+    :param privacy: 公開範囲 ("public" / "unlisted" / "private")
+    :return: (rtmp_url, youtube_watch_url, broadcast_id)
+    """
+    return get_youtube_client().create_live(title, description, privacy)
+
+def stop_youtube_live(broadcast_id: str):
+    """
+    指定されたbroadcast IDのYouTubeライブ配信を停止する
+
+    :param broadcast_id: 停止するライブ配信のID
+    """
+    get_youtube_client().stop_live(broadcast_id)
 
 if __name__ == '__main__':
     # テスト用
@@ -0,0 +1,143 @@
+import itertools
+import threading
+import time
+
+
+class _Request:
+    def __init__(self, handler, latency):
+        self._handler = handler
+        self._latency = latency
+
+    def execute(self):
+        if self._latency:
+            time.sleep(self._latency)
+        return self._handler()
+
+
+class FakeYouTubeService:
+    """
+    YouTube Data API v3 のライブ配信関連の呼び出しをメモリ上で再現する偽物
+
+    googleapiclientのリソースと同じ `service.liveBroadcasts().insert(...).execute()`
+    の形で呼び出せるので、YouTubeClientにそのまま渡してオフラインで動作確認や計測ができる。
+
+    :param latency: 1回のAPI呼び出しごとに待つ時間（秒）、実際の通信の遅延の代わり
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.broadcasts = {}
+        self.streams = {}
+        self.calls = []
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def _next_id(self, prefix):
+        with self._lock:
+            return f"{prefix}{next(self._ids):06d}"
+
+    def _request(self, name, handler):
+        with self._lock:
+            self.calls.append(name)
+        return _Request(handler, self.latency)
+
+    def liveBroadcasts(self):
+        return _LiveBroadcasts(self)
+
+    def liveStreams(self):
+        return _LiveStreams(self)
+
+
+class _LiveBroadcasts:
+    def __init__(self, service):
+        self._service = service
+
+    def insert(self, part, body):
+        def handler():
+            broadcast_id = self._service._next_id("fake-broadcast-")
+            broadcast = {
+                "id": broadcast_id,
+                "snippet": dict(body.get("snippet", {})),
+                "status": {**body.get("status", {}), "lifeCycleStatus": "ready"},
+                "contentDetails": dict(body.get("contentDetails", {})),
+            }
+            self._service.broadcasts[broadcast_id] = broadcast
+            return broadcast
+
+        return self._service._request("liveBroadcasts.insert", handler)
+
+    def bind(self, part, id, streamId=None):
+        def handler():
+            broadcast = self._service.broadcasts[id]
+            if broadcast["status"]["lifeCycleStatus"] not in ("created", "ready"):
+                raise RuntimeError(f"broadcast {id} cannot be bound in state {broadcast['status']['lifeCycleStatus']}")
+            if streamId not in self._service.streams:
+                raise RuntimeError(f"stream {streamId} not found")
+            broadcast["contentDetails"]["boundStreamId"] = streamId
+            return broadcast
+
+        return self._service._request("liveBroadcasts.bind", handler)
+
+    def update(self, part, body):
+        def handler():
+            broadcast = self._service.broadcasts[body["id"]]
+            broadcast["snippet"].update(body.get("snippet", {}))
+            broadcast["status"].update(body.get("status", {}))
+            return broadcast
+
+        return self._service._request("liveBroadcasts.update", handler)
+
+    def transition(self, part, id, broadcastStatus):
+        def handler():
+            broadcast = self._service.broadcasts[id]
+            broadcast["status"]["lifeCycleStatus"] = broadcastStatus
+            return broadcast
+
+        return self._service._request("liveBroadcasts.transition", handler)
+
+    def list(self, part, id=None, broadcastStatus=None, mine=None, maxResults=5):
+        def handler():
+            items = list(self._service.broadcasts.values())
+            if id:
+                ids = id.split(",")
+                items = [item for item in items if item["id"] in ids]
+            if broadcastStatus == "upcoming":
+                items = [item for item in items if item["status"]["lifeCycleStatus"] in ("created", "ready")]
+            return {"items": items[:maxResults]}
+
+        return self._service._request("liveBroadcasts.list", handler)
+
+
+class _LiveStreams:
+    def __init__(self, service):
+        self._service = service
+
+    def insert(self, part, body):
+        def handler():
+            stream_id = self._service._next_id("fake-stream-")
+            stream = {
+                "id": stream_id,
+                "snippet": dict(body.get("snippet", {})),
+                "cdn": {
+                    **body.get("cdn", {}),
+                    "ingestionInfo": {
+                        "ingestionAddress": "rtmp://127.0.0.1:19350/live",
+                        "streamName": f"key-{stream_id}",
+                    },
+                },
+                "contentDetails": dict(body.get("contentDetails", {})),
+            }
+            self._service.streams[stream_id] = stream
+            return stream
+
+        return self._service._request("liveStreams.insert", handler)
+
+    def list(self, part, id=None, mine=None, maxResults=5):
+        def handler():
+            items = list(self._service.streams.values())
+            if id:
+                ids = id.split(",")
+                items = [item for item in items if item["id"] in ids]
+            return {"items": items[:maxResults]}
+
+        return self._service._request("liveStreams.list", handler)